@@ -0,0 +1,132 @@
+import io
+import logging
+from typing import Optional
+
+ARTWORK_FORMATS = ('JPEG', 'WEBP')
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Read-only, seekable file over an existing buffer that never copies it as a whole.
+
+    io.BytesIO copies any buffer other than bytes it is created from, which for
+    artwork read into a bytearray would double its memory for the whole upload.
+    """
+    def __init__(self, buffer: bytes) -> None:
+        """
+        Wrap a buffer.
+
+        Args:
+            buffer: Any object supporting the buffer protocol, e.g. bytes, bytearray or memoryview
+        """
+        super().__init__()
+        self.view = memoryview(buffer).cast('B')
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, target: bytearray) -> int:
+        count = max(0, min(len(target), len(self.view) - self.position))
+        target[:count] = self.view[self.position:self.position + count]
+        self.position += count
+        return count
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: len(self.view)}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+
+def prepare_artwork(data: bytes, max_edge: int = 512, image_format: str = 'JPEG', quality: int = 85) -> io.BytesIO:
+    """
+    Downscale and re-encode a thumbnail before it is uploaded.
+
+    Discord never displays presence images larger than a few hundred pixels, so
+    the image is shrunk to fit within max_edge and re-encoded, which also drops
+    EXIF and other embedded metadata. This is CPU bound and meant to run in a
+    worker thread.
+
+    Args:
+        data: Raw thumbnail bytes as read from the media session, in any buffer
+        max_edge: Maximum width and height of the result in pixels
+        image_format: Output format, either 'JPEG' or 'WEBP'
+        quality: Encoder quality from 1 to 100
+
+    Returns:
+        An io.BytesIO object containing the processed image, or the original bytes if
+        they could not be decoded or re-encoding them didn't make them smaller.
+    """
+    image_format = image_format.upper()
+    if image_format not in ARTWORK_FORMATS:
+        raise ValueError(f"Unsupported artwork format '{image_format}', expected one of {ARTWORK_FORMATS}")
+
+    # Imported on first use, Pillow is a noticeable part of startup time
+    from PIL import Image
+
+    try:
+        with Image.open(BufferReader(data)) as image:
+            # Lets the JPEG decoder skip straight to a reduced scale instead of decoding full size
+            image.draft('RGB', (max_edge, max_edge))
+            original_size = image.size
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+            if image_format == 'JPEG' or image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if image_format == 'WEBP' and 'A' in image.getbands() else 'RGB')
+
+            output = io.BytesIO()
+            # No exif/icc_profile arguments, so no metadata is carried over
+            image.save(output, format=image_format, quality=quality, optimize=image_format == 'JPEG')
+    except Exception as e:
+        logging.warning(f"Failed to preprocess artwork, uploading it unchanged: {e}")
+        return io.BytesIO(data)
+
+    logging.debug(f"Prepared artwork: {original_size} -> {image.size}, {len(data)} -> {output.tell()} bytes")
+    if output.tell() >= len(data):
+        # Already small and well compressed, e.g. a low quality JPEG re-encoded at a higher quality
+        logging.debug("Prepared artwork is not smaller than the original, uploading the original")
+        return io.BytesIO(data)
+    output.seek(0)
+    return output
+
+
+def artwork_hash(data: bytes, size: int = 8) -> Optional[int]:
+    """
+    Compute a perceptual difference hash (dHash) of a thumbnail.
+
+    The image is decoded at a reduced scale, shrunk to a (size + 1) x size grayscale
+    grid, and each bit records whether a pixel is brighter than its right neighbour.
+    Re-encoded, resized or slightly retouched copies of the same cover get hashes
+    within a few bits of each other, so similar artwork is found by Hamming distance.
+    This is CPU bound and meant to run in a worker thread.
+
+    Args:
+        data: Raw thumbnail bytes as read from the media session, in any buffer
+        size: Grid size, the hash has size * size bits
+
+    Returns:
+        The hash as an integer, or None if the thumbnail could not be decoded.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(BufferReader(data)) as image:
+            image.draft('L', (size + 1, size))
+            small = image.convert('L').resize((size + 1, size), Image.BOX)
+    except Exception as e:
+        logging.warning(f"Failed to hash artwork: {e}")
+        return None
+
+    pixels = small.tobytes()
+    value = 0
+    for row in range(size):
+        for column in range(size):
+            offset = row * (size + 1) + column
+            value = value << 1 | (pixels[offset] > pixels[offset + 1])
+    return value
@@ -0,0 +1,416 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+
+def default_cache_path(name: str = "artwork_cache.json") -> Path:
+    """
+    Get the default location of a persistent artwork cache.
+
+    Args:
+        name: File name of the cache
+
+    Returns:
+        Path to the cache file under %LOCALAPPDATA%/amrp-py.
+    """
+    local_appdata = os.getenv('LOCALAPPDATA') or str(Path.home())
+    return Path(local_appdata) / "amrp-py" / name
+
+
+class ArtworkCache:
+    """
+    Content-addressed cache mapping thumbnail bytes to uploaded image links.
+
+    Entries are keyed by a hash of the raw thumbnail bytes, kept in memory in
+    least-recently-used order and mirrored to a small JSON file so uploads
+    survive restarts. Changes only mark the cache dirty; the file is rewritten by
+    flush(), periodically off the event loop, and by save() at shutdown, so a new
+    track never waits on the disk. The cache is bounded in size and entries
+    expire after a time-to-live.
+    """
+    def __init__(self, path: Optional[Path] = None, max_entries: int = 512, ttl: int = 30 * 24 * 3600) -> None:
+        """
+        Initialize the cache and load any previously persisted entries.
+
+        Args:
+            path: File used to persist the cache, or None to keep it in memory only
+            max_entries: Maximum number of entries kept before evicting the least recently used
+            ttl: Time-to-live of an entry in seconds
+        """
+        logging.info("Initializing artwork cache")
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self.dirty = False
+        # Serializes writes of the file, which flush() and save() may start from different threads
+        self.write_lock = threading.Lock()
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def key(data: bytes) -> str:
+        """
+        Compute the cache key for a thumbnail.
+
+        Args:
+            data: Raw thumbnail bytes, or any object supporting the buffer protocol
+
+        Returns:
+            Hex digest identifying the thumbnail contents.
+        """
+        return ArtworkCache.hasher(data).hexdigest()
+
+    @staticmethod
+    def hasher(data: bytes = b'') -> "hashlib.blake2b":
+        """
+        Start computing a cache key incrementally, e.g. while a thumbnail is streamed.
+
+        Args:
+            data: Initial bytes to hash
+
+        Returns:
+            Hash object whose hexdigest() is the cache key of all bytes passed to update().
+        """
+        return hashlib.blake2b(data, digest_size=16)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up the uploaded link for a thumbnail.
+
+        Args:
+            key: Cache key as returned by ArtworkCache.key()
+
+        Returns:
+            The cached link, or None if it is missing or expired.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        link, stored = entry
+        if int(time.time()) - stored > self.ttl:
+            logging.debug(f"Artwork cache entry expired: {key}")
+            del self.entries[key]
+            self.dirty = True
+            return None
+
+        self.entries.move_to_end(key)
+        return link
+
+    def put(self, key: str, link: str) -> None:
+        """
+        Store the uploaded link for a thumbnail, evicting old entries if needed.
+
+        Args:
+            key: Cache key as returned by ArtworkCache.key()
+            link: Uploaded image link
+
+        Returns:
+            None
+        """
+        self.entries[key] = (link, int(time.time()))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            evicted, _ = self.entries.popitem(last=False)
+            logging.debug(f"Evicted artwork cache entry: {evicted}")
+        self.dirty = True
+
+    def load(self) -> None:
+        """
+        Load persisted entries from disk, dropping expired ones.
+
+        Returns:
+            None
+        """
+        if self.path is None or not self.path.exists():
+            return
+
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Failed to load artwork cache, starting empty: {e}")
+            return
+
+        now = int(time.time())
+        # Entries are persisted oldest first, so insertion order restores the LRU order
+        for key, (link, timestamp) in stored.items():
+            if now - timestamp <= self.ttl:
+                self.entries[key] = (link, timestamp)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        logging.info(f"Loaded {len(self.entries)} artwork cache entries")
+
+    async def flush(self) -> None:
+        """
+        Persist the cache if it changed, writing the file on a worker thread.
+
+        The entries are copied on the calling loop's thread, so the cache can keep
+        changing while the copy is written.
+
+        Returns:
+            None
+        """
+        if not self.dirty or self.path is None:
+            return
+        self.dirty = False
+        entries = dict(self.entries)
+        await asyncio.get_running_loop().run_in_executor(None, self.write, entries)
+
+    def save(self) -> None:
+        """
+        Persist the cache if it changed, blocking until it is written. Meant for shutdown.
+
+        Returns:
+            None
+        """
+        if not self.dirty or self.path is None:
+            return
+        self.dirty = False
+        self.write(dict(self.entries))
+
+    def write(self, entries: Dict[str, Tuple[str, int]]) -> None:
+        """
+        Write entries to disk, replacing the previous file atomically.
+
+        Args:
+            entries: Entries to persist, oldest first
+
+        Returns:
+            None
+        """
+        with self.write_lock:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_suffix(".tmp")
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(entries, f, separators=(",", ":"))
+                os.replace(tmp, self.path)
+            except OSError as e:
+                logging.warning(f"Failed to save artwork cache: {e}")
+                # Retried with the next flush
+                self.dirty = True
+
+
+class SimilarArtworkIndex(ArtworkCache):
+    """
+    Persistent index of uploaded links by perceptual hash of the artwork.
+
+    The same cover reaches the application with different bytes for deluxe
+    editions, compilations or streamed and library copies, which the content
+    addressed ArtworkCache can't match. Entries are keyed by the artwork's
+    perceptual hash (artwork.artwork_hash()), and nearest() finds the closest
+    stored hash within `threshold` differing bits. The index is bounded like the
+    cache, so a lookup is a scan of at most `max_entries` XORs and popcounts over
+    hashes parsed once from their keys.
+    Hashes of nearly uniform images carry too little detail to tell covers apart
+    and are never matched or stored.
+    """
+    def __init__(self, path: Optional[Path] = None, threshold: int = 3, max_entries: int = 1024,
+                 ttl: int = 30 * 24 * 3600, bits: int = 64) -> None:
+        """
+        Initialize the index and load any previously persisted entries.
+
+        Args:
+            path: File used to persist the index, or None to keep it in memory only
+            threshold: Most differing bits for two hashes to count as the same artwork, negative to disable
+            max_entries: Maximum number of entries kept before evicting the least recently used
+            ttl: Time-to-live of an entry in seconds
+            bits: Length of the hashes
+        """
+        self.threshold = threshold
+        self.bits = bits
+        self.values: Dict[str, int] = {}
+        super().__init__(path, max_entries, ttl)
+
+    def informative(self, value: int) -> bool:
+        """
+        Check whether a hash has enough detail to be matched.
+
+        Args:
+            value: Perceptual hash
+
+        Returns:
+            False for hashes of nearly uniform images, which have almost all bits equal.
+        """
+        ones = bin(value).count('1')
+        return self.bits // 8 <= ones <= self.bits - self.bits // 8
+
+    def nearest(self, value: int) -> Optional[str]:
+        """
+        Find the link of the most similar stored artwork.
+
+        Args:
+            value: Perceptual hash of the artwork
+
+        Returns:
+            The link of the closest hash within the threshold, or None if there is none.
+        """
+        if self.threshold < 0 or not self.informative(value):
+            return None
+        if len(self.values) > 2 * self.max_entries:
+            # Drop the parsed hashes of evicted and expired entries
+            self.values = {key: self.values[key] for key in self.entries if key in self.values}
+        best, best_distance = None, self.threshold + 1
+        for key in self.entries:
+            stored = self.values.get(key)
+            if stored is None:
+                stored = self.values[key] = int(key, 16)
+            distance = bin(stored ^ value).count('1')
+            if distance < best_distance:
+                best, best_distance = key, distance
+        if best is None:
+            return None
+        logging.debug(f"Similar artwork {best} is {best_distance} bits from {value:016x}")
+        return self.get(best)
+
+    def add(self, value: int, link: str) -> None:
+        """
+        Store the uploaded link for an artwork's perceptual hash.
+
+        Args:
+            value: Perceptual hash of the artwork
+            link: Uploaded image link
+
+        Returns:
+            None
+        """
+        if self.threshold < 0 or not self.informative(value):
+            return
+        self.put(f"{value:0{self.bits // 4}x}", link)
+
+
+class AlbumIndex:
+    """
+    In-memory index mapping an (artist, album) pair to its resolved image link.
+
+    Tracks of the same album share their artwork, so a hit lets a new track reuse
+    the link without reading the thumbnail stream at all. Each entry remembers the
+    content key of the thumbnail it was resolved from. The first hit on an entry
+    is checked against the hitting track's thumbnail in the background, and the
+    entry is invalidated if the image differs, so an album whose tracks don't share
+    their artwork only skips reading once. The index is bounded in size with LRU
+    eviction.
+    """
+    def __init__(self, max_entries: int = 256) -> None:
+        """
+        Initialize an empty index.
+
+        Args:
+            max_entries: Maximum number of albums kept before evicting the least recently used
+        """
+        logging.info("Initializing album artwork index")
+        self.max_entries = max_entries
+        # (link, content key, whether a hit was checked against its thumbnail)
+        self.entries: "OrderedDict[Tuple[str, str], Tuple[str, str, bool]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def key(artist: Optional[str], album: Optional[str]) -> Optional[Tuple[str, str]]:
+        """
+        Normalize an artist and album into an index key.
+
+        Args:
+            artist: Artist name as parsed by Song.get_info()
+            album: Album name as parsed by Song.get_info()
+
+        Returns:
+            Case and whitespace insensitive (artist, album) pair, or None if either is missing.
+        """
+        if not artist or not album:
+            return None
+        return " ".join(artist.split()).casefold(), " ".join(album.split()).casefold()
+
+    def get(self, key: Optional[Tuple[str, str]]) -> Optional[str]:
+        """
+        Look up the image link of an album.
+
+        Args:
+            key: Index key as returned by AlbumIndex.key()
+
+        Returns:
+            The image link, or None if the album is not indexed.
+        """
+        entry = self.entries.get(key) if key is not None else None
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: Optional[Tuple[str, str]], link: str, content_key: str) -> None:
+        """
+        Record the image link of an album, replacing it if the artwork differs.
+
+        Args:
+            key: Index key as returned by AlbumIndex.key()
+            link: Resolved image link
+            content_key: Artwork cache key of the thumbnail the link was resolved from
+
+        Returns:
+            None
+        """
+        if key is None:
+            return
+
+        previous = self.entries.get(key)
+        if previous is not None and previous[1] != content_key:
+            logging.info(f"Artwork for album {key} changed, replacing index entry")
+        self.entries[key] = (link, content_key, False)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def needs_check(self, key: Optional[Tuple[str, str]]) -> bool:
+        """
+        Tell whether a hit on an album should still be checked against its thumbnail.
+
+        Args:
+            key: Index key as returned by AlbumIndex.key()
+
+        Returns:
+            True if the album is indexed and no hit on its entry was checked yet.
+        """
+        entry = self.entries.get(key) if key is not None else None
+        return entry is not None and not entry[2]
+
+    def claim_check(self, key: Optional[Tuple[str, str]]) -> Optional[str]:
+        """
+        Mark an album's entry as checked, so only the first hit on it reads the thumbnail.
+
+        Args:
+            key: Index key as returned by AlbumIndex.key()
+
+        Returns:
+            The content key to compare the thumbnail's against, or None if the entry
+            is missing or was checked already.
+        """
+        entry = self.entries.get(key) if key is not None else None
+        if entry is None or entry[2]:
+            return None
+        self.entries[key] = (entry[0], entry[1], True)
+        return entry[1]
+
+    def invalidate(self, key: Optional[Tuple[str, str]]) -> None:
+        """
+        Drop an album from the index so its artwork is read again.
+
+        Args:
+            key: Index key as returned by AlbumIndex.key()
+
+        Returns:
+            None
+        """
+        if key is not None and self.entries.pop(key, None) is not None:
+            logging.debug(f"Invalidated album index entry {key}")
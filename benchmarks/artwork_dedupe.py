@@ -0,0 +1,135 @@
+"""
+Artwork dedupe benchmark: how often variants of a cover reuse an existing upload.
+
+Renders synthetic covers with shapes and gradients, then derives the variants
+the same album art shows up as: re-encoded at other qualities, other sizes, as
+PNG, slightly brightened, and with a small edition banner. Each cover is
+"uploaded" once, and every variant is looked up by content hash (ArtworkCache)
+and by perceptual hash (SimilarArtworkIndex). Reports, per similarity threshold:
+
+- variants matched to their cover, i.e. uploads saved
+- variants and other covers wrongly matched to a different cover
+- hashing time per thumbnail and lookup time in a full index
+
+Run from the repository root:
+
+    python -m benchmarks.artwork_dedupe
+    python -m benchmarks.artwork_dedupe --covers 500 --thresholds 2 4 6 8 10
+"""
+import argparse
+import io
+import random
+import statistics
+import time
+from typing import Callable, Dict, List, Tuple
+
+from artwork import artwork_hash
+from artwork_cache import ArtworkCache, SimilarArtworkIndex
+
+
+def render_cover(seed: int, size: int = 1000):
+    """
+    Render a deterministic cover with a gradient background and a few shapes.
+    """
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    start, end = [tuple(rng.randrange(256) for _ in range(3)) for _ in range(2)]
+    gradient = Image.linear_gradient('L').resize((size, size)).rotate(rng.randrange(360))
+    image = Image.composite(Image.new('RGB', (size, size), start), Image.new('RGB', (size, size), end), gradient)
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.randint(3, 8)):
+        box = sorted(rng.randrange(size) for _ in range(2)), sorted(rng.randrange(size) for _ in range(2))
+        shape = (box[0][0], box[1][0], box[0][1], box[1][1])
+        color = tuple(rng.randrange(256) for _ in range(3))
+        (draw.ellipse if rng.random() < 0.5 else draw.rectangle)(shape, fill=color)
+    return image
+
+
+def encode(image, image_format: str = 'JPEG', **options) -> bytes:
+    output = io.BytesIO()
+    image.save(output, format=image_format, **options)
+    return output.getvalue()
+
+
+def banner(image):
+    from PIL import ImageDraw
+
+    image = image.copy()
+    width, height = image.size
+    ImageDraw.Draw(image).rectangle((width * 0.7, height * 0.92, width, height), fill=(200, 20, 20))
+    return image
+
+
+def brighten(image):
+    from PIL import ImageEnhance
+
+    return ImageEnhance.Brightness(image).enhance(1.08)
+
+
+VARIANTS: Dict[str, Callable] = {
+    'jpeg q60': lambda image: encode(image, quality=60),
+    'jpeg 600px': lambda image: encode(image.resize((600, 600)), quality=90),
+    'png 300px': lambda image: encode(image.resize((300, 300)), 'PNG'),
+    'brightened': lambda image: encode(brighten(image), quality=90),
+    'edition banner': lambda image: encode(banner(image), quality=90),
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--covers', type=int, default=200, help="distinct covers rendered")
+    parser.add_argument('--thresholds', type=int, nargs='+', default=[0, 2, 3, 4, 6, 8, 12],
+                        help="similarity thresholds to compare")
+    args = parser.parse_args()
+
+    originals: List[bytes] = []
+    variants: List[Tuple[int, str, bytes]] = []
+    for cover in range(args.covers):
+        image = render_cover(cover)
+        originals.append(encode(image, quality=92))
+        variants.extend((cover, name, make(image)) for name, make in VARIANTS.items())
+
+    timings = []
+    hashes = []
+    for data in originals + [data for _, _, data in variants]:
+        start = time.perf_counter()
+        hashes.append(artwork_hash(data))
+        timings.append(time.perf_counter() - start)
+    original_hashes, variant_hashes = hashes[:len(originals)], hashes[len(originals):]
+    print(f"hashing:    median {statistics.median(timings) * 1000:.2f} ms per thumbnail")
+
+    exact = ArtworkCache(None, max_entries=len(originals))
+    for cover, data in enumerate(originals):
+        exact.put(ArtworkCache.key(data), f"cover-{cover}")
+    exact_hits = sum(exact.get(ArtworkCache.key(data)) is not None for _, _, data in variants)
+    print(f"content hash: {exact_hits}/{len(variants)} variants reused an upload")
+
+    for threshold in args.thresholds:
+        index = SimilarArtworkIndex(None, threshold, max_entries=len(originals))
+        # Covers are added one at a time, so a cover wrongly matching an earlier one counts as a false match
+        wrong_covers = 0
+        for cover, value in enumerate(original_hashes):
+            found = index.nearest(value)
+            wrong_covers += found is not None and found != f"cover-{cover}"
+            index.add(value, f"cover-{cover}")
+
+        matched, wrong = 0, 0
+        per_variant: Dict[str, int] = {name: 0 for name in VARIANTS}
+        start = time.perf_counter()
+        for (cover, name, _), value in zip(variants, variant_hashes):
+            found = index.nearest(value)
+            if found == f"cover-{cover}":
+                matched += 1
+                per_variant[name] += 1
+            elif found is not None:
+                wrong += 1
+        lookup = (time.perf_counter() - start) / len(variants)
+        breakdown = ", ".join(f"{name} {count}" for name, count in per_variant.items())
+        print(f"threshold {threshold:>2}: {matched}/{len(variants)} variants reused their cover's upload "
+              f"({breakdown}); {wrong} variants and {wrong_covers} covers matched a different cover; "
+              f"lookup {lookup * 1e6:.0f} us in {len(index)} entries")
+
+
+if __name__ == '__main__':
+    main()
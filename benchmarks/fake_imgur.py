@@ -0,0 +1,215 @@
+"""
+Local stand-in for the Imgur upload endpoint with configurable latency and failures.
+
+Used as a context manager, it serves POST /3/image on a random local port and
+answers like Imgur, returning a link derived from the uploaded bytes. `status`
+and `headers` can be changed while it runs to simulate outages and rate limits.
+Running the module checks that ImgurUploader keeps the event loop responsive, that
+cancelling an in-flight upload returns immediately and frees its worker, so skipping
+tracks during slow uploads doesn't hold up the current track's upload, and that an
+outage opens the circuit breaker instead of sending every upload to the failing
+endpoint. It fails if the current track's upload waits behind stale ones:
+
+    python -m benchmarks.fake_imgur --latency 2
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+
+class FakeImgur:
+    """
+    Threaded HTTP server imitating Imgur's image upload API.
+    """
+    def __init__(self, latency: float = 0.0, status: int = 200, headers: Optional[Dict[str, str]] = None) -> None:
+        """
+        Args:
+            latency: Seconds to wait before answering each upload
+            status: HTTP status code returned for uploads
+            headers: Extra response headers, e.g. Imgur's rate limit headers
+        """
+        self.latency = latency
+        self.status = status
+        self.headers = dict(headers or {})
+        self.requests = 0
+        self.uploads = 0
+        # Counted on arrival, before the latency, so uploads in flight can be told apart
+        self.received = 0
+        self.bytes_received = 0
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/3/image"
+
+    def __enter__(self) -> "FakeImgur":
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self) -> None:
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                fake.received += 1
+                time.sleep(fake.latency)
+                fake.requests += 1
+                fake.uploads += fake.status == 200
+                fake.bytes_received += len(body)
+                digest = hashlib.sha1(body).hexdigest()[:7]
+                payload = json.dumps({
+                    'data': {'link': f"https://i.imgur.com/{digest}.png"},
+                    'success': fake.status == 200,
+                    'status': fake.status,
+                }).encode()
+                try:
+                    self.send_response(fake.status)
+                    self.send_header('Content-Type', 'application/json')
+                    for name, value in fake.headers.items():
+                        self.send_header(name, value)
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except OSError:
+                    # The client aborted the upload while it waited
+                    self.close_connection = True
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+async def max_loop_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    """
+    Measure the worst delay of a periodic timer while other work runs on the loop.
+    """
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def skip_during_slow_uploads(server: FakeImgur, image: io.BytesIO, latency: float, skips: int = 2) -> float:
+    """
+    Skip tracks while their uploads to a slow server are in flight, then upload the current track's artwork.
+
+    Each skip cancels the previous track's upload once the server has received it.
+    The server then turns fast again, so the current track's upload should only take
+    as long as a fast upload, unless the stale posts still occupy the workers.
+
+    Returns:
+        Seconds the current track's upload took.
+    """
+    from imgur import ImgurUploader
+
+    server.latency = latency
+    uploader = ImgurUploader("benchmark", url=server.url)
+    for _ in range(skips):
+        received = server.received
+        task = asyncio.create_task(uploader.upload(image))
+        while server.received == received:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    server.latency = 0
+    start = time.perf_counter()
+    link = await uploader.upload(image)
+    elapsed = time.perf_counter() - start
+    uploader.close()
+    print(f"skip x{skips} during {latency:g}s uploads: current upload {link} in {elapsed:.3f}s")
+    return elapsed
+
+
+async def run(latency: float, max_skip: float) -> bool:
+    from imgur import ImgurUploader
+    from rate_limit import CircuitBreaker
+
+    with FakeImgur(latency=latency) as server:
+        uploader = ImgurUploader("benchmark", url=server.url, read_timeout=latency + 5)
+        image = io.BytesIO(b"\x89PNG" + bytes(64 * 1024))
+
+        stop = asyncio.Event()
+        lag = asyncio.create_task(max_loop_lag(stop))
+        start = time.perf_counter()
+        link = await uploader.upload(image)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        print(f"upload: {link} in {elapsed:.3f}s, worst loop lag {await lag * 1000:.1f} ms")
+
+        start = time.perf_counter()
+        second = await uploader.upload(image)
+        print(f"keep-alive upload: {second} in {time.perf_counter() - start:.3f}s")
+
+        task = asyncio.create_task(uploader.upload(image))
+        await asyncio.sleep(latency / 2)
+        start = time.perf_counter()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        print(f"cancelled mid-upload in {(time.perf_counter() - start) * 1000:.1f} ms")
+        uploader.close()
+
+        skip = await skip_during_slow_uploads(server, image, max(latency, 5))
+
+        server.latency = 0
+        server.status = 503
+        breaker = CircuitBreaker(threshold=3, cooldown=0.5)
+        uploader = ImgurUploader("benchmark", url=server.url, max_retries=6, retry_delay=0.05, breaker=breaker)
+        before = server.requests
+        start = time.perf_counter()
+        task = asyncio.create_task(uploader.upload(image))
+        await asyncio.sleep(1)
+        print(f"outage: {server.requests - before} requests in 1s, breaker open: {breaker.is_open}")
+        server.status = 200
+        link = await task
+        print(f"recovered: {link} after {time.perf_counter() - start:.2f}s and {server.requests - before} requests, "
+              f"breaker open: {breaker.is_open}")
+        uploader.close()
+
+        server.status = 429
+        server.headers = {'X-Post-Rate-Limit-Remaining': '0', 'X-Post-Rate-Limit-Reset': '120'}
+        uploader = ImgurUploader("benchmark", url=server.url, max_retries=0)
+        await uploader.upload(image)
+        print(f"rate limited: uploads paused for {uploader.retry_in():.0f}s")
+        uploader.close()
+
+    ok = skip <= max_skip
+    print(f"current upload after skips within {max_skip:g}s: {'ok' if ok else 'FAILED'}")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=1.0, help="seconds the fake server waits before answering")
+    parser.add_argument('--max-skip', type=float, default=1.0,
+                        help="longest acceptable upload of the current track after skips")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args.latency, args.max_skip)) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,360 @@
+"""
+Fake stand-ins for the Windows-only and external parts of the presence pipeline.
+
+install() registers fake `winsdk.windows.media.control`, `winsdk.windows.storage.streams`,
+`discordrpc` and `tray` modules in sys.modules, so the real main.py, currently_playing.py and
+discord_rp.py can be imported and run on any platform. It must be called before those
+modules are imported. The Imgur endpoint is faked separately by benchmarks.fake_imgur.
+
+The asynchronous WinRT calls named in FakeSessionManager.hanging never complete,
+like calls into a hung Apple Music, until they are removed from it again.
+"""
+import asyncio
+import enum
+import os
+import random
+import sys
+import threading
+import time
+import types
+from datetime import timedelta
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+APPLE_MUSIC_APP_ID = 'AppleInc.AppleMusicWin_nzyj5cx40ttqa!App'
+
+
+class FakeEvent:
+    """
+    WinRT-style event source with add/remove tokens.
+
+    Setting `drop_rate` makes fire() of lossy events silently lose that fraction
+    of events, to exercise the fallback refreshes.
+    """
+    drop_rate = 0.0
+    rng = random.Random(0)
+
+    def __init__(self, lossy: bool = False) -> None:
+        self.lossy = lossy
+        self.handlers: Dict[int, Callable[[Any, Any], None]] = {}
+        self.next_token = 0
+
+    def add(self, handler: Callable[[Any, Any], None]) -> int:
+        self.next_token += 1
+        self.handlers[self.next_token] = handler
+        return self.next_token
+
+    def remove(self, token: int) -> None:
+        self.handlers.pop(token, None)
+
+    def fire(self, sender: Any) -> None:
+        if self.lossy and FakeEvent.drop_rate and FakeEvent.rng.random() < FakeEvent.drop_rate:
+            return
+        for handler in list(self.handlers.values()):
+            handler(sender, None)
+
+
+async def winrt_call(name: str) -> None:
+    """
+    Count an asynchronous WinRT call, hanging while its name is in FakeSessionManager.hanging.
+    """
+    FakeSessionManager.calls[name] += 1
+    while name in FakeSessionManager.hanging:
+        await asyncio.sleep(0.05)
+
+
+class PlaybackStatus(enum.IntEnum):
+    CLOSED = 0
+    OPENED = 1
+    CHANGING = 2
+    STOPPED = 3
+    PLAYING = 4
+    PAUSED = 5
+
+
+class IRandomAccessStreamReference:
+    """
+    Thumbnail reference backed by in-memory bytes.
+    """
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+    async def open_read_async(self) -> "FakeStream":
+        await winrt_call('open_read_async')
+        return FakeStream(self.data)
+
+
+class FakeStream:
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self.size = len(data)
+
+
+class DataReader:
+    """
+    Sequential reader over a FakeStream that allocates like the WinRT one: loaded
+    bytes are copied into an internal buffer, and every read_buffer() returns a new
+    buffer holding a copy. These stand in for WinRT's native allocations, so memory
+    measurements with tracemalloc see them.
+    """
+    def __init__(self, stream: FakeStream) -> None:
+        self.stream = stream
+        self.loaded = 0
+        self.buffer = bytearray()
+
+    async def load_async(self, size: int) -> int:
+        await winrt_call('load_async')
+        size = min(size, self.stream.size - self.loaded)
+        self.buffer += self.stream.data[self.loaded:self.loaded + size]
+        self.loaded += size
+        return size
+
+    def read_buffer(self, size: int) -> bytes:
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+class FakeSession:
+    """
+    Media session of a fake player, driven by the simulation.
+
+    Playback position advances with time.monotonic() scaled by `speed`, so a
+    compressed trace still produces consistent timelines.
+    """
+    def __init__(self, source_app_id: str = APPLE_MUSIC_APP_ID, speed: float = 1.0) -> None:
+        self.source_app_user_model_id = source_app_id
+        self.speed = speed
+        self.title: Optional[str] = None
+        self.artist_album: Optional[str] = None
+        self.thumbnail: Optional[IRandomAccessStreamReference] = None
+        self.duration = 0.0
+        self.offset = 0.0
+        self.started = time.monotonic()
+        self.status = PlaybackStatus.CLOSED
+        self.media_properties_changed = FakeEvent(lossy=True)
+        self.playback_info_changed = FakeEvent(lossy=True)
+        self.timeline_properties_changed = FakeEvent(lossy=True)
+
+    # WinRT surface used by the application
+    def add_media_properties_changed(self, handler): return self.media_properties_changed.add(handler)
+    def remove_media_properties_changed(self, token): self.media_properties_changed.remove(token)
+    def add_playback_info_changed(self, handler): return self.playback_info_changed.add(handler)
+    def remove_playback_info_changed(self, token): self.playback_info_changed.remove(token)
+    def add_timeline_properties_changed(self, handler): return self.timeline_properties_changed.add(handler)
+    def remove_timeline_properties_changed(self, token): self.timeline_properties_changed.remove(token)
+
+    def get_playback_info(self) -> Any:
+        FakeSessionManager.calls['get_playback_info'] += 1
+        return types.SimpleNamespace(playback_status=self.status)
+
+    def get_timeline_properties(self) -> Any:
+        FakeSessionManager.calls['get_timeline_properties'] += 1
+        return types.SimpleNamespace(
+            position=timedelta(seconds=self.position()),
+            end_time=timedelta(seconds=self.duration),
+        )
+
+    async def try_get_media_properties_async(self) -> Any:
+        await winrt_call('try_get_media_properties_async')
+        return types.SimpleNamespace(title=self.title, artist=self.artist_album, thumbnail=self.thumbnail)
+
+    # Controls used by the simulation
+    def position(self) -> float:
+        if self.status != PlaybackStatus.PLAYING:
+            return self.offset
+        return min(self.duration, self.offset + (time.monotonic() - self.started) * self.speed)
+
+    def play(self, title: str, artist: str, album: Optional[str], duration: float, artwork: bytes) -> None:
+        self.title = title
+        # Without an album, Apple Music only shows the artist
+        self.artist_album = f"{artist} — {album}" if album else artist
+        self.thumbnail = IRandomAccessStreamReference(artwork)
+        self.duration = duration
+        self.offset = 0.0
+        self.started = time.monotonic()
+        self.status = PlaybackStatus.PLAYING
+        self.media_properties_changed.fire(self)
+        self.playback_info_changed.fire(self)
+        self.timeline_properties_changed.fire(self)
+
+    def pause(self) -> None:
+        self.offset = self.position()
+        self.status = PlaybackStatus.PAUSED
+        self.playback_info_changed.fire(self)
+
+    def resume(self) -> None:
+        self.started = time.monotonic()
+        self.status = PlaybackStatus.PLAYING
+        self.playback_info_changed.fire(self)
+
+    def seek(self, position: float) -> None:
+        self.offset = position
+        self.started = time.monotonic()
+        self.timeline_properties_changed.fire(self)
+
+
+class FakeSessionManager:
+    """
+    Session manager returned by GlobalSystemMediaTransportControlsSessionManager.request_async().
+    """
+    instance: Optional["FakeSessionManager"] = None
+    calls: Dict[str, int] = {}
+    hanging: Set[str] = set()
+
+    def __init__(self) -> None:
+        self.session: Optional[FakeSession] = None
+        self.current_session_changed = FakeEvent()
+        FakeSessionManager.instance = self
+        FakeSessionManager.calls = {name: 0 for name in (
+            'request_async', 'get_playback_info', 'get_timeline_properties',
+            'try_get_media_properties_async', 'open_read_async', 'load_async',
+        )}
+
+    @staticmethod
+    async def request_async() -> "FakeSessionManager":
+        await winrt_call('request_async')
+        return FakeSessionManager.instance
+
+    def add_current_session_changed(self, handler): return self.current_session_changed.add(handler)
+    def remove_current_session_changed(self, token): self.current_session_changed.remove(token)
+
+    def get_current_session(self) -> Optional[FakeSession]:
+        return self.session
+
+    def set_session(self, session: Optional[FakeSession]) -> None:
+        self.session = session
+        self.current_session_changed.fire(self)
+
+
+class FakeDiscordClient:
+    """
+    Stand-in for discordrpc.RPC recording every IPC message instead of sending it.
+
+    quit() simulates Discord quitting: its IPC endpoint disappears, connecting fails
+    and every open connection raises BrokenPipeError until start() brings Discord
+    back and the client has reconnected. The endpoint is an empty file named like
+    Discord's socket inside `ipc_dir`, which DISCORD_IPC_DIR must point to.
+    """
+    messages: List[Tuple[float, Dict[str, Any]]] = []
+    connects = 0
+    disconnects = 0
+    running = True
+    generation = 0
+    ipc_dir: Optional[str] = None
+
+    def __init__(self, app_id: int, **kwargs: Any) -> None:
+        if not FakeDiscordClient.running:
+            raise ConnectionRefusedError("Discord is not running")
+        FakeDiscordClient.connects += 1
+        self.app_id = app_id
+        self.generation = FakeDiscordClient.generation
+
+    def send(self) -> None:
+        if not FakeDiscordClient.running or self.generation != FakeDiscordClient.generation:
+            raise BrokenPipeError("Discord closed the pipe")
+
+    def set_activity(self, **activity: Any) -> None:
+        self.send()
+        FakeDiscordClient.messages.append((time.perf_counter(), activity))
+
+    def clear(self) -> None:
+        self.send()
+        FakeDiscordClient.messages.append((time.perf_counter(), {}))
+
+    def disconnect(self) -> None:
+        FakeDiscordClient.disconnects += 1
+        # The real client exits through SystemExit when disconnecting
+        raise SystemExit
+
+    @classmethod
+    def endpoint(cls) -> Optional[str]:
+        return None if cls.ipc_dir is None else os.path.join(cls.ipc_dir, 'discord-ipc-0')
+
+    @classmethod
+    def quit(cls) -> None:
+        cls.running = False
+        cls.generation += 1
+        if cls.endpoint() is not None and os.path.exists(cls.endpoint()):
+            os.remove(cls.endpoint())
+
+    @classmethod
+    def start(cls) -> None:
+        cls.running = True
+        if cls.endpoint() is not None:
+            open(cls.endpoint(), 'w').close()
+
+    @classmethod
+    def reset(cls) -> None:
+        cls.messages = []
+        cls.connects = 0
+        cls.disconnects = 0
+        cls.start()
+
+
+class FakeTray:
+    """
+    Headless replacement for tray.TrayIcon.
+    """
+    instances: List["FakeTray"] = []
+
+    def __init__(self, stop_event: threading.Event, on_quit: Optional[Callable[[], None]] = None,
+                 stats: Optional[Callable[[], List[str]]] = None, memory: Optional[Any] = None,
+                 profiler: Optional[Any] = None) -> None:
+        self.stop_event = stop_event
+        self.on_quit = on_quit
+        self.stats = stats
+        self.memory = memory
+        self.profiler = profiler
+        FakeTray.instances.append(self)
+
+    def run(self) -> None:
+        pass
+
+    def quit(self) -> None:
+        self.stop_event.set()
+        if self.on_quit is not None:
+            self.on_quit()
+
+
+def install() -> None:
+    """
+    Register the fake modules in sys.modules.
+
+    Returns:
+        None
+    """
+    winsdk = types.ModuleType('winsdk')
+    windows = types.ModuleType('winsdk.windows')
+    media = types.ModuleType('winsdk.windows.media')
+    control = types.ModuleType('winsdk.windows.media.control')
+    storage = types.ModuleType('winsdk.windows.storage')
+    streams = types.ModuleType('winsdk.windows.storage.streams')
+
+    control.GlobalSystemMediaTransportControlsSessionPlaybackStatus = PlaybackStatus
+    control.GlobalSystemMediaTransportControlsSessionManager = FakeSessionManager
+    streams.DataReader = DataReader
+    streams.IRandomAccessStreamReference = IRandomAccessStreamReference
+
+    winsdk.windows = windows
+    windows.media = media
+    windows.storage = storage
+    media.control = control
+    storage.streams = streams
+
+    discordrpc = types.ModuleType('discordrpc')
+    discordrpc.RPC = FakeDiscordClient
+
+    # The real tray needs a desktop session, which the simulation doesn't have
+    tray = types.ModuleType('tray')
+    tray.TrayIcon = FakeTray
+
+    sys.modules.update({
+        'winsdk': winsdk,
+        'winsdk.windows': windows,
+        'winsdk.windows.media': media,
+        'winsdk.windows.media.control': control,
+        'winsdk.windows.storage': storage,
+        'winsdk.windows.storage.streams': streams,
+        'discordrpc': discordrpc,
+        'tray': tray,
+    })
@@ -0,0 +1,160 @@
+"""
+Footprint benchmark: resident memory and threads of the tray and headless modes.
+
+Launches fresh interpreters that run main() against a fake media session playing a
+track with real artwork (benchmarks.fakes) and a fake Imgur server running in this
+process. Once the artwork has reached Discord and the application has settled, each
+reports its RSS, USS (memory only this process uses), OS threads and which heavy
+modules were loaded. The headless run then asks for its status and quits through the
+control endpoint, checking that path end to end, and checks that a client without
+the endpoint's token is turned away.
+
+The tray run uses the real tray.TrayIcon. Without a desktop session, off Windows,
+pystray's dummy backend is used: pystray and the icon are still loaded, but its
+event loop exits at once, so the tray thread isn't counted there. Only runs on
+Windows measure what headless mode saves on the machines it is meant for.
+
+The run fails if the headless mode loaded pystray or used more memory or threads
+than the tray mode. Run from the repository root:
+
+    python -m benchmarks.footprint
+    python -m benchmarks.footprint --runs 5 --settle 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+from benchmarks.fake_imgur import FakeImgur
+from benchmarks.startup import HELPERS
+
+CHILD = """
+import asyncio, gc, json, threading
+from functools import partial
+from unittest import mock
+import psutil
+
+from benchmarks import fakes
+fakes.install()
+os.environ.setdefault('DISCORD_CLIENT_ID', '0')
+os.environ.setdefault('IMGUR_CLIENT_ID', 'footprint')
+HEADLESS = os.environ['FOOTPRINT_MODE'] == 'headless'
+if not HEADLESS:
+    # The real tray instead of the fake one
+    del sys.modules['tray']
+
+fakes.FakeDiscordClient.ipc_dir = os.environ['DISCORD_IPC_DIR']
+fakes.FakeDiscordClient.start()
+manager = fakes.FakeSessionManager()
+session = fakes.FakeSession()
+manager.set_session(session)
+with open(os.environ['FOOTPRINT_ARTWORK'], 'rb') as f:
+    session.play('Title', 'Artist', 'Album', 240, f.read())
+
+import main
+import socket
+from control import default_endpoint_path, send_command
+from imgur import ImgurUploader
+
+def wrong_token():
+    with open(default_endpoint_path()) as f:
+        endpoint = json.load(f)
+    with socket.create_connection((endpoint['host'], endpoint['port']), timeout=5) as connection:
+        connection.sendall(b'guessed\\nquit\\n')
+        return json.loads(connection.makefile('rb').readline())['ok']
+
+async def run():
+    with mock.patch('currently_playing.ImgurUploader', partial(ImgurUploader, url=os.environ['FOOTPRINT_IMGUR'])):
+        application = asyncio.create_task(main.main(threading.Event(), HEADLESS))
+        while not any(activity.get('large_image', '').startswith('http')
+                      for _, activity in fakes.FakeDiscordClient.messages):
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(float(os.environ['FOOTPRINT_SETTLE']))
+        gc.collect()
+        process = psutil.Process()
+        memory = process.memory_full_info()
+        sample = {'rss': memory.rss, 'uss': getattr(memory, 'uss', memory.rss), 'threads': process.num_threads(),
+                  'modules': loaded().split(',') if loaded() else []}
+        if HEADLESS:
+            loop = asyncio.get_running_loop()
+            sample['status'] = (await loop.run_in_executor(None, send_command, 'status'))['ok']
+            sample['rejected'] = not await loop.run_in_executor(None, wrong_token)
+            sample['quit'] = (await loop.run_in_executor(None, send_command, 'quit'))['ok']
+            await asyncio.wait_for(application, 10)
+        print('FOOTPRINT ' + json.dumps(sample), flush=True)
+        os._exit(0)
+
+asyncio.run(run())
+"""
+
+
+def footprint(mode: str, imgur_url: str, artwork: str, settle: float) -> Dict[str, Any]:
+    """
+    Run the application in a fresh interpreter and sample it once it has settled.
+
+    Returns:
+        RSS and USS in bytes, OS threads, heavy modules loaded, and for headless runs
+        whether the status and quit control commands succeeded and a wrong token was rejected.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        # Its own profile directory, so each run publishes its own control endpoint
+        env = dict(os.environ, LOCALAPPDATA=directory, DISCORD_IPC_DIR=directory, FOOTPRINT_MODE=mode,
+                   FOOTPRINT_IMGUR=imgur_url, FOOTPRINT_ARTWORK=artwork, FOOTPRINT_SETTLE=str(settle))
+        if os.name != 'nt':
+            env['PYSTRAY_BACKEND'] = 'dummy'
+        result = subprocess.run([sys.executable, '-c', HELPERS + CHILD], capture_output=True, text=True, env=env,
+                                timeout=120)
+    for line in result.stdout.splitlines():
+        if line.startswith('FOOTPRINT '):
+            return json.loads(line[len('FOOTPRINT '):])
+    raise RuntimeError(f"The {mode} run reported nothing:\n{result.stderr}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help="fresh interpreters per mode")
+    parser.add_argument('--settle', type=float, default=2, help="seconds to run after the artwork is published")
+    args = parser.parse_args()
+
+    from benchmarks.simulate import artwork_bytes
+
+    results: Dict[str, List[Dict[str, Any]]] = {'tray': [], 'headless': []}
+    with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as artwork, FakeImgur() as imgur:
+        artwork.write(artwork_bytes('footprint'))
+        artwork.close()
+        try:
+            for _ in range(args.runs):
+                for mode in results:
+                    results[mode].append(footprint(mode, imgur.url, artwork.name, args.settle))
+        finally:
+            os.unlink(artwork.name)
+
+    summary = {}
+    for mode, runs in results.items():
+        summary[mode] = {key: statistics.median(run[key] for run in runs) for key in ('rss', 'uss', 'threads')}
+        print(f"{mode:9} rss {summary[mode]['rss'] / 1024 / 1024:6.1f} MiB  uss {summary[mode]['uss'] / 1024 / 1024:6.1f} "
+              f"MiB  threads {summary[mode]['threads']:.0f}  loaded {', '.join(runs[-1]['modules']) or 'none'}")
+    tray, headless = summary['tray'], summary['headless']
+    print(f"headless saves {(tray['rss'] - headless['rss']) / 1024 / 1024:.1f} MiB RSS, "
+          f"{(tray['uss'] - headless['uss']) / 1024 / 1024:.1f} MiB USS and {tray['threads'] - headless['threads']:.0f} "
+          f"thread(s) per session")
+
+    checks = {
+        'headless never loads pystray': all('pystray' not in run['modules'] for run in results['headless']),
+        'headless uses no more memory': headless['uss'] <= tray['uss'],
+        'headless uses no more threads': headless['threads'] <= tray['threads'],
+        'control endpoint answers status and quit': all(run['status'] and run['quit']
+                                                         for run in results['headless']),
+        'control endpoint rejects a wrong token': all(run['rejected'] for run in results['headless']),
+    }
+    for name, ok in checks.items():
+        print(f"  {name:40} {'ok' if ok else 'FAILED'}")
+    sys.exit(0 if all(checks.values()) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Log pipeline check: the handlers in log_queue.py on their own, in a temporary directory.
+
+Rotates a log file dozens of times within a second and checks that no rotated
+file overwrote another and that files stay near the rotation size, then writes
+through start_logging() and checks that the directory stays under its total
+size cap with the newest records kept. Then checks that expired log files are
+pruned while other files are kept, that identical consecutive records collapse
+into "Previous message repeated N times" summaries, also periodically while a
+run continues, and that records dropped by a full queue are counted and
+reported. Prints one line per case and fails if any fails. Run from the
+repository root:
+
+    python -m benchmarks.log_pipeline
+"""
+import logging
+import os
+import queue
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+from log_queue import DroppingQueueHandler, PrunedFileHandler, RepeatCollapsingHandler, start_logging, stop_logging
+
+LINE = "x" * 100
+FORMATTER = logging.Formatter("%(message)s")
+
+
+class Collecting(logging.Handler):
+    """Handler keeping the messages it is given."""
+    def __init__(self) -> None:
+        super().__init__()
+        self.messages: List[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.messages.append(record.getMessage())
+
+
+def log_files(directory: Path) -> List[Path]:
+    return sorted(path for path in directory.iterdir() if '.log' in path.name)
+
+
+def write_lines(directory: Path, count: int, max_total_bytes: int) -> None:
+    logger = logging.getLogger(f"log_pipeline.{directory.name}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    listener = start_logging(logger, directory / "amrp.log", FORMATTER, max_total_bytes, retention_days=14)
+    for number in range(count):
+        logger.info(f"{number:06d} {LINE}")
+    stop_logging(listener)
+
+
+def record(message: str, created: float) -> logging.LogRecord:
+    return logging.makeLogRecord({'name': 'log_pipeline', 'levelno': logging.INFO, 'levelname': 'INFO',
+                                  'msg': message, 'created': created})
+
+
+def rotation() -> Tuple[bool, str]:
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        # Large enough a total that nothing is pruned
+        handler = PrunedFileHandler(directory / "amrp.log", 5_000, 10_000_000, retention_days=14)
+        handler.setFormatter(FORMATTER)
+        for number in range(2000):
+            handler.handle(record(f"{number:06d} {LINE}", time.time()))
+        handler.close()
+        files = log_files(directory)
+        lines = [line for path in files for line in path.read_text(encoding='utf-8').splitlines()]
+        largest = max(path.stat().st_size for path in files)
+        ok = len(lines) == 2000 and len(set(lines)) == 2000 and largest <= 5_000 + len(LINE) + 8
+        return ok, f"{len(files)} files, {len(lines)}/2000 lines kept, largest {largest} bytes"
+
+
+def size_cap() -> Tuple[bool, str]:
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        write_lines(directory, 5000, 20_000)
+        files = log_files(directory)
+        total = sum(path.stat().st_size for path in files)
+        last = (directory / "amrp.log").read_text(encoding='utf-8').splitlines()[-1]
+        ok = total <= 20_000 + len(LINE) + 8 and last.startswith("004999 ")
+        return ok, f"{len(files)} files, {total} bytes against a 20000 byte cap, newest line kept: {ok}"
+
+
+def age_pruning() -> Tuple[bool, str]:
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        old = time.time() - 10 * 86400
+        for name in ("amrp.log.2020-01-01", "amrp.log.2020-01-02_12-00-00", "notes.txt"):
+            (directory / name).write_text(LINE)
+            os.utime(directory / name, (old, old))
+        (directory / "amrp.log.fresh").write_text(LINE)
+        handler = PrunedFileHandler(directory / "amrp.log", 10_000, 100_000, retention_days=7)
+        handler.close()
+        left = sorted(path.name for path in directory.iterdir())
+        ok = left == ["amrp.log", "amrp.log.fresh", "notes.txt"]
+        return ok, f"left {left}"
+
+
+def collapsing() -> Tuple[bool, str]:
+    target = Collecting()
+    handler = RepeatCollapsingHandler(target, summary_interval=10)
+    now = time.time()
+    for offset in range(5):
+        handler.handle(record("same", now + offset))
+    handler.handle(record("other", now + 5))
+    # A run longer than the summary interval is summarized while it continues
+    for offset in (6, 8, 16, 17):
+        handler.handle(record("other", now + offset))
+    handler.close()
+    expected = ["same", "Previous message repeated 4 times", "other",
+                "Previous message repeated 3 times", "Previous message repeated 1 times"]
+    return target.messages == expected, f"wrote {target.messages}"
+
+
+def drops() -> Tuple[bool, str]:
+    log_queue: queue.Queue = queue.Queue(2)
+    handler = DroppingQueueHandler(log_queue)
+    handler.setFormatter(FORMATTER)
+    for number in range(5):
+        handler.handle(record(f"record {number}", time.time()))
+    queued = [log_queue.get_nowait().getMessage() for _ in range(log_queue.qsize())]
+    handler.handle(record("after", time.time()))
+    reported = log_queue.get_nowait().getMessage()
+    ok = queued == ["record 0", "record 1"] and "3 earlier log records dropped" in reported and not handler.dropped
+    return ok, f"queued {queued}, then {reported!r}"
+
+
+CASES: List[Tuple[str, Callable[[], Tuple[bool, str]]]] = [
+    ("rotation", rotation),
+    ("size cap", size_cap),
+    ("age pruning", age_pruning),
+    ("repeat collapsing", collapsing),
+    ("queue drops", drops),
+]
+
+
+def main() -> None:
+    failed = 0
+    for name, case in CASES:
+        ok, detail = case()
+        failed += not ok
+        print(f"{name:18} {detail}  {'ok' if ok else 'FAILED'}")
+    print(f"{len(CASES) - failed}/{len(CASES)} cases passed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
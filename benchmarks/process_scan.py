@@ -0,0 +1,94 @@
+"""
+Micro-benchmark of Apple Music process detection against a synthetic process table.
+
+Compares a full psutil.process_iter() scan per refresh cycle with the cached
+ProcessDetector. Run from the repository root:
+
+    python -m benchmarks.process_scan --processes 400 --cycles 2000
+"""
+import argparse
+import time
+from typing import Any, Dict, List
+from unittest import mock
+
+import psutil
+from process_detector import ProcessDetector
+
+TARGET = 'AppleMusic.exe'
+APP_ID = 'AppleInc.AppleMusicWin_nzyj5cx40ttqa!App'
+
+
+class FakeProcess:
+    """
+    Minimal stand-in for psutil.Process as yielded by process_iter().
+    """
+    def __init__(self, pid: int, name: str) -> None:
+        self.pid = pid
+        self.info: Dict[str, Any] = {'name': name, 'create_time': 1_700_000_000.0 + pid}
+
+    def is_running(self) -> bool:
+        return True
+
+
+def synthetic_table(processes: int) -> List[FakeProcess]:
+    """
+    Build a process table with the target process placed last, the worst case for a scan.
+
+    Args:
+        processes: Total number of processes in the table
+
+    Returns:
+        List of fake processes.
+    """
+    table = [FakeProcess(pid, f"svc{pid}.exe") for pid in range(4, processes + 3)]
+    table.append(FakeProcess(processes + 3, TARGET))
+    return table
+
+
+def full_scan() -> bool:
+    """
+    Reproduce the previous per-cycle check, which walks the whole process table.
+    """
+    for proc in psutil.process_iter(['name']):
+        if proc.info['name'] == TARGET:
+            return True
+    return False
+
+
+def measure(label: str, check, cycles: int) -> float:
+    start = time.perf_counter()
+    for _ in range(cycles):
+        assert check()
+    elapsed = time.perf_counter() - start
+    per_call = elapsed / cycles * 1e6
+    print(f"{label:<20} {per_call:10.2f} us/check  ({cycles} checks in {elapsed:.3f}s)")
+    return per_call
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=400, help="size of the synthetic process table")
+    parser.add_argument('--cycles', type=int, default=2000, help="number of checks to time")
+    args = parser.parse_args()
+
+    table = synthetic_table(args.processes)
+    iterations = {'count': 0}
+
+    def process_iter(attrs=None):
+        iterations['count'] += 1
+        return iter(table)
+
+    with mock.patch.object(psutil, 'process_iter', process_iter):
+        baseline = measure("full scan", full_scan, args.cycles)
+        scans_before = iterations['count']
+        detector = ProcessDetector(TARGET, 'AppleInc.AppleMusicWin')
+        cached = measure("cached detector", detector.is_running, args.cycles)
+        detector_scans = iterations['count'] - scans_before
+        session = measure("session app id", lambda: detector.is_running(APP_ID), args.cycles)
+
+    print(f"\nprocesses={args.processes} detector full scans={detector_scans} "
+          f"speedup={baseline / cached:.0f}x (cached), {baseline / session:.0f}x (session app id)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Shutdown check: quitting from the tray is instant, whatever the application is doing.
+
+Runs the real main() against the fakes of benchmarks.simulate and quits from a
+separate thread, as the tray does, in three situations:
+
+- idle: waiting for media session events
+- upload: an artwork upload to a slow fake Imgur is in flight
+- winrt: a media session call hangs, with a deadline longer than the test
+
+Each quit runs in a fresh interpreter, which is left to exit on its own once
+main() returns, as the application does. For each, reports the time from the quit
+to main() returning and to the process having exited, whether the presence was
+cleared and the tray stopped, and which tasks were still running. Exiting also
+waits for the threads still running, such as an upload worker. The run fails if
+main() takes longer than --max-ms to return or the process longer than
+--max-exit-ms to exit. Run from the repository root:
+
+    python -m benchmarks.shutdown
+    python -m benchmarks.shutdown --runs 10 --max-ms 50
+"""
+import os
+
+# Long enough that only cancellation can end the hung call in time
+os.environ.setdefault('WINRT_TIMEOUT', '30')
+
+import argparse  # noqa: E402
+import asyncio  # noqa: E402
+import json  # noqa: E402
+import logging  # noqa: E402
+import statistics  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+import tempfile  # noqa: E402
+import threading  # noqa: E402
+import time  # noqa: E402
+from functools import partial  # noqa: E402
+from typing import Any, Callable, Dict  # noqa: E402
+from unittest import mock  # noqa: E402
+
+from benchmarks.simulate import app, artwork_bytes, fakes  # noqa: E402
+from benchmarks.fake_imgur import FakeImgur  # noqa: E402
+from imgur import ImgurUploader  # noqa: E402
+
+
+async def until(condition: Callable[[], bool], timeout: float = 10) -> None:
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("the application never reached the state to quit in")
+        await asyncio.sleep(0.01)
+
+
+async def quit_while(scenario: str, run: int) -> Dict[str, Any]:
+    """
+    Start the application, bring it into the scenario's state and quit from another thread.
+
+    Returns:
+        Quit latency in milliseconds, the wall clock time of the quit, and what the application left behind.
+    """
+    fakes.FakeDiscordClient.reset()
+    fakes.FakeTray.instances.clear()
+    fakes.FakeSessionManager.hanging.clear()
+    manager = fakes.FakeSessionManager()
+    session = fakes.FakeSession()
+    manager.set_session(session)
+    session.play('Warm up', 'Artist', 'Album', 240, artwork_bytes(f'warm up {scenario} {run}', size=300))
+    stop_event = threading.Event()
+
+    with FakeImgur() as imgur, mock.patch('currently_playing.ImgurUploader', partial(ImgurUploader, url=imgur.url)):
+        application = asyncio.create_task(app.main(stop_event))
+        await until(lambda: imgur.uploads > 0)
+        await until(lambda: any(activity.get('details') == 'Warm up' for _, activity
+                                in fakes.FakeDiscordClient.messages))
+
+        if scenario == 'upload':
+            imgur.latency = 10
+            received = imgur.received
+            # A cover not seen before in this process, so it is neither cached nor similar
+            session.play('Uploading', 'Artist', f'Other album {run}', 240,
+                         artwork_bytes(f'upload {scenario} {run}', size=300))
+            await until(lambda: imgur.received > received)
+        elif scenario == 'winrt':
+            calls = fakes.FakeSessionManager.calls['try_get_media_properties_async']
+            fakes.FakeSessionManager.hanging.add('try_get_media_properties_async')
+            session.timeline_properties_changed.fire(session)
+            await until(lambda: fakes.FakeSessionManager.calls['try_get_media_properties_async'] > calls)
+        else:
+            await asyncio.sleep(0.2)
+
+        tasks = len(asyncio.all_tasks())
+        tray = fakes.FakeTray.instances[0]
+        quit_at = []
+        # Quit from another thread, as the tray does
+        threading.Thread(target=lambda: (quit_at.append((time.perf_counter(), time.time())), tray.quit())).start()
+        await asyncio.wait_for(application, timeout=30)
+        returned = time.perf_counter()
+        fakes.FakeSessionManager.hanging.clear()
+        imgur.latency = 0
+
+    last = fakes.FakeDiscordClient.messages[-1][1] if fakes.FakeDiscordClient.messages else None
+    return {
+        'quit_ms': (returned - quit_at[0][0]) * 1000,
+        'quit_time': quit_at[0][1],
+        'cleared': last == {},
+        'tray_stopped': stop_event.is_set(),
+        'tasks_before': tasks,
+        'tasks_left': len(asyncio.all_tasks()) - 1,
+    }
+
+
+def quit_child(scenario: str, run: int) -> None:
+    """
+    Quit once in this interpreter, print the result and let the interpreter exit normally.
+    """
+    result = asyncio.run(quit_while(scenario, run))
+    print('SHUTDOWN ' + json.dumps(result), flush=True)
+
+
+def quit_process(scenario: str, run: int, verbose: bool) -> Dict[str, Any]:
+    """
+    Quit once in a fresh interpreter and time how long it takes to exit.
+
+    Returns:
+        The child's result, with the milliseconds from the quit to the process having exited.
+    """
+    command = [sys.executable, '-m', 'benchmarks.shutdown', '--child', scenario, str(run)]
+    if verbose:
+        command.append('--verbose')
+    # Fresh app data, so artwork cached by earlier runs is uploaded again
+    with tempfile.TemporaryDirectory() as appdata:
+        result = subprocess.run(command, stdout=subprocess.PIPE, text=True, timeout=120,
+                                env=dict(os.environ, LOCALAPPDATA=appdata))
+        exited = time.time()
+    for line in result.stdout.splitlines():
+        if line.startswith('SHUTDOWN '):
+            child = json.loads(line[len('SHUTDOWN '):])
+            child['exit_ms'] = (exited - child['quit_time']) * 1000
+            return child
+    raise RuntimeError(f"The {scenario} run reported nothing, exit code {result.returncode}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help="quits measured per scenario")
+    parser.add_argument('--scenarios', nargs='+', default=['idle', 'upload', 'winrt'],
+                        choices=['idle', 'upload', 'winrt'], help="situations to quit in")
+    parser.add_argument('--max-ms', type=float, default=100, help="longest acceptable time for main() to return")
+    parser.add_argument('--max-exit-ms', type=float, default=500,
+                        help="longest acceptable time for the process to exit")
+    parser.add_argument('--verbose', action='store_true', help="show application logs")
+    parser.add_argument('--child', nargs=2, metavar=('SCENARIO', 'RUN'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL,
+                        format="%(asctime)s :: [%(levelname)s] :: %(message)s")
+    if args.child:
+        quit_child(args.child[0], int(args.child[1]))
+        return
+
+    results: Dict[str, list] = {scenario: [] for scenario in args.scenarios}
+    for run in range(args.runs):
+        for scenario in args.scenarios:
+            results[scenario].append(quit_process(scenario, run, args.verbose))
+
+    failed = False
+    for scenario, runs in results.items():
+        latencies = [run['quit_ms'] for run in runs]
+        exits = [run['exit_ms'] for run in runs]
+        ok = (max(latencies) <= args.max_ms and max(exits) <= args.max_exit_ms
+              and all(run['cleared'] and run['tray_stopped'] for run in runs))
+        failed |= not ok
+        print(f"{scenario:7} quit ms: median {statistics.median(latencies):6.1f}  max {max(latencies):6.1f}  "
+              f"exit ms: median {statistics.median(exits):6.1f}  max {max(exits):6.1f}  "
+              f"presence cleared {sum(run['cleared'] for run in runs)}/{len(runs)}, "
+              f"tasks {runs[-1]['tasks_before']} -> {runs[-1]['tasks_left']} left  "
+              f"{'ok' if ok else 'FAILED'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,513 @@
+"""
+Offline simulation and benchmark of the whole presence pipeline.
+
+Replays a playback trace through the real main(), Song and RPC code with fake
+media session, Discord IPC and tray stand-ins (benchmarks.fakes) and a local fake
+Imgur server (benchmarks.fake_imgur), then reports:
+
+- track change to presence latency percentiles
+- uploads per hour of trace time
+- IPC messages sent and connections opened
+- loop wakeups per hour of trace time, and how many were fallback refreshes
+- CPU time and peak memory of the process
+- with --trace-memory, peak Python memory allocated while resolving each track's artwork
+- with --sinks, track change latency seen by a WebSocket client of the HTTP sink, a
+  file sink and a deliberately slow sink, next to the Discord latency
+- with --profile, a profile capture of the whole replay written to a directory, so
+  its CPU time can be compared with a run without one
+
+Traces are JSON lists of events with an `at` offset in trace seconds:
+
+    {"at": 0,   "event": "play", "title": "...", "artist": "...", "album": "...",
+                "duration": 210, "artwork": "album-id"}
+    {"at": 30,  "event": "pause"}     {"at": 45,  "event": "resume"}
+    {"at": 60,  "event": "seek", "position": 120}
+    {"at": 300, "event": "stop"}      {"at": 320, "event": "close"}
+    {"at": 340, "event": "open"}
+    {"at": 400, "event": "discord_quit"}    {"at": 460, "event": "discord_start"}
+
+`stop` removes the media session, `close` also quits the fake app and `open`
+brings it back. `discord_quit` removes the fake Discord IPC endpoint and breaks the
+pipe until `discord_start`; the application defers presence work in between.
+
+Without --trace a synthetic trace is generated. Trace time runs
+--speed times faster than real time; Discord's presence rate limit still applies in
+real time, so high speeds inflate latencies of rapid skips. Refresh intervals are
+scaled by --speed so the scheduler keeps its trace-time behaviour. --drop-events loses
+a fraction of media session events, showing the detection latency the fallback
+refreshes give in exchange for their wakeups. The run fails if the p95 track change
+to presence latency exceeds --max-latency-ms, so a regression of the publish path is
+caught; raise it for high speeds or dropped events. Run from the repository root:
+
+    python -m benchmarks.simulate --minutes 20 --speed 10
+    python -m benchmarks.simulate --drop-events 0.5
+    python -m benchmarks.simulate --minutes 120 --trace-memory
+    python -m benchmarks.simulate --sinks --slow-sink 5
+    python -m benchmarks.simulate --profile profiles
+    python -m benchmarks.simulate --trace recorded.json --json
+"""
+import argparse
+import asyncio
+import atexit
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from unittest import mock
+
+from benchmarks import fakes
+from benchmarks.fake_imgur import FakeImgur
+
+fakes.install()
+os.environ.setdefault('DISCORD_CLIENT_ID', '0')
+os.environ.setdefault('IMGUR_CLIENT_ID', 'simulation')
+# Discord's IPC endpoint is faked by a file the application's probe can find
+fakes.FakeDiscordClient.ipc_dir = os.environ['DISCORD_IPC_DIR'] = tempfile.mkdtemp(prefix='amrp-ipc-')
+atexit.register(shutil.rmtree, fakes.FakeDiscordClient.ipc_dir, True)
+
+import main as app  # noqa: E402  (needs the fakes installed first)
+from currently_playing import Song  # noqa: E402
+from imgur import ImgurUploader  # noqa: E402
+from media_watcher import MediaWatcher  # noqa: E402
+from profiler import Profiler  # noqa: E402
+from scheduler import RefreshScheduler  # noqa: E402
+from sinks import FileSink, HttpSink, Sink, read_websocket_frame  # noqa: E402
+
+
+def synthetic_trace(minutes: float, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Generate a listening session: albums played through, with skips, seeks and pauses,
+    and Apple Music occasionally closed and reopened.
+
+    Args:
+        minutes: Length of the trace in trace minutes
+        seed: Random seed, so runs are comparable
+
+    Returns:
+        List of trace events ordered by time.
+    """
+    rng = random.Random(seed)
+    trace: List[Dict[str, Any]] = []
+    now = 0.0
+    album_number = 0
+    while now < minutes * 60:
+        album_number += 1
+        artist, album = f"Artist {album_number % 7}", f"Album {album_number}"
+        for track in range(rng.randint(6, 14)):
+            if now >= minutes * 60:
+                break
+            duration = rng.randint(150, 300)
+            trace.append({'at': now, 'event': 'play', 'title': f"{album} Track {track + 1}", 'artist': artist,
+                          'album': album, 'duration': duration, 'artwork': album})
+            roll = rng.random()
+            if roll < 0.2:
+                # Skipped after a few seconds
+                now += rng.uniform(2, 15)
+                continue
+            if roll < 0.3:
+                trace.append({'at': now + duration / 3, 'event': 'seek', 'position': duration / 2})
+                now += duration / 3 + duration / 2
+                continue
+            if roll < 0.4:
+                pause = rng.uniform(10, 120)
+                trace.append({'at': now + duration / 2, 'event': 'pause'})
+                trace.append({'at': now + duration / 2 + pause, 'event': 'resume'})
+                now += pause
+            now += duration
+        if rng.random() < 0.15:
+            trace.append({'at': now, 'event': 'close'})
+            now += rng.uniform(30, 300)
+            trace.append({'at': now, 'event': 'open'})
+    return trace
+
+
+def load_trace(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding='utf-8') as f:
+        return sorted(json.load(f), key=lambda event: event['at'])
+
+
+def artwork_bytes(name: str, size: int = 1200) -> bytes:
+    """
+    Render deterministic album artwork of realistic size for an artwork id.
+    """
+    from PIL import Image
+
+    rng = random.Random(name)
+    image = Image.effect_noise((size, size), 64).convert('RGB')
+    image = Image.blend(image, Image.new('RGB', image.size, tuple(rng.randrange(256) for _ in range(3))), 0.6)
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=92)
+    return output.getvalue()
+
+
+class Player:
+    """
+    Drives the fake media session through a trace and records when tracks change.
+    """
+    def __init__(self, trace: List[Dict[str, Any]], speed: float) -> None:
+        self.trace = trace
+        self.speed = speed
+        self.manager = fakes.FakeSessionManager()
+        self.session: Optional[fakes.FakeSession] = None
+        # Rendered up front so replaying doesn't stall the loop the application runs on
+        self.artwork: Dict[str, bytes] = {
+            event['artwork']: artwork_bytes(event['artwork']) for event in trace if event['event'] == 'play'
+        }
+        self.changes: List[tuple] = []
+
+    def ensure_session(self) -> fakes.FakeSession:
+        if self.session is None:
+            self.session = fakes.FakeSession(speed=self.speed)
+            self.manager.set_session(self.session)
+        return self.session
+
+    async def replay(self) -> None:
+        start = time.monotonic()
+        for event in self.trace:
+            delay = start + event['at'] / self.speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.apply(event)
+
+    def apply(self, event: Dict[str, Any]) -> None:
+        kind = event['event']
+        if kind == 'play':
+            self.changes.append((time.perf_counter(), event['title']))
+            self.ensure_session().play(event['title'], event['artist'], event['album'], event['duration'],
+                                       self.artwork[event['artwork']])
+        elif kind in ('pause', 'resume', 'seek') and self.session is not None:
+            if kind == 'seek':
+                self.session.seek(event['position'])
+            else:
+                getattr(self.session, kind)()
+        elif kind in ('stop', 'close'):
+            self.session = None
+            self.manager.set_session(None)
+        elif kind == 'open':
+            self.ensure_session()
+        elif kind == 'discord_quit':
+            fakes.FakeDiscordClient.quit()
+        elif kind == 'discord_start':
+            fakes.FakeDiscordClient.start()
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def presence_latencies(changes: List[tuple], messages: List[tuple], field: str = 'details') -> List[float]:
+    """
+    Match each track change with the first presence update showing the new title.
+
+    Args:
+        changes: (time, title) of every track change
+        messages: (time, payload) of every update sent
+        field: Payload key holding the title
+
+    Returns:
+        Latencies in milliseconds for every change that reached the consumer.
+    """
+    latencies = []
+    for changed_at, title in changes:
+        for sent_at, activity in messages:
+            if sent_at >= changed_at and activity.get(field) == title:
+                latencies.append((sent_at - changed_at) * 1000)
+                break
+    return latencies
+
+
+class ScaledScheduler(RefreshScheduler):
+    """
+    Refresh scheduler whose trace-time intervals are replayed `speed` times faster.
+    """
+    speed = 1.0
+
+    def next_interval(self, *args: Any, **kwargs: Any) -> float:
+        return super().next_interval(*args, **kwargs) / self.speed
+
+
+class WakeupCounter:
+    """
+    Wraps MediaWatcher.wait() to count loop wakeups and fallback refreshes.
+    """
+    def __init__(self) -> None:
+        self.wakeups = 0
+        self.fallbacks = 0
+
+    def patch(self) -> Any:
+        wait = MediaWatcher.wait
+        counter = self
+
+        async def counted(watcher: MediaWatcher, timeout: Optional[float]) -> List[str]:
+            events = await wait(watcher, timeout)
+            counter.wakeups += 1
+            counter.fallbacks += not events
+            return events
+
+        return mock.patch.object(MediaWatcher, 'wait', counted)
+
+
+class ArtworkMemory:
+    """
+    Wraps Song.resolve_thumbnail() to record the peak Python memory allocated while
+    each track's artwork is read, processed and uploaded.
+
+    Uses tracemalloc, which sees Python allocations such as copies of the thumbnail
+    but not Pillow's native image buffers. The fake Imgur server runs in the same
+    process, so the uploaded body it receives is included.
+    """
+    def __init__(self) -> None:
+        self.peaks: List[int] = []
+
+    def patch(self) -> Any:
+        resolve = Song.resolve_thumbnail
+        recorder = self
+
+        async def measured(song: Song, thumbnail: Any) -> str:
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+            try:
+                return await resolve(song, thumbnail)
+            finally:
+                recorder.peaks.append(tracemalloc.get_traced_memory()[1] - start)
+
+        return mock.patch.object(Song, 'resolve_thumbnail', measured)
+
+
+class RecordingSink(Sink):
+    """
+    Sink recording every state it receives, taking `delay` seconds per state like a slow consumer.
+    """
+    name = "recorder"
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.received: List[tuple] = []
+
+    async def send(self, state: Dict[str, Any]) -> None:
+        await asyncio.sleep(self.delay)
+        self.received.append((time.perf_counter(), state))
+
+
+class SinkConsumers:
+    """
+    Replaces the configured sinks with a file sink, an HTTP sink with a WebSocket
+    client listening to it, and a slow recording sink.
+    """
+    def __init__(self, directory: str, slow_delay: float) -> None:
+        self.file = FileSink(os.path.join(directory, 'now-playing.json'))
+        self.http = HttpSink('127.0.0.1', 0)
+        self.slow = RecordingSink(slow_delay)
+        self.websocket: List[tuple] = []
+        self.client: Optional[asyncio.Task] = None
+
+    def patch(self) -> Any:
+        return mock.patch.object(app, 'configured_sinks', lambda: [self.file, self.http, self.slow])
+
+    async def listen(self) -> None:
+        """
+        Connect a WebSocket client to the HTTP sink and record the states pushed to it.
+        """
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.http.port)
+        writer.write(b'GET / HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     b'Sec-WebSocket-Key: c2ltdWxhdGlvbiBjbGllbnQ=\r\nSec-WebSocket-Version: 13\r\n\r\n')
+        await reader.readuntil(b'\r\n\r\n')
+        try:
+            while True:
+                _, payload = await read_websocket_frame(reader)
+                self.websocket.append((time.perf_counter(), json.loads(payload)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def report(self, changes: List[tuple]) -> Dict[str, Any]:
+        with open(self.file.path, encoding='utf-8') as file:
+            final = json.load(file)
+        return {
+            'websocket_latency_ms': {q: percentile(presence_latencies(changes, self.websocket, 'title'), q)
+                                     for q in (50, 95, 100)},
+            'websocket_updates': len(self.websocket),
+            'slow_sink_updates': len(self.slow.received),
+            'file_final_title': final['title'],
+        }
+
+
+async def simulate(trace: List[Dict[str, Any]], speed: float, imgur_latency: float, settle: float,
+                   drop_events: float = 0.0, trace_memory: bool = False,
+                   slow_sink: Optional[float] = None, profile: Optional[str] = None) -> Dict[str, Any]:
+    fakes.FakeDiscordClient.reset()
+    fakes.FakeTray.instances.clear()
+    fakes.FakeEvent.drop_rate = drop_events
+    player = Player(trace, speed)
+    stop_event = threading.Event()
+    counter = WakeupCounter()
+    memory = ArtworkMemory()
+    ScaledScheduler.speed = speed
+    if trace_memory:
+        tracemalloc.start()
+    sink_directory = tempfile.mkdtemp(prefix='amrp-sinks-')
+    consumers = SinkConsumers(sink_directory, slow_sink) if slow_sink is not None else None
+    profilers: List[Profiler] = []
+
+    def capture_replay(directory: Path, seconds: float) -> Profiler:
+        # Started with the application and long enough for any replay, it is stopped at quit
+        profilers.append(Profiler(Path(profile), seconds=24 * 3600))
+        return profilers[-1]
+
+    with FakeImgur(latency=imgur_latency) as imgur, \
+            mock.patch('currently_playing.ImgurUploader', partial(ImgurUploader, url=imgur.url)), \
+            mock.patch.object(app, 'RefreshScheduler', ScaledScheduler), counter.patch(), \
+            mock.patch.object(app, 'DISCORD_PROBE_INTERVAL', app.DISCORD_PROBE_INTERVAL / speed), \
+            (memory.patch() if trace_memory else contextlib.nullcontext()), \
+            (consumers.patch() if consumers else contextlib.nullcontext()), \
+            (mock.patch.multiple(app, Profiler=capture_replay, PROFILE_ON_START=True) if profile
+             else contextlib.nullcontext()):
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        application = asyncio.create_task(app.main(stop_event))
+        # Let main() subscribe before the first event fires
+        await asyncio.sleep(0.2)
+        if consumers:
+            consumers.client = asyncio.create_task(consumers.listen())
+        await player.replay()
+        await asyncio.sleep(settle)
+        for tray in fakes.FakeTray.instances:
+            tray.quit()
+        try:
+            await asyncio.wait_for(application, timeout=30)
+        except SystemExit:
+            pass
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        uploads = imgur.uploads
+        uploaded_bytes = imgur.bytes_received
+    written = profilers[0].wait(30) if profilers else None
+    if trace_memory:
+        tracemalloc.stop()
+
+    trace_hours = max(trace[-1]['at'] if trace else 0, 1) / 3600
+    latencies = presence_latencies(player.changes, fakes.FakeDiscordClient.messages)
+    sinks = consumers.report(player.changes) if consumers else None
+    shutil.rmtree(sink_directory, ignore_errors=True)
+    return {
+        'track_changes': len(player.changes),
+        'changes_published': len(latencies),
+        'latency_ms': {q: percentile(latencies, q) for q in (50, 95, 99, 100)},
+        'uploads': uploads,
+        'uploads_per_hour': uploads / trace_hours,
+        'uploaded_bytes': uploaded_bytes,
+        'ipc_messages': len(fakes.FakeDiscordClient.messages),
+        'ipc_connects': fakes.FakeDiscordClient.connects,
+        'winrt_calls': dict(fakes.FakeSessionManager.calls),
+        'wakeups_per_hour': counter.wakeups / trace_hours,
+        'fallback_refreshes_per_hour': counter.fallbacks / trace_hours,
+        'cpu_seconds': cpu,
+        'wall_seconds': wall,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'artwork_peak_kib': {q: percentile([peak / 1024 for peak in memory.peaks], q) for q in (50, 100)},
+        'artwork_resolutions': len(memory.peaks),
+        'sinks': sinks,
+        'profile': [str(path) for path in written] if written else None,
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    latency = report['latency_ms']
+
+    def ms(value: Optional[float]) -> str:
+        return "n/a" if value is None else f"{value:.1f}"
+
+    print(f"track changes:        {report['track_changes']} ({report['changes_published']} reached Discord)")
+    print(f"presence latency ms:  p50 {ms(latency[50])}  p95 {ms(latency[95])}  "
+          f"p99 {ms(latency[99])}  max {ms(latency[100])}")
+    print(f"uploads:              {report['uploads']} ({report['uploads_per_hour']:.1f}/h, "
+          f"{report['uploaded_bytes'] / 1024:.0f} KiB)")
+    print(f"ipc messages:         {report['ipc_messages']} over {report['ipc_connects']} connection(s)")
+    print(f"winrt calls:          {report['winrt_calls']}")
+    print(f"loop wakeups:         {report['wakeups_per_hour']:.1f}/h "
+          f"({report['fallback_refreshes_per_hour']:.1f}/h fallback refreshes)")
+    print(f"cpu time:             {report['cpu_seconds']:.2f}s over {report['wall_seconds']:.1f}s wall")
+    print(f"peak rss:             {report['peak_rss_mb']:.1f} MiB")
+    if report['artwork_resolutions']:
+        artwork = report['artwork_peak_kib']
+        print(f"artwork peak memory:  p50 {artwork[50]:.0f} KiB  max {artwork[100]:.0f} KiB "
+              f"over {report['artwork_resolutions']} artwork resolution(s)")
+    if report['sinks']:
+        sinks = report['sinks']
+        latency = sinks['websocket_latency_ms']
+        print(f"websocket latency ms: p50 {ms(latency[50])}  p95 {ms(latency[95])}  max {ms(latency[100])} "
+              f"over {sinks['websocket_updates']} update(s)")
+        print(f"slow sink updates:    {sinks['slow_sink_updates']} (superseded states were coalesced)")
+        print(f"file sink final:      {sinks['file_final_title']}")
+    if report['profile']:
+        print(f"profile:              {' and '.join(report['profile'])}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trace', help="JSON trace to replay instead of a synthetic one")
+    parser.add_argument('--minutes', type=float, default=20, help="length of the synthetic trace in trace minutes")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic trace")
+    parser.add_argument('--speed', type=float, default=10, help="trace seconds replayed per real second")
+    parser.add_argument('--imgur-latency', type=float, default=0.3, help="seconds the fake Imgur takes per upload")
+    parser.add_argument('--settle', type=float, default=2, help="real seconds to wait after the last event")
+    parser.add_argument('--drop-events', type=float, default=0.0,
+                        help="fraction of playback events of the media session silently lost")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    parser.add_argument('--metrics', action='store_true', help="enable per-stage metrics and print them")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="measure peak Python memory per artwork resolution with tracemalloc")
+    parser.add_argument('--sinks', action='store_true', help="attach local sinks and report their latency")
+    parser.add_argument('--slow-sink', type=float, default=0.0,
+                        help="real seconds the slow sink takes per state, implies --sinks")
+    parser.add_argument('--profile', metavar='DIRECTORY',
+                        help="capture a profile of the whole replay and write it to DIRECTORY")
+    parser.add_argument('--max-latency-ms', type=float, default=100,
+                        help="longest acceptable p95 track change to presence latency")
+    parser.add_argument('--verbose', action='store_true', help="show application logs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL,
+                        format="%(asctime)s :: [%(levelname)s] :: %(message)s")
+
+    app.METRICS_ENABLED = args.metrics
+    trace = load_trace(args.trace) if args.trace else synthetic_trace(args.minutes, args.seed)
+    with tempfile.TemporaryDirectory() as appdata:
+        os.environ['LOCALAPPDATA'] = appdata
+        report = asyncio.run(simulate(trace, args.speed, args.imgur_latency, args.settle, args.drop_events,
+                                      args.trace_memory,
+                                      args.slow_sink if args.sinks or args.slow_sink else None, args.profile))
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+    if args.metrics:
+        print("\n".join(["", "stage metrics:"] + app.metrics.lines()))
+
+    p95 = report['latency_ms'][95]
+    ok = p95 is not None and p95 <= args.max_latency_ms
+    print(f"p95 presence latency within {args.max_latency_ms:g} ms: {'ok' if ok else 'FAILED'}",
+          file=sys.stderr if args.json else sys.stdout)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""
+Soak test: checks that memory stays flat over a very long session.
+
+Pushes tens of thousands of track changes, pauses, Apple Music restarts and
+Discord restarts through the real main() with the fakes of benchmarks.simulate,
+as fast as the application handles them: each event is applied once the loop is
+back to waiting for media events. After a warm-up, RSS, live objects, asyncio
+tasks and threads are sampled at regular checkpoints, and the run fails if any
+of them grew past its bound between the first and the last checkpoint. With
+--monitor, a MemoryMonitor (memory_monitor.py) logs the allocation sites that
+grew over the run. Run from the repository root:
+
+    python -m benchmarks.soak
+    python -m benchmarks.soak --changes 50000 --monitor
+"""
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+from collections import deque
+from functools import partial
+from typing import Any, Dict, List, Optional
+from unittest import mock
+
+import psutil
+
+from benchmarks.simulate import Player, app, artwork_bytes, fakes
+from benchmarks.fake_imgur import FakeImgur
+from imgur import ImgurUploader
+from media_watcher import MediaWatcher
+from memory_monitor import MemoryMonitor
+
+
+def soak_events(changes: int, albums: int, seed: int = 0):
+    """
+    Generate the events of a long session, one track change at a time.
+
+    Args:
+        changes: Number of track changes
+        albums: Number of distinct albums cycled through, above the album index size to exercise its eviction
+        seed: Random seed, so runs are comparable
+
+    Yields:
+        Trace events without timestamps.
+    """
+    rng = random.Random(seed)
+    for change in range(changes):
+        album = f"Album {rng.randrange(albums)}"
+        yield {'event': 'play', 'title': f"{album} Track {change}", 'artist': f"Artist {change % 13}",
+               'album': album, 'duration': rng.randint(150, 300), 'artwork': album}
+        roll = rng.random()
+        if roll < 0.2:
+            yield {'event': 'pause'}
+            yield {'event': 'resume'}
+        elif roll < 0.3:
+            yield {'event': 'seek', 'position': rng.randint(0, 150)}
+        if change % 500 == 499:
+            yield {'event': 'close'}
+            yield {'event': 'open'}
+        if change % 1500 == 1499:
+            yield {'event': 'discord_quit'}
+            yield {'event': 'discord_start'}
+
+
+class CycleWaiter:
+    """
+    Wraps MediaWatcher.wait() to signal each time the main loop finishes a refresh cycle.
+    """
+    def __init__(self) -> None:
+        self.idle = asyncio.Event()
+        self.cycles = 0
+
+    def patch(self) -> Any:
+        wait = MediaWatcher.wait
+        waiter = self
+
+        async def signalled(watcher: MediaWatcher, timeout: Optional[float]) -> List[str]:
+            waiter.cycles += 1
+            waiter.idle.set()
+            return await wait(watcher, timeout)
+
+        return mock.patch.object(MediaWatcher, 'wait', signalled)
+
+    async def settle(self, timeout: float = 5) -> None:
+        self.idle.clear()
+        await asyncio.wait_for(self.idle.wait(), timeout)
+
+
+def sample(process: psutil.Process) -> Dict[str, float]:
+    gc.collect()
+    return {
+        'rss_mib': process.memory_info().rss / 1024 / 1024,
+        'objects': len(gc.get_objects()),
+        'tasks': len(asyncio.all_tasks()),
+        'threads': threading.active_count(),
+    }
+
+
+async def soak(changes: int, albums: int, checkpoints: int, warmup: float, monitor: Optional[MemoryMonitor],
+               seed: int = 0) -> List[Dict[str, float]]:
+    """
+    Run the session through main() and sample resource usage at every checkpoint after the warm-up.
+
+    Returns:
+        One sample per checkpoint, with the number of track changes played so far.
+    """
+    fakes.FakeDiscordClient.reset()
+    fakes.FakeTray.instances.clear()
+    fakes.FakeEvent.drop_rate = 0.0
+    player = Player([], speed=1)
+    # Smaller than simulate's artwork, so rendering hundreds of albums stays quick and the data small
+    player.artwork = {f"Album {album}": artwork_bytes(f"Album {album}", size=300) for album in range(albums)}
+    # Latencies aren't measured here, and a growing list of changes would show up as growth
+    player.changes = deque(maxlen=1)
+    waiter = CycleWaiter()
+    process = psutil.Process()
+    stop_event = threading.Event()
+    every = max(changes // checkpoints, 1)
+    first = int(changes * warmup)
+    samples = []
+
+    with FakeImgur() as imgur, \
+            mock.patch('currently_playing.ImgurUploader', partial(ImgurUploader, url=imgur.url)), waiter.patch():
+        application = asyncio.create_task(app.main(stop_event))
+        await waiter.settle(30)
+        played = 0
+        for event in soak_events(changes, albums, seed):
+            player.apply(event)
+            played += event['event'] == 'play'
+            try:
+                await waiter.settle()
+            except asyncio.TimeoutError:
+                pass
+            if event['event'] == 'play' and played >= first and (played - first) % every == 0:
+                if monitor is not None:
+                    if not monitor.enabled:
+                        monitor.enable()
+                    else:
+                        await asyncio.get_running_loop().run_in_executor(None, monitor.check)
+                samples.append(dict(sample(process), changes=played))
+                print(f"{played:>7} changes: {samples[-1]['rss_mib']:.1f} MiB RSS, {samples[-1]['objects']} objects, "
+                      f"{samples[-1]['tasks']} tasks, {samples[-1]['threads']} threads", flush=True)
+        for tray in fakes.FakeTray.instances:
+            tray.quit()
+        await asyncio.wait_for(application, timeout=30)
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--changes', type=int, default=20000, help="track changes to play")
+    parser.add_argument('--albums', type=int, default=400, help="distinct albums cycled through")
+    parser.add_argument('--checkpoints', type=int, default=10, help="samples taken after the warm-up")
+    parser.add_argument('--warmup', type=float, default=0.2, help="fraction of the changes played before sampling")
+    parser.add_argument('--max-rss-growth', type=float, default=16, help="MiB RSS may grow after the warm-up")
+    parser.add_argument('--max-object-growth', type=int, default=5000,
+                        help="live objects that may be added after the warm-up")
+    parser.add_argument('--monitor', action='store_true',
+                        help="also trace allocations and log the sites that grew, slows the run down")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the session")
+    args = parser.parse_args()
+
+    monitor = MemoryMonitor(top=10) if args.monitor else None
+    logging.basicConfig(level=logging.CRITICAL)
+    if monitor is not None:
+        # Only let the monitor's reports through
+        logging.getLogger().setLevel(logging.INFO)
+        logging.getLogger().handlers[0].addFilter(lambda record: record.getMessage().startswith("Memory growth"))
+    with tempfile.TemporaryDirectory() as appdata:
+        os.environ['LOCALAPPDATA'] = appdata
+        samples = asyncio.run(soak(args.changes, args.albums, args.checkpoints, args.warmup, monitor, args.seed))
+
+    start, end = samples[0], samples[-1]
+    bounds = {
+        'rss_mib': args.max_rss_growth,
+        'objects': args.max_object_growth,
+        'tasks': 2,
+        'threads': 2,
+    }
+    failed = False
+    print(f"\ngrowth from {start['changes']} to {end['changes']} changes:")
+    for name, bound in bounds.items():
+        growth = end[name] - start[name]
+        ok = growth <= bound
+        failed |= not ok
+        print(f"  {name:8} {start[name]:10.1f} -> {end[name]:10.1f}  ({growth:+.1f}, bound {bound})  "
+              f"{'ok' if ok else 'FAILED'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Startup benchmark: import cost of main.py and time from launch to the first presence.
+
+Import cost is measured with `python -X importtime` in a fresh interpreter and
+reported as the cumulative import time of main plus the slowest modules. The
+first presence is measured by launching a fresh interpreter that runs main()
+against a fake media session that is already playing (benchmarks.fakes), and
+timing from process start until the first presence update is sent. Both report
+which heavy dependencies were loaded by then.
+
+By default the Windows-only and external modules are replaced by the fakes, so
+the numbers cover the application's own startup path. On Windows, --real measures
+the import cost with the real winsdk, discordrpc and tray dependencies. Run from
+the repository root:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 10 --top 15
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+HEAVY_MODULES = ('winsdk', 'discordrpc', 'requests', 'psutil', 'pystray', 'PIL', 'dotenv')
+
+HELPERS = f"""
+import os, sys
+HEAVY_MODULES = {HEAVY_MODULES!r}
+
+def loaded():
+    # Leaves out the fakes, which have no file
+    return ','.join(name for name in HEAVY_MODULES if getattr(sys.modules.get(name), '__file__', None))
+"""
+
+FAKE_SETUP = """
+from benchmarks import fakes
+fakes.install()
+os.environ.setdefault('DISCORD_CLIENT_ID', '0')
+os.environ.setdefault('IMGUR_CLIENT_ID', 'startup')
+"""
+
+IMPORT_MAIN = """
+import main
+"""
+
+FIRST_PRESENCE = """
+import asyncio, threading, time
+fakes.FakeDiscordClient.ipc_dir = os.environ['DISCORD_IPC_DIR']
+fakes.FakeDiscordClient.start()
+manager = fakes.FakeSessionManager()
+session = fakes.FakeSession()
+manager.session = session
+session.play('Title', 'Artist', 'Album', 200, b'not an image')
+
+def published(self, **activity):
+    print(f"PRESENCE {time.perf_counter()} {loaded()}", flush=True)
+    os._exit(0)
+
+fakes.FakeDiscordClient.set_activity = published
+import main
+asyncio.run(main.main(threading.Event()))
+"""
+
+
+def import_times(real: bool) -> Tuple[float, List[Tuple[str, float, float]], List[str]]:
+    """
+    Import main.py in a fresh interpreter with -X importtime.
+
+    Returns:
+        Cumulative import time of main in ms, (module, self ms, cumulative ms) for
+        every module imported, and the heavy modules that were loaded.
+    """
+    code = HELPERS + (IMPORT_MAIN if real else FAKE_SETUP + IMPORT_MAIN) + "print(loaded())"
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                            check=True)
+    modules = []
+    total = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        modules.append((name, int(own) / 1000, int(cumulative) / 1000))
+        if name == 'main':
+            total = int(cumulative) / 1000
+    return total, modules, [name for name in result.stdout.strip().split(',') if name]
+
+
+def first_presence() -> Tuple[float, List[str]]:
+    """
+    Launch the application against an already playing fake session.
+
+    Returns:
+        Milliseconds from process start to the first presence update, and the heavy
+        modules that were loaded by then.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, LOCALAPPDATA=directory, DISCORD_IPC_DIR=directory)
+        code = HELPERS + FAKE_SETUP + FIRST_PRESENCE
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env, timeout=60)
+        elapsed = (time.perf_counter() - started) * 1000
+    for line in result.stdout.splitlines():
+        if line.startswith('PRESENCE'):
+            _, _, heavy = (line.split(' ') + [''])[:3]
+            return elapsed, [name for name in heavy.split(',') if name]
+    raise RuntimeError(f"No presence update was sent:\n{result.stderr}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument('--top', type=int, default=10, help="slowest modules to list")
+    parser.add_argument('--real', action='store_true', help="import the real dependencies instead of the fakes")
+    args = parser.parse_args()
+
+    runs = [import_times(args.real) for _ in range(args.runs)]
+    totals = [total for total, _, _ in runs]
+    print(f"import main:          median {statistics.median(totals):.1f} ms, min {min(totals):.1f} ms "
+          f"over {args.runs} runs")
+    print(f"loaded at import:     {', '.join(runs[-1][2]) or 'none of ' + ', '.join(HEAVY_MODULES)}")
+
+    slowest: Dict[str, float] = {}
+    for name, own, _ in runs[-1][1]:
+        slowest[name] = own
+    print("slowest modules (self time, last run):")
+    for name, own in sorted(slowest.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {own:8.1f} ms  {name}")
+
+    if args.real:
+        return
+    presences = [first_presence() for _ in range(args.runs)]
+    latencies = [latency for latency, _ in presences]
+    print(f"launch to presence:   median {statistics.median(latencies):.1f} ms, min {min(latencies):.1f} ms "
+          f"over {args.runs} runs")
+    print(f"loaded by presence:   {', '.join(presences[-1][1]) or 'none of ' + ', '.join(HEAVY_MODULES)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Transition table check: the engine in transitions.py on its own, without the main loop.
+
+Feeds hand-built SongSnapshot pairs to classify() and plan() and compares the
+transition and actions with the expected ones: idle, stopping, new tracks, pausing
+and resuming, seeks, drift within the tolerance, timestamps moving while paused,
+and CONNECT being dropped once Discord is connected. Prints one line per case
+and fails if any differs. Run from the repository root:
+
+    python -m benchmarks.transition_table
+"""
+import os
+import sys
+from typing import List, Optional, Tuple
+
+from benchmarks import fakes
+
+fakes.install()
+os.environ.setdefault('DISCORD_CLIENT_ID', '0')
+os.environ.setdefault('IMGUR_CLIENT_ID', 'transitions')
+
+from currently_playing import SongSnapshot  # noqa: E402  (needs the fakes installed first)
+from transitions import Action, Transition, plan  # noqa: E402
+
+CONNECT, FETCH_ARTWORK, PUBLISH, CLEAR = Action.CONNECT, Action.FETCH_ARTWORK, Action.PUBLISH, Action.CLEAR
+
+
+def song(title: str = 'Title', playing: bool = True, start: Optional[int] = 1000, end: Optional[int] = 1240,
+         album: str = 'Album') -> SongSnapshot:
+    return SongSnapshot(title, 'Artist', album, playing, start, end)
+
+
+# Name, previous snapshot, current snapshot, connected, expected transition and actions
+CASES: List[Tuple[str, Optional[SongSnapshot], Optional[SongSnapshot], bool, Transition, Tuple[Action, ...]]] = [
+    ("nothing playing", None, None, False, Transition.IDLE, ()),
+    ("playback stops", song(), None, True, Transition.STOPPED, (CLEAR,)),
+    ("first song, disconnected", None, song(), False, Transition.NEW_TRACK, (CONNECT, FETCH_ARTWORK, PUBLISH)),
+    ("first song, connected", None, song(), True, Transition.NEW_TRACK, (FETCH_ARTWORK, PUBLISH)),
+    ("next song", song(), song('Other'), True, Transition.NEW_TRACK, (FETCH_ARTWORK, PUBLISH)),
+    ("same title, other album", song(), song(album='Live'), True, Transition.NEW_TRACK, (FETCH_ARTWORK, PUBLISH)),
+    ("paused, disconnected", song(), song(playing=False), False, Transition.PLAYBACK_CHANGED, (CONNECT, PUBLISH)),
+    ("paused, connected", song(), song(playing=False), True, Transition.PLAYBACK_CHANGED, (PUBLISH,)),
+    ("resumed", song(playing=False), song(start=1060, end=1300), True, Transition.PLAYBACK_CHANGED, (PUBLISH,)),
+    ("seeked", song(), song(start=970, end=1210), True, Transition.SEEKED, (PUBLISH,)),
+    ("seeked, disconnected", song(), song(start=970, end=1210), False, Transition.SEEKED, (CONNECT, PUBLISH)),
+    ("timestamps appear", song(start=None, end=None), song(), True, Transition.SEEKED, (PUBLISH,)),
+    ("drift within tolerance", song(), song(start=1002, end=1242), True, Transition.UNCHANGED, ()),
+    ("drift while paused", song(playing=False), song(playing=False, start=1030, end=1270), True,
+     Transition.UNCHANGED, ()),
+    ("unchanged", song(), song(), False, Transition.UNCHANGED, ()),
+]
+
+
+def main() -> None:
+    failed = 0
+    for name, old, new, connected, transition, actions in CASES:
+        got = plan(old, new, connected, drift_tolerance=2)
+        ok = got == (transition, actions)
+        failed += not ok
+        result = 'ok' if ok else f"FAILED, got {got[0].value} {[action.value for action in got[1]]}"
+        print(f"{name:26} {transition.value:16} {[action.value for action in actions]}  {result}")
+    print(f"{len(CASES) - failed}/{len(CASES)} cases passed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+WinRT stall check: the presence survives a hung media session.
+
+Runs the real main() against the fake media session (benchmarks.fakes), makes
+the chosen asynchronous WinRT calls hang while Apple Music keeps firing events
+and switches to a new track, then lets them complete again. Reports:
+
+- how many calls stalled and how often the session manager handle was rebuilt
+- the worst event loop lag during the hang, which stays small because stalled
+  calls are abandoned at their deadline instead of blocking the loop
+- what Discord showed during the hang: the last known good track, never cleared
+- how long after the hang ended the new track reached Discord
+
+WINRT_TIMEOUT is lowered for the run unless set. Run from the repository root:
+
+    python -m benchmarks.winrt_stall
+    python -m benchmarks.winrt_stall --hang request_async try_get_media_properties_async --seconds 10
+"""
+import os
+
+os.environ.setdefault('WINRT_TIMEOUT', '0.5')
+
+import argparse  # noqa: E402
+import asyncio  # noqa: E402
+import logging  # noqa: E402
+import tempfile  # noqa: E402
+import threading  # noqa: E402
+import time  # noqa: E402
+from functools import partial  # noqa: E402
+from typing import Any, Dict, List  # noqa: E402
+from unittest import mock  # noqa: E402
+
+from benchmarks.simulate import app, artwork_bytes, fakes  # noqa: E402
+from benchmarks.fake_imgur import FakeImgur  # noqa: E402
+from imgur import ImgurUploader  # noqa: E402
+
+
+async def measure_lag(lags: List[float], interval: float = 0.01) -> None:
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def wait_for_title(title: str, timeout: float = 30) -> float:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if any(activity.get('details') == title for _, activity in fakes.FakeDiscordClient.messages):
+            return time.perf_counter()
+        await asyncio.sleep(0.01)
+    raise TimeoutError(f"{title} never reached Discord")
+
+
+async def stall(hang: List[str], seconds: float) -> Dict[str, Any]:
+    fakes.FakeDiscordClient.reset()
+    fakes.FakeTray.instances.clear()
+    manager = fakes.FakeSessionManager()
+    session = fakes.FakeSession()
+    manager.set_session(session)
+    artwork = artwork_bytes('stall', size=300)
+    session.play('Before the hang', 'Artist', 'Album', 240, artwork)
+    app.METRICS_ENABLED = True
+    stop_event = threading.Event()
+
+    with FakeImgur() as imgur, mock.patch('currently_playing.ImgurUploader', partial(ImgurUploader, url=imgur.url)):
+        application = asyncio.create_task(app.main(stop_event))
+        await wait_for_title('Before the hang')
+        sent_before = len(fakes.FakeDiscordClient.messages)
+
+        lags: List[float] = []
+        ticker = asyncio.create_task(measure_lag(lags))
+        fakes.FakeSessionManager.hanging.update(hang)
+        hang_start = time.perf_counter()
+        session.play('After the hang', 'Artist', 'Other album', 240, artwork)
+        while time.perf_counter() - hang_start < seconds:
+            # Apple Music keeps firing events while it is busy
+            await asyncio.sleep(0.2)
+            session.timeline_properties_changed.fire(session)
+        during = fakes.FakeDiscordClient.messages[sent_before:]
+        ticker.cancel()
+
+        fakes.FakeSessionManager.hanging.clear()
+        released = time.perf_counter()
+        session.timeline_properties_changed.fire(session)
+        published = await wait_for_title('After the hang')
+
+        for tray in fakes.FakeTray.instances:
+            tray.quit()
+        await asyncio.wait_for(application, timeout=30)
+
+    counters = app.metrics.summary()['counters']
+    return {
+        'stalls': counters.get('winrt_stalls', 0),
+        'rebuilds': counters.get('winrt_rebuilds', 0),
+        'max_loop_lag_ms': max(lags) * 1000 if lags else 0.0,
+        'messages_during_hang': len(during),
+        'cleared_during_hang': any(not activity for _, activity in during),
+        'shown_during_hang': [activity.get('details') for _, activity in during],
+        'recovery_ms': (published - released) * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hang', nargs='+', default=['try_get_media_properties_async'],
+                        choices=sorted(fakes.FakeSessionManager().calls), help="WinRT calls that hang")
+    parser.add_argument('--seconds', type=float, default=5, help="real seconds the calls hang for")
+    parser.add_argument('--verbose', action='store_true', help="show application logs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL,
+                        format="%(asctime)s :: [%(levelname)s] :: %(message)s")
+    with tempfile.TemporaryDirectory() as appdata:
+        os.environ['LOCALAPPDATA'] = appdata
+        report = asyncio.run(stall(args.hang, args.seconds))
+
+    print(f"hanging calls:        {', '.join(args.hang)} for {args.seconds:.1f}s "
+          f"(deadline {os.environ['WINRT_TIMEOUT']}s)")
+    print(f"stalled calls:        {report['stalls']}, manager rebuilds {report['rebuilds']}")
+    print(f"worst loop lag:       {report['max_loop_lag_ms']:.1f} ms")
+    print(f"discord during hang:  {report['messages_during_hang']} update(s) {report['shown_during_hang']}, "
+          f"{'cleared' if report['cleared_during_hang'] else 'never cleared'}")
+    print(f"new track after hang: {report['recovery_ms']:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import os
+from dotenv import load_dotenv
+from artwork import ARTWORK_FORMATS
+
+# Configuration is read once at startup, from the environment and an optional .env file
+load_dotenv()
+
+# Required to run the application; None if unset, so `--control` works without it and main.py refuses to start
+DISCORD_CLIENT_ID = int(os.environ["DISCORD_CLIENT_ID"]) if os.getenv("DISCORD_CLIENT_ID") else None
+IMGUR_CLIENT_ID = os.getenv("IMGUR_CLIENT_ID")
+
+# Presence
+PRESENCE_DRIFT_TOLERANCE = int(os.getenv("PRESENCE_DRIFT_TOLERANCE", 2))
+# Directory holding Discord's discord-ipc-N endpoints, the named pipe namespace on Windows
+DISCORD_IPC_DIR = os.getenv("DISCORD_IPC_DIR") or (
+    '\\\\.\\pipe\\' if os.name == 'nt' else
+    next((os.environ[var] for var in ('XDG_RUNTIME_DIR', 'TMPDIR', 'TMP', 'TEMP') if os.environ.get(var)), '/tmp')
+)
+DISCORD_PROBE_INTERVAL = float(os.getenv("DISCORD_PROBE_INTERVAL", 5))
+
+# Media session
+WINRT_TIMEOUT = float(os.getenv("WINRT_TIMEOUT", 5))
+WINRT_REBUILD_AFTER = int(os.getenv("WINRT_REBUILD_AFTER", 3))
+
+# Artwork
+ARTWORK_MAX_EDGE = int(os.getenv("ARTWORK_MAX_EDGE", 512))
+# Case insensitive, and checked here so a bad value fails at startup instead of on every upload
+ARTWORK_FORMAT = os.getenv("ARTWORK_FORMAT", "JPEG").upper()
+ARTWORK_FORMAT = "JPEG" if ARTWORK_FORMAT == "JPG" else ARTWORK_FORMAT
+if ARTWORK_FORMAT not in ARTWORK_FORMATS:
+    raise ValueError(f"Unsupported ARTWORK_FORMAT '{ARTWORK_FORMAT}', expected one of {', '.join(ARTWORK_FORMATS)}")
+ARTWORK_QUALITY = int(os.getenv("ARTWORK_QUALITY", 85))
+ARTWORK_MAX_BYTES = int(float(os.getenv("ARTWORK_MAX_MB", 8)) * 1024 * 1024)
+# Most of the 64 perceptual hash bits two covers may differ in to share an upload, negative to disable
+ARTWORK_SIMILARITY_THRESHOLD = int(os.getenv("ARTWORK_SIMILARITY_THRESHOLD", 3))
+# Seconds between writes of changed artwork caches to disk, which also happen at shutdown
+ARTWORK_CACHE_FLUSH_INTERVAL = float(os.getenv("ARTWORK_CACHE_FLUSH_INTERVAL", 30))
+
+# Refresh scheduling
+REFRESH_FAST_INTERVAL = float(os.getenv("REFRESH_FAST_INTERVAL", 2))
+REFRESH_PAUSED_INTERVAL = float(os.getenv("REFRESH_PAUSED_INTERVAL", 120))
+REFRESH_IDLE_INTERVAL = float(os.getenv("REFRESH_IDLE_INTERVAL", 60))
+REFRESH_MAX_INTERVAL = float(os.getenv("REFRESH_MAX_INTERVAL", 300))
+
+# Metrics and logging
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_INTERVAL = int(os.getenv("METRICS_INTERVAL", 600))
+LOG_MAX_BYTES = int(float(os.getenv("LOG_MAX_MB", 20)) * 1024 * 1024)
+LOG_RETENTION_DAYS = float(os.getenv("LOG_RETENTION_DAYS", 14))
+MEMORY_MONITOR_ENABLED = os.getenv("MEMORY_MONITOR_ENABLED", "0") == "1"
+MEMORY_MONITOR_INTERVAL = int(os.getenv("MEMORY_MONITOR_INTERVAL", 3600))
+MEMORY_MONITOR_FRAMES = int(os.getenv("MEMORY_MONITOR_FRAMES", 1))
+# Profile captures, also started from the tray; on start covers the launch phase
+PROFILE_ON_START = os.getenv("PROFILE_ON_START", "0") == "1"
+PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", 60))
+# Captures kept in their own folder, next to the logs but outside the logs' size cap
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 10))
+
+# Headless mode runs without the tray, e.g. on kiosk and VDI machines; also set with --headless
+HEADLESS = os.getenv("HEADLESS", "0") == "1"
+# Local control endpoint for status, refresh and quit commands, published with a token to the user only.
+# Unset, only headless instances, which have no tray, listen for commands
+CONTROL_ENABLED = {"1": True, "0": False}.get(os.getenv("CONTROL_ENABLED", ""))
+CONTROL_HOST = os.getenv("CONTROL_HOST", "127.0.0.1")
+# 0 picks a free port, so every session on a shared host gets its own
+CONTROL_PORT = int(os.getenv("CONTROL_PORT", 0))
+
+# Now playing sinks for local consumers such as overlays, all disabled by default
+SINK_FILE = os.getenv("SINK_FILE")
+SINK_FILE_FORMAT = os.getenv("SINK_FILE_FORMAT", "{artist} - {title}")
+SINK_HTTP_HOST = os.getenv("SINK_HTTP_HOST", "127.0.0.1")
+SINK_HTTP_PORT = int(os.getenv("SINK_HTTP_PORT")) if os.getenv("SINK_HTTP_PORT") else None
+SINK_PLUGINS = os.getenv("SINK_PLUGINS", "")
+# Comma separated web page origins, e.g. http://localhost:8080, allowed to read the HTTP sink; * allows any
+SINK_HTTP_ORIGINS = os.getenv("SINK_HTTP_ORIGINS", "")
@@ -0,0 +1,189 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+import socket
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Set
+import local_server
+from artwork_cache import default_cache_path
+from config import CONTROL_HOST, CONTROL_PORT
+
+
+def default_endpoint_path() -> Path:
+    """
+    Get the file a running instance publishes its control endpoint in.
+
+    Returns:
+        Path to the endpoint file under %LOCALAPPDATA%/amrp-py, which only the user can read.
+    """
+    return default_cache_path("control.json")
+
+
+class ControlServer:
+    """
+    Local control endpoint for a running instance, e.g. one started headless.
+
+    The server listens on the loopback interface, on a free port unless one is
+    configured, and writes the port with a random token into an endpoint file in
+    the user's profile. Clients first send the token, then one command per line,
+    and get one line of JSON back, either {"ok": true, "result": ...} or
+    {"ok": false, "error": ...}. Loopback is shared by every session on a host, so
+    without the token, which only the user can read, other users' clients are
+    turned away, and each session's instance listens on its own port.
+
+    The commands are plain callables run on the loop thread, so they must return quickly.
+    """
+    def __init__(self, commands: Dict[str, Callable[[], Any]], host: str = CONTROL_HOST, port: int = CONTROL_PORT,
+                 endpoint: Optional[Path] = None, client_timeout: float = 5) -> None:
+        """
+        Initialize the server without listening yet.
+
+        Args:
+            commands: Callables by command name, whose JSON serializable result is sent back
+            host: Interface to listen on
+            port: Port to listen on, 0 to pick a free one
+            endpoint: File the port and token are written to, or None for the default one
+            client_timeout: Seconds a client may stay silent before it is disconnected
+        """
+        logging.info(f"Initializing control server on {host}:{port}")
+        self.commands = commands
+        self.host = host
+        self.port = port
+        self.endpoint = endpoint if endpoint is not None else default_endpoint_path()
+        self.token = secrets.token_urlsafe(32)
+        self.client_timeout = client_timeout
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.clients: Set[asyncio.StreamWriter] = set()
+
+    async def start(self) -> None:
+        """
+        Listen for clients and publish the endpoint for them.
+
+        Returns:
+            None
+
+        Raises:
+            OSError: If the port can't be bound or the endpoint file can't be written
+        """
+        self.server, self.port = await local_server.listen(self.handle, self.host, self.port)
+        try:
+            self.publish()
+        except OSError:
+            await self.close()
+            raise
+        logging.info(f"Accepting control commands on {self.host}:{self.port}: {', '.join(self.commands)}")
+
+    def publish(self) -> None:
+        """
+        Write the endpoint file, readable by the user only, replacing the previous one atomically.
+
+        Returns:
+            None
+        """
+        self.endpoint.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.endpoint.with_suffix(".tmp")
+        if tmp.exists():
+            tmp.unlink()
+        # Created owner only on POSIX, on Windows the profile directory is private to the user already
+        with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w", encoding="utf-8") as f:
+            json.dump({'host': self.host, 'port': self.port, 'token': self.token, 'pid': os.getpid()}, f)
+        os.replace(tmp, self.endpoint)
+
+    async def close(self) -> None:
+        await local_server.close(self.server, self.clients)
+        self.server = None
+        try:
+            # Only if it is still ours, a later instance of the user may have replaced it
+            with open(self.endpoint, encoding="utf-8") as f:
+                ours = json.load(f).get('token') == self.token
+            if ours:
+                self.endpoint.unlink()
+        except (OSError, ValueError, AttributeError) as e:
+            logging.debug(f"Could not remove control endpoint file: {e!r}")
+
+    def run(self, command: str) -> Dict[str, Any]:
+        """
+        Run a command and build its reply.
+
+        Args:
+            command: Command name as received, surrounding whitespace ignored
+
+        Returns:
+            The reply to send.
+        """
+        handler = self.commands.get(command.strip().lower())
+        if handler is None:
+            return {'ok': False, 'error': f"unknown command {command.strip()!r}", 'commands': list(self.commands)}
+        logging.info(f"Running control command {command.strip()}")
+        try:
+            return {'ok': True, 'result': handler()}
+        except Exception as e:
+            logging.error(f"Control command {command.strip()} failed: {e!r}")
+            return {'ok': False, 'error': repr(e)}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Check a client's token, then answer its commands until it disconnects or goes quiet.
+
+        Args:
+            reader: Reader of the client connection
+            writer: Writer of the client connection
+
+        Returns:
+            None
+        """
+        self.clients.add(writer)
+        try:
+            token = await asyncio.wait_for(reader.readline(), self.client_timeout)
+            if not hmac.compare_digest(token.strip(), self.token.encode()):
+                logging.warning("Control client sent a wrong token, disconnecting it")
+                writer.write(json.dumps({'ok': False, 'error': "wrong token"}).encode() + b'\n')
+                await asyncio.wait_for(writer.drain(), self.client_timeout)
+                return
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.client_timeout)
+                if not line:
+                    return
+                reply = self.run(line.decode('utf-8', 'replace'))
+                writer.write(json.dumps(reply, default=str).encode() + b'\n')
+                await asyncio.wait_for(writer.drain(), self.client_timeout)
+        except (OSError, ValueError, asyncio.LimitOverrunError, asyncio.TimeoutError) as e:
+            logging.debug(f"Control client failed: {e!r}")
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+
+def send_command(command: str, endpoint: Optional[Path] = None, timeout: float = 5) -> Dict[str, Any]:
+    """
+    Send one command to the user's running instance and wait for its reply.
+
+    Args:
+        command: Command name, e.g. status, refresh or quit
+        endpoint: Endpoint file written by the instance's control server, or None for the default one
+        timeout: Seconds to wait for the connection and the reply
+
+    Returns:
+        The decoded reply.
+
+    Raises:
+        OSError: If no instance published an endpoint, or it didn't answer in time
+    """
+    endpoint = endpoint if endpoint is not None else default_endpoint_path()
+    try:
+        with open(endpoint, encoding="utf-8") as f:
+            published = json.load(f)
+        address, token = (published['host'], int(published['port'])), published['token']
+    except FileNotFoundError:
+        raise OSError(f"no running instance published a control endpoint in {endpoint}")
+    except (ValueError, KeyError, TypeError) as e:
+        raise OSError(f"unreadable control endpoint file {endpoint}: {e!r}")
+    with socket.create_connection(address, timeout=timeout) as connection:
+        connection.sendall(token.encode() + b'\n' + command.encode() + b'\n')
+        reply = connection.makefile('rb').readline()
+    if not reply:
+        raise OSError("connection closed without a reply")
+    return json.loads(reply)
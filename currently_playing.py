@@ -2,18 +2,83 @@ from winsdk.windows.media.control import GlobalSystemMediaTransportControlsSessi
 from winsdk.windows.media.control import GlobalSystemMediaTransportControlsSessionManager as MediaManager
 from winsdk.windows.storage.streams import DataReader, IRandomAccessStreamReference
 import asyncio
-import io
 import re
-import os
 import time
 import logging
-from dotenv import load_dotenv
-import requests
-from typing import List, Optional, Union
+from typing import Any, List, Optional, Tuple
+from artwork import artwork_hash, prepare_artwork
+from artwork_cache import AlbumIndex, ArtworkCache, SimilarArtworkIndex
+from config import ARTWORK_FORMAT, ARTWORK_MAX_BYTES, ARTWORK_MAX_EDGE, ARTWORK_QUALITY, IMGUR_CLIENT_ID
+from imgur import ImgurUploader
+from metrics import metrics
+from winrt_watchdog import WinRTWatchdog
 
+# Bytes loaded from the thumbnail stream per read
+THUMBNAIL_CHUNK_SIZE = 64 * 1024
 
-load_dotenv()
-IMGUR_CLIENT_ID = os.getenv("IMGUR_CLIENT_ID")
+
+class SongSnapshot:
+    """
+    Immutable, hashable view of the song state at one refresh.
+
+    Snapshots are compared between refreshes to decide what work is needed,
+    so they only hold the fields that drive presence updates.
+    """
+    __slots__ = ('title', 'artist', 'album', 'playing', 'start', 'end')
+
+    def __init__(self, title: str, artist: str, album: str, playing: bool,
+                 start: Optional[int] = None, end: Optional[int] = None) -> None:
+        for name, value in zip(self.__slots__, (title, artist, album, playing, start, end)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def astuple(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, SongSnapshot):
+            return NotImplemented
+        return self.astuple() == other.astuple()
+
+    def __hash__(self) -> int:
+        return hash(self.astuple())
+
+    def __repr__(self) -> str:
+        return f"SongSnapshot{self.astuple()}"
+
+    @property
+    def identity(self) -> Tuple[str, str, str]:
+        """
+        Get the fields identifying the track.
+
+        Returns:
+            Tuple of title, artist and album.
+        """
+        return self.title, self.artist, self.album
+
+    def drifted(self, other: "SongSnapshot", tolerance: int) -> bool:
+        """
+        Check whether the timestamps moved further than a tolerance, i.e. the user seeked.
+
+        Args:
+            other: Snapshot to compare against
+            tolerance: Seconds the timestamps may differ by
+
+        Returns:
+            True if either timestamp differs by more than the tolerance
+        """
+        for mine, theirs in ((self.start, other.start), (self.end, other.end)):
+            if mine is None or theirs is None:
+                if mine is not theirs:
+                    return True
+            elif abs(mine - theirs) > tolerance:
+                return True
+        return False
 
 class Song:
     """
@@ -22,18 +87,35 @@ class Song:
     This class handles fetching, storing, and managing information about the
     currently playing song in Apple Music, including its metadata and playback status.
     """
-    def __init__(self) -> None:
+    def __init__(self, artwork_cache: Optional[ArtworkCache] = None, uploader: Optional[ImgurUploader] = None,
+                 album_index: Optional[AlbumIndex] = None, watchdog: Optional[WinRTWatchdog] = None,
+                 similar_artwork: Optional[SimilarArtworkIndex] = None) -> None:
         """
         Initialize a new Song object with default values.
 
         All attributes are initialized to None or default values and will be
         populated when get_info() is called.
+
+        Args:
+            artwork_cache: Cache of previously uploaded thumbnails, or None to always upload
+            uploader: Imgur uploader to use, or None to create one from IMGUR_CLIENT_ID
+            album_index: Index of artwork links by album, or None to read every thumbnail
+            watchdog: Deadline for WinRT calls, or None for one with the configured deadline
+            similar_artwork: Index of artwork links by perceptual hash, or None to only reuse identical thumbnails
         """
         logging.info("Initializing new Song object")
+        self.artwork_cache = artwork_cache
+        self.uploader = uploader if uploader is not None else ImgurUploader(IMGUR_CLIENT_ID)
+        self.album_index = album_index
+        self.watchdog = watchdog if watchdog is not None else WinRTWatchdog()
+        self.similar_artwork = similar_artwork
         self.title: Optional[str] = None
         self.artist: Optional[str] = None
         self.album: Optional[str] = None
-        self.image: Optional[Union[IRandomAccessStreamReference, str]] = None
+        # False when Apple Music gave no album and the artist stands in for it
+        self.album_known: bool = False
+        self.image: Optional[str] = None
+        self.thumbnail: Optional[IRandomAccessStreamReference] = None
         self.ts: Optional[List[int]] = None
         self.playing: bool = False
         self.paused: Optional[int] = None
@@ -47,14 +129,17 @@ class Song:
         """
         return f"Title: {self.title} \nArtist: {self.artist} \nAlbum: {self.album} \nImage: {self.image} \nTimestamps: {self.ts} \nPlaying: {self.playing} \nPause timer: {self.paused}"
 
-    def listview(self) -> List[Optional[Union[str, bool]]]:
+    def snapshot(self) -> Optional[SongSnapshot]:
         """
-        Get quick access to non-static song information.
+        Capture the presence-relevant song state.
 
         Returns:
-            List containing title, artist, album, and playing status.
+            A SongSnapshot, or None if no song is loaded.
         """
-        return [self.title, self.artist, self.album, self.playing]
+        if self.title is None or self.artist is None or self.album is None:
+            return None
+        start, end = self.ts if self.ts else (None, None)
+        return SongSnapshot(self.title, self.artist, self.album, self.playing, start, end)
 
     def pause(self) -> None:
         """
@@ -76,30 +161,48 @@ class Song:
             logging.info("Song resumed, resetting pause timer")
             self.paused = None
 
-    async def get_info(self, difference: bool) -> None:
+    async def get_info(self, sessions: Optional[MediaManager] = None) -> None:
         """
         Fetch and update song information from the media session.
 
         Gets the current song information from the Windows Media API and updates
         the Song object's attributes accordingly.
 
+        The thumbnail reference is refreshed every time, while the resolved image
+        link is left to the main loop, which takes it from indexed_artwork() or has
+        publish_artwork() resolve it with resolve_thumbnail() on a new track.
+
+        WinRT calls are awaited through the watchdog. If one stalls, the song is left
+        untouched, so the last known good state stays published.
+
         Args:
-            difference: If True, forces an update of the song's thumbnail
+            sessions: Session manager to query, or None to request a new one
 
         Returns:
             None
         """
         logging.info("Fetching current song information")
         current_time = int(time.time())
-        sessions = await MediaManager.request_async()
-
-        # Early return if no media session available
-        if not sessions or not sessions.get_current_session():
-            logging.info("No media session available, resetting song info")
-            self.reset()
+        try:
+            if sessions is None:
+                with metrics.span('winrt_request_async'):
+                    sessions = await self.watchdog.call('request_async', MediaManager.request_async())
+
+            # Early return if no media session available
+            if not sessions or not sessions.get_current_session():
+                logging.info("No media session available, resetting song info")
+                self.reset()
+                return
+
+            current_session = sessions.get_current_session()
+            # Awaited before anything is updated, so a stall leaves the whole song as it was
+            with metrics.span('winrt_media_properties'):
+                media = await self.watchdog.call('try_get_media_properties_async',
+                                                 current_session.try_get_media_properties_async())
+        except asyncio.TimeoutError:
+            logging.warning("Media session didn't respond, keeping the last known song info")
             return
 
-        current_session = sessions.get_current_session()
         info = current_session.get_playback_info()
 
         # Early return if no playback info
@@ -125,17 +228,13 @@ class Song:
             self.ts = []
             logging.debug("No timeline information available")
 
-        # Get media properties
-        media = await current_session.try_get_media_properties_async()
+        # Check media properties
         if not media:
             logging.info("No media properties available, resetting song info")
             self.reset()
             return
 
-        # Update thumbnail if needed
-        if self.image is None or difference:
-            logging.info("Updating song thumbnail")
-            self.image = media.thumbnail
+        self.thumbnail = media.thumbnail
 
         # Parse artist and album
         artist_album = media.artist or None
@@ -150,11 +249,13 @@ class Song:
                 artist, album = artist_album.split("—")
                 self.artist = artist.strip()
                 self.album = album.strip()
+                self.album_known = True
                 logging.debug(f"Parsed artist: '{self.artist}' and album: '{self.album}'")
             # If EM-dash not available define artist and album both as album
             else:
                 self.artist = artist_album.strip()
                 self.album = artist_album.strip()
+                self.album_known = False
                 logging.debug(f"Using artist_album as both artist and album: '{artist_album}'")
 
         # Set title
@@ -166,70 +267,125 @@ class Song:
         else:
             logging.debug("No title available in media properties")
 
-    async def convert_thumbnail(self) -> None:
+    def album_key(self) -> Optional[Tuple[str, str]]:
         """
-        Convert the song's thumbnail to a usable image URL.
+        Get the song's key in the album index.
 
-        If the image is an IRandomAccessStreamReference object, converts it to a BytesIO
-        object and uploads it to Imgur. Otherwise, sets it to 'default'.
+        Songs without a known album have none: the artist standing in for the album
+        would make every such song by the artist share the first one's artwork.
 
         Returns:
-            None
+            The album index key, or None if there is no index or no known album.
         """
-        logging.info("Converting song thumbnail")
+        if self.album_index is None or not self.album_known:
+            return None
+        return self.album_index.key(self.artist, self.album)
 
-        async def process_thumbnail() -> io.BytesIO:
-            """
-            Transform IRandomAccessStreamReference into a BytesIO object.
-
-            Returns:
-                An io.BytesIO object containing the thumbnail data.
-            """
-            logging.debug("Processing thumbnail from IRandomAccessStreamReference")
-            stream = await self.image.open_read_async()
-            reader = DataReader(stream)
-            size = stream.size
-            await reader.load_async(size)
-            buffer = reader.read_buffer(size)
-            return io.BytesIO(bytes(memoryview(buffer)))
-
-        def upload(image: io.BytesIO) -> str:
-            """
-            Upload the image to Imgur and return the link.
-
-            Args:
-                image: BytesIO object containing the thumbnail data
-
-            Returns:
-                Either an Imgur link or 'default' if upload fails
-            """
-            logging.info("Uploading thumbnail to Imgur")
-            image.seek(0)
-            headers = {'Authorization': f'Client-ID {IMGUR_CLIENT_ID}'}
-            try:
-                response = requests.post(
-                    "https://api.imgur.com/3/image",
-                    headers=headers,
-                    files={'image': image}
-                )
-                if response.status_code == 200:
-                    link = response.json().get('data').get('link')
-                    logging.info(f"Thumbnail uploaded successfully: {link}")
-                    return link
-                else:
-                    logging.warning(f"Failed to upload thumbnail: HTTP {response.status_code}")
-                    return 'default'
-            except Exception as e:
-                logging.error(f"Error uploading thumbnail: {e}")
-                return 'default'
-
-        if isinstance(self.image, IRandomAccessStreamReference):
-            thumbnail_data = await process_thumbnail()
-            self.image = upload(thumbnail_data)
-        else:
-            logging.info("No valid thumbnail found, using default")
-            self.image = 'default'
+    def indexed_artwork(self) -> Optional[str]:
+        """
+        Get the artwork link already resolved for the song's album, if any.
 
+        Returns:
+            The image link from the album index, or None on a miss.
+        """
+        if self.album_index is None:
+            return None
+        return self.album_index.get(self.album_key())
+
+    def artwork_needs_check(self) -> bool:
+        """
+        Tell whether the indexed artwork of the song's album is still to be checked against its thumbnail.
+
+        Returns:
+            True if resolve_thumbnail() would read the thumbnail despite the album index hit.
+        """
+        return self.album_index is not None and self.album_index.needs_check(self.album_key())
+
+    async def resolve_thumbnail(self, thumbnail: Optional[IRandomAccessStreamReference]) -> str:
+        """
+        Resolve a thumbnail to a usable image URL without modifying the song.
+
+        If the song's album is in the album index, its link is returned without reading
+        the thumbnail, except on the first hit on the entry: then the thumbnail is read
+        and compared with the one the entry was resolved from, and the entry is
+        invalidated and the thumbnail resolved anew if they differ. Otherwise, if the thumbnail is an IRandomAccessStreamReference object,
+        streams it into memory, downscales and re-encodes it, and uploads it to Imgur, reusing
+        the link from the artwork cache when the same thumbnail was uploaded before, or from the
+        similar artwork index when a visually identical one was. Thumbnails over ARTWORK_MAX_BYTES
+        are not read. Processing and upload run off the event loop and can be cancelled.
+
+        Args:
+            thumbnail: Thumbnail reference as stored in Song.thumbnail
+
+        Returns:
+            The image link, or 'default' if there is no usable thumbnail.
+        """
+        logging.info("Converting song thumbnail")
+        album_key = self.album_key()
+        indexed = self.album_index.get(album_key) if album_key is not None else None
+        expected = None
+        if indexed is not None:
+            logging.info(f"Thumbnail found in album index: {indexed}")
+            metrics.count('album_index_hits')
+            expected = self.album_index.claim_check(album_key)
+            if expected is None or not isinstance(thumbnail, IRandomAccessStreamReference):
+                return indexed
+            logging.info("Checking the album index entry against the thumbnail")
+
+        if not isinstance(thumbnail, IRandomAccessStreamReference):
+            logging.info("No valid thumbnail found, using default")
+            return 'default'
+
+        with metrics.span('thumbnail_read'):
+            read = await read_thumbnail(thumbnail, ARTWORK_MAX_BYTES, self.watchdog)
+        if read is None:
+            return indexed or 'default'
+        thumbnail_data, key = read
+        if indexed is not None:
+            if key == expected:
+                return indexed
+            logging.info(f"Artwork differs from the album index entry for {album_key}, invalidating it")
+            metrics.count('album_index_invalidations')
+            self.album_index.invalidate(album_key)
+        if self.artwork_cache is not None:
+            cached = self.artwork_cache.get(key)
+            if cached is not None:
+                logging.info(f"Thumbnail found in artwork cache: {cached}")
+                metrics.count('artwork_cache_hits')
+                if self.album_index is not None:
+                    self.album_index.put(album_key, cached, key)
+                return cached
+
+        loop = asyncio.get_running_loop()
+        perceptual = None
+        if self.similar_artwork is not None:
+            with metrics.span('artwork_hash'):
+                perceptual = await loop.run_in_executor(None, artwork_hash, thumbnail_data)
+            similar = self.similar_artwork.nearest(perceptual) if perceptual is not None else None
+            if similar is not None:
+                logging.info(f"Similar thumbnail found in artwork index: {similar}")
+                metrics.count('similar_artwork_hits')
+                if self.artwork_cache is not None:
+                    self.artwork_cache.put(key, similar)
+                if self.album_index is not None:
+                    self.album_index.put(album_key, similar, key)
+                return similar
+
+        with metrics.span('prepare_artwork'):
+            prepared = await loop.run_in_executor(
+                None, prepare_artwork, thumbnail_data, ARTWORK_MAX_EDGE, ARTWORK_FORMAT, ARTWORK_QUALITY
+            )
+        with metrics.span('upload'):
+            link = await self.uploader.upload(prepared)
+        metrics.count('uploads' if link != 'default' else 'upload_failures')
+        if link != 'default':
+            if self.artwork_cache is not None:
+                self.artwork_cache.put(key, link)
+            if self.album_index is not None:
+                self.album_index.put(album_key, link, key)
+            if self.similar_artwork is not None and perceptual is not None:
+                self.similar_artwork.add(perceptual, link)
+        return link
 
     def reset(self) -> None:
         """
@@ -245,7 +401,58 @@ class Song:
         self.title = None
         self.artist = None
         self.album = None
+        self.album_known = False
         self.image = None
+        self.thumbnail = None
         self.ts = None
         self.playing = False
         self.paused = None
+
+
+async def read_thumbnail(thumbnail: IRandomAccessStreamReference, max_bytes: int, watchdog: WinRTWatchdog,
+                         chunk_size: int = THUMBNAIL_CHUNK_SIZE) -> Optional[Tuple[memoryview, str]]:
+    """
+    Stream a thumbnail into memory, computing its artwork cache key on the way.
+
+    The stream is loaded in chunks, each copied once from the WinRT buffer into a
+    single buffer allocated for the whole thumbnail and hashed in place, so no
+    intermediate bytes objects are created. The stream's reported size is checked
+    against max_bytes before anything is read.
+
+    Args:
+        thumbnail: Thumbnail reference from the media session
+        max_bytes: Largest thumbnail in bytes that is read
+        watchdog: Deadline for the WinRT stream calls
+        chunk_size: Bytes loaded from the stream per read
+
+    Returns:
+        A view of the thumbnail bytes and its cache key, or None if the thumbnail is empty or too large.
+
+    Raises:
+        asyncio.TimeoutError: If a stream call stalled
+    """
+    logging.debug("Reading thumbnail from IRandomAccessStreamReference")
+    stream = await watchdog.call('open_read_async', thumbnail.open_read_async())
+    size = stream.size
+    if not size:
+        logging.info("Thumbnail is empty, using default")
+        return None
+    if size > max_bytes:
+        logging.warning(f"Thumbnail is {size} bytes, over the {max_bytes} byte limit, using default")
+        metrics.count('artwork_too_large')
+        return None
+
+    data = bytearray(size)
+    view = memoryview(data)
+    hasher = ArtworkCache.hasher()
+    reader = DataReader(stream)
+    offset = 0
+    while offset < size:
+        loaded = await watchdog.call('load_async', reader.load_async(min(chunk_size, size - offset)))
+        if not loaded:
+            break
+        chunk = view[offset:offset + loaded]
+        chunk[:] = memoryview(reader.read_buffer(loaded))
+        hasher.update(chunk)
+        offset += loaded
+    return view[:offset], hasher.hexdigest()
@@ -1,28 +1,186 @@
+import asyncio
 import os
 import logging
-import discordrpc
-from dotenv import load_dotenv
+import random
+from config import DISCORD_CLIENT_ID, DISCORD_IPC_DIR, PRESENCE_DRIFT_TOLERANCE
 from currently_playing import Song
+from metrics import metrics
+from rate_limit import TokenBucket
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+if TYPE_CHECKING:
+    import discordrpc
+
+# Discord accepts 5 presence updates per 20 seconds
+PRESENCE_UPDATES = 5
+PRESENCE_PERIOD = 20
+
+# Bounds of the jittered exponential backoff between reconnect attempts, in seconds
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+def discord_running(ipc_dir: str = DISCORD_IPC_DIR) -> bool:
+    """
+    Check whether the Discord client is running by looking for its IPC endpoint.
+
+    Listing the directory doesn't open the endpoint, so unlike a connection attempt
+    this is cheap and invisible to Discord.
+
+    Args:
+        ipc_dir: Directory holding Discord's discord-ipc-N pipes or sockets
+
+    Returns:
+        True if a Discord IPC endpoint exists
+    """
+    try:
+        return any(name.startswith('discord-ipc-') for name in os.listdir(ipc_dir))
+    except OSError:
+        return False
+
+
+def open_connection() -> "discordrpc.RPC":
+    """
+    Connect to Discord. Blocking, meant to run in a worker thread.
+
+    discordrpc is imported here, so loading it never delays startup.
+
+    Returns:
+        The connected client.
+    """
+    import discordrpc
+    return discordrpc.RPC(DISCORD_CLIENT_ID)
+
+
+def close_abandoned(connection: "asyncio.Future[discordrpc.RPC]") -> None:
+    """
+    Disconnect a connection that opened after the reconnect waiting for it was cancelled.
+
+    The worker thread can't be interrupted, so a cancelled reconnect leaves this
+    as a done callback on the connection attempt instead of leaking the connection.
+
+    Args:
+        connection: Future of the open_connection() call
+
+    Returns:
+        None
+    """
+    if connection.cancelled() or connection.exception() is not None:
+        return
+    logging.debug("Closing the Discord connection opened after its reconnect was cancelled")
+    try:
+        connection.result().disconnect()
+    except Exception as e:
+        logging.debug(f"Could not close abandoned Discord connection: {e!r}")
 
-load_dotenv()
-DISCORD_CLIENT_ID = int(os.getenv("DISCORD_CLIENT_ID"))
 
 class RPC:
     """
     Class to manage Discord Rich Presence calls.
 
     This class handles the connection to Discord and updates the rich presence
-    status based on the currently playing song.
+    status based on the currently playing song. Updates identical to the last one
+    sent are skipped, and the rest are rate limited to Discord's presence limit,
+    with only the newest pending update sent once the limit allows it.
+
+    One IPC connection is kept for the lifetime of the object. It is opened in the
+    background by connect(), stopping playback only clears the activity, and a broken
+    pipe triggers a background reconnect with jittered exponential backoff, after
+    which the newest activity is sent again.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, drift_tolerance: int = PRESENCE_DRIFT_TOLERANCE) -> None:
+        """
+        Initialize the Discord RPC manager without connecting yet.
+
+        Args:
+            drift_tolerance: Seconds timestamps may shift before an update is sent again
+        """
+        logging.info("Initializing Discord RPC manager")
+        self.rpc: Optional["discordrpc.RPC"] = None
+        self.connect_task: Optional[asyncio.Task] = None
+        self.drift_tolerance = drift_tolerance
+        self.bucket = TokenBucket(PRESENCE_UPDATES, PRESENCE_PERIOD)
+        self.last: Optional[Dict[str, Any]] = None
+        self.pending: Optional[Dict[str, Any]] = None
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def connected(self) -> bool:
+        """
+        Whether the IPC connection is open or being (re)established in the background.
         """
-        Initialize the Discord RPC connection.
+        return self.rpc is not None or self.connect_task is not None
 
-        Creates a new RPC connection using the Discord client ID from environment variables.
+    def connect(self) -> None:
         """
-        logging.info("Initializing Discord RPC connection")
-        self.rpc = discordrpc.RPC(DISCORD_CLIENT_ID)
+        Open the IPC connection in the background unless it is open or already being opened.
+
+        Returns:
+            None
+        """
+        if self.connected:
+            return
+        self.connect_task = asyncio.get_running_loop().create_task(self.reconnect())
+
+    async def reconnect(self) -> None:
+        """
+        Keep trying to connect to Discord until it succeeds, then send the pending activity.
+
+        The blocking IPC handshake runs in the default executor so the refresh loop
+        keeps running while Discord is unavailable.
+
+        Returns:
+            None
+        """
+        loop = asyncio.get_running_loop()
+        delay = RECONNECT_MIN_DELAY
+        try:
+            while True:
+                if not discord_running():
+                    logging.debug(f"Discord is not running, checking again in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                    continue
+                connection = loop.run_in_executor(None, open_connection)
+                try:
+                    with metrics.span('discord_connect'):
+                        # Shielded, so a cancelled reconnect can still close what the thread opens
+                        rpc = await asyncio.shield(connection)
+                    break
+                except asyncio.CancelledError:
+                    connection.add_done_callback(close_abandoned)
+                    raise
+                except (Exception, SystemExit) as e:
+                    # The library exits through SystemExit when Discord isn't running
+                    wait = random.uniform(delay / 2, delay)
+                    logging.warning(f"Could not connect to Discord ({e!r}), retrying in {wait:.1f}s")
+                    metrics.count('discord_connect_failures')
+                    await asyncio.sleep(wait)
+                    delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        finally:
+            self.connect_task = None
+
+        logging.info("Connected to Discord")
+        metrics.count('discord_connects')
+        self.rpc = rpc
+        self.last = None
+        self.flush()
+
+    def disconnected(self, error: BaseException) -> None:
+        """
+        Drop a broken connection and reconnect in the background.
+
+        Args:
+            error: Exception raised while talking to Discord
+
+        Returns:
+            None
+        """
+        logging.warning(f"Lost connection to Discord ({error!r}), reconnecting")
+        metrics.count('discord_disconnects')
+        self.rpc = None
+        self.last = None
+        self.connect()
 
     def update_activity(self, info: Song) -> None:
         """
@@ -35,8 +193,7 @@ class RPC:
             None
         """
         if info.playing:
-            logging.info(f"Updating Discord activity: Playing '{info.title}' by {info.artist}")
-            self.rpc.set_activity(
+            activity = dict(
                 details=info.title,
                 state=info.artist,
                 large_text=info.album,
@@ -46,8 +203,7 @@ class RPC:
                 ts_end=info.ts[1],
             )
         else:
-            logging.info(f"Updating Discord activity: Paused '{info.title}' by {info.artist}")
-            self.rpc.set_activity(
+            activity = dict(
                 details=info.title,
                 state=info.artist,
                 large_text=info.album,
@@ -57,3 +213,147 @@ class RPC:
                 act_type=2,
                 ts_start=info.paused,
             )
+
+        self.pending = activity
+        if self.flush_handle is not None:
+            logging.debug("Discord presence rate limited, replacing pending activity")
+            metrics.count('presence_coalesced')
+            return
+        self.flush()
+
+    def same_activity(self, old: Optional[Dict[str, Any]], new: Dict[str, Any]) -> bool:
+        """
+        Check whether two activities would look the same in Discord.
+
+        Timestamps within the drift tolerance count as equal, so the one second
+        jitter of recomputed timestamps doesn't trigger updates while seeks do.
+
+        Args:
+            old: Previously sent activity, or None
+            new: Activity about to be sent
+
+        Returns:
+            True if sending new would not change the presence
+        """
+        if old is None or old.keys() != new.keys():
+            return False
+        for key, value in new.items():
+            if key in ('ts_start', 'ts_end') and value is not None and old[key] is not None:
+                if abs(value - old[key]) > self.drift_tolerance:
+                    return False
+            elif value != old[key]:
+                return False
+        return True
+
+    def flush(self) -> None:
+        """
+        Send the pending activity if the rate limit allows, otherwise schedule a retry.
+
+        Returns:
+            None
+        """
+        if self.pending is None or self.rpc is None:
+            # Without a connection the newest activity waits for reconnect() to send it
+            return
+
+        if self.same_activity(self.last, self.pending):
+            logging.debug("Discord activity unchanged, skipping update")
+            metrics.count('presence_skipped')
+            self.pending = None
+            return
+
+        if not self.bucket.try_acquire():
+            metrics.count('presence_rate_limited')
+            self.schedule_flush()
+            return
+
+        activity, self.pending = self.pending, None
+        if activity.get('small_text') == "Paused":
+            logging.info(f"Updating Discord activity: Paused '{activity['details']}' by {activity['state']}")
+        else:
+            logging.info(f"Updating Discord activity: Playing '{activity['details']}' by {activity['state']}")
+        try:
+            with metrics.span('presence_update'):
+                self.rpc.set_activity(**activity)
+        except (OSError, SystemExit) as e:
+            # Keep the activity so it is sent again once the connection is back
+            self.pending = activity
+            self.disconnected(e)
+            return
+        metrics.count('presence_sent')
+        self.last = activity
+
+    def schedule_flush(self) -> None:
+        """
+        Arrange for the pending activity to be sent when a token is available.
+
+        Returns:
+            None
+        """
+        if self.flush_handle is not None:
+            return
+
+        delay = self.bucket.delay()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logging.debug("No running event loop, pending Discord activity waits for the next update")
+            return
+        logging.debug(f"Discord presence rate limited, sending newest activity in {delay:.1f}s")
+        self.flush_handle = loop.call_later(delay, self.scheduled_flush)
+
+    def scheduled_flush(self) -> None:
+        """
+        Timer callback sending the newest pending activity.
+
+        Returns:
+            None
+        """
+        self.flush_handle = None
+        self.flush()
+
+    def cancel_flush(self) -> None:
+        """
+        Cancel any scheduled update and drop the pending activity.
+
+        Returns:
+            None
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.pending = None
+
+    def clear(self) -> None:
+        """
+        Remove the activity from Discord while keeping the connection open.
+
+        Returns:
+            None
+        """
+        self.cancel_flush()
+        if self.rpc is None or self.last is None:
+            return
+        logging.info("Clearing Discord activity")
+        try:
+            self.rpc.clear()
+        except (OSError, SystemExit) as e:
+            self.disconnected(e)
+            return
+        metrics.count('presence_cleared')
+        self.last = None
+
+    def close(self) -> None:
+        """
+        Cancel any scheduled update or reconnect and disconnect from Discord.
+
+        Returns:
+            None
+        """
+        self.cancel_flush()
+        if self.connect_task is not None:
+            self.connect_task.cancel()
+            self.connect_task = None
+        if self.rpc is not None:
+            rpc, self.rpc = self.rpc, None
+            rpc.disconnect()
@@ -0,0 +1,354 @@
+import asyncio
+import io
+import logging
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Mapping, Optional, Set, Tuple
+from metrics import metrics
+from rate_limit import CircuitBreaker
+
+if TYPE_CHECKING:
+    import requests
+    from requests.adapters import HTTPAdapter
+
+IMGUR_UPLOAD_URL = "https://api.imgur.com/3/image"
+
+# Imgur's client credits reset daily without a reset header, so probe again after this many seconds
+CLIENT_CREDITS_RETRY = 3600
+
+# The request the current worker thread is sending, so its connection can be attached to it
+current = threading.local()
+
+
+class InFlight:
+    """
+    An upload request sent from a worker thread, which another thread can abort.
+
+    The connection sending the request attaches itself once it is picked from the
+    pool or connected. Aborting shuts its socket down, so the worker's blocking
+    send or read fails at once instead of running into the timeouts.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.connection: Optional[Any] = None
+        self.aborted = False
+
+    def attach(self, connection: Any) -> None:
+        """
+        Record the connection sending the request. Runs on the worker thread.
+
+        Args:
+            connection: urllib3 connection about to connect or send the request
+
+        Raises:
+            ConnectionAbortedError: If the request was aborted already
+        """
+        with self.lock:
+            self.connection = connection
+            aborted = self.aborted
+        if aborted:
+            self.shutdown()
+            raise ConnectionAbortedError("upload aborted")
+
+    def abort(self) -> None:
+        """
+        Abort the request from any thread, closing its connection if it has one.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.aborted = True
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        sock = getattr(self.connection, 'sock', None)
+        if sock is None:
+            return
+        try:
+            # On the plain socket, so a TLS connection isn't torn down under the reading thread
+            socket.socket.shutdown(sock, socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def abortable_adapter(pool_maxsize: int) -> "HTTPAdapter":
+    """
+    Create a requests transport adapter whose connections attach to the worker's InFlight request.
+
+    Imports requests and urllib3, so it is only called from a worker thread.
+
+    Args:
+        pool_maxsize: Connections kept alive per host
+
+    Returns:
+        The adapter, to mount on a session.
+    """
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class Abortable:
+        def track(self) -> None:
+            request = getattr(current, 'request', None)
+            if request is not None:
+                request.attach(self)
+
+        def connect(self) -> None:
+            self.track()
+            super().connect()
+            # Again with the socket connected, in case the request was aborted while connecting
+            self.track()
+
+        def request(self, *args, **kwargs) -> None:
+            self.track()
+            return super().request(*args, **kwargs)
+
+    class AbortableHTTPConnection(Abortable, HTTPConnection):
+        pass
+
+    class AbortableHTTPSConnection(Abortable, HTTPSConnection):
+        pass
+
+    class AbortableHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = AbortableHTTPConnection
+
+    class AbortableHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = AbortableHTTPSConnection
+
+    class AbortableAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs) -> None:
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': AbortableHTTPConnectionPool,
+                'https': AbortableHTTPSConnectionPool,
+            }
+
+    return AbortableAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+
+
+def rate_limit_delay(headers: Mapping[str, str], now: Optional[float] = None) -> float:
+    """
+    Work out how long Imgur asks clients to wait from its response headers.
+
+    Args:
+        headers: Response headers, case insensitive as returned by requests
+        now: Current Unix time, defaults to time.time()
+
+    Returns:
+        Seconds until uploads should be attempted again, 0 if no limit is exhausted.
+    """
+    now = time.time() if now is None else now
+    delays = [0.0]
+    try:
+        if 'Retry-After' in headers:
+            delays.append(float(headers['Retry-After']))
+        if headers.get('X-Post-Rate-Limit-Remaining') == '0':
+            delays.append(float(headers.get('X-Post-Rate-Limit-Reset', 0)))
+        if headers.get('X-RateLimit-UserRemaining') == '0':
+            delays.append(float(headers.get('X-RateLimit-UserReset', now)) - now)
+        if headers.get('X-RateLimit-ClientRemaining') == '0':
+            delays.append(CLIENT_CREDITS_RETRY)
+    except ValueError as e:
+        logging.warning(f"Could not parse Imgur rate limit headers: {e}")
+    return max(delays)
+
+
+class ImgurUploader:
+    """
+    Uploads thumbnails to Imgur without blocking the event loop.
+
+    Requests are sent from a small worker pool over a single keep-alive session,
+    with connect and read timeouts. Cancelling an upload aborts its request by
+    shutting its connection down, so the caller returns immediately and the worker
+    is free for the next upload instead of waiting for the stale response. close()
+    aborts every request in flight the same way, so no worker outlives the uploader.
+
+    Temporary failures (network errors, 429 and 5xx responses) are retried with
+    jittered exponential backoff. Uploads wait until Imgur's rate limit headers
+    allow them, and repeated failures open a circuit breaker that keeps uploads
+    from reaching the endpoint until its cooldown has passed.
+    """
+    def __init__(self, client_id: str, url: str = IMGUR_UPLOAD_URL, connect_timeout: float = 5,
+                 read_timeout: float = 20, max_workers: int = 2, max_retries: int = 4, retry_delay: float = 2,
+                 max_retry_delay: float = 60, breaker: Optional[CircuitBreaker] = None) -> None:
+        """
+        Initialize the uploader. The HTTP session is created by the first upload.
+
+        Args:
+            client_id: Imgur API client ID
+            url: Upload endpoint, overridable to point at a local test server
+            connect_timeout: Seconds to wait for the connection to be established
+            read_timeout: Seconds to wait for the server to respond
+            max_workers: Number of uploads that can be in flight at once
+            max_retries: Retries of an upload after temporary failures
+            retry_delay: Seconds before the first retry, doubled for each further one
+            max_retry_delay: Upper bound in seconds for the delay between retries
+            breaker: Circuit breaker guarding the endpoint, or None for the default one
+        """
+        logging.info("Initializing Imgur uploader")
+        self.client_id = client_id
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_workers = max_workers
+        self.session: Optional["requests.Session"] = None
+        self.session_lock = threading.Lock()
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.blocked_until = 0.0
+        self.in_flight: Set[InFlight] = set()
+        self.in_flight_lock = threading.Lock()
+        self.closed = False
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="imgur-upload")
+
+    async def upload(self, image: io.BytesIO) -> str:
+        """
+        Upload the image to Imgur from a worker thread and return the link.
+
+        Waits while Imgur's rate limit or the circuit breaker holds uploads back, and
+        retries temporary failures, so this can take long; callers are expected to
+        show a placeholder meanwhile.
+
+        Args:
+            image: BytesIO object containing the thumbnail data
+
+        Returns:
+            Either an Imgur link or 'default' if upload fails
+        """
+        loop = asyncio.get_running_loop()
+        request: Optional[InFlight] = None
+        try:
+            for attempt in range(self.max_retries + 1):
+                wait = self.retry_in()
+                if wait > 0:
+                    logging.info(f"Imgur uploads paused, waiting {wait:.0f}s before uploading")
+                    metrics.count('upload_deferred')
+                    await asyncio.sleep(wait)
+
+                request = InFlight()
+                link, retryable, retry_after = await loop.run_in_executor(self.executor, self.post, image, request)
+                if retry_after > 0:
+                    logging.warning(f"Imgur rate limit reached, pausing uploads for {retry_after:.0f}s")
+                    metrics.count('upload_rate_limited')
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+                if link != 'default':
+                    self.breaker.success()
+                    return link
+                if self.breaker.failure():
+                    logging.warning(f"{self.breaker.failures} failed uploads in a row, "
+                                    f"pausing uploads for {self.breaker.retry_in():.0f}s")
+                    metrics.count('upload_breaker_opened')
+                if not retryable or attempt == self.max_retries:
+                    break
+                delay = random.uniform(0.5, 1) * min(self.retry_delay * 2 ** attempt, self.max_retry_delay)
+                logging.info(f"Retrying thumbnail upload in {delay:.1f}s")
+                metrics.count('upload_retries')
+                await asyncio.sleep(delay)
+            return 'default'
+        except asyncio.CancelledError:
+            logging.info("Thumbnail upload cancelled, aborting its request")
+            if request is not None:
+                request.abort()
+            raise
+
+    def retry_in(self) -> float:
+        """
+        Get the time until uploads may reach Imgur again.
+
+        Returns:
+            Seconds to wait for the rate limit or the circuit breaker, 0 if uploads are allowed.
+        """
+        return max(0.0, self.breaker.retry_in(), self.blocked_until - time.monotonic())
+
+    def post(self, image: io.BytesIO, request: Optional[InFlight] = None) -> Tuple[str, bool, float]:
+        """
+        Upload the image to Imgur once and return the link.
+
+        Runs on a worker thread.
+
+        Args:
+            image: BytesIO object containing the thumbnail data
+            request: Handle through which the upload can be aborted from another thread
+
+        Returns:
+            Either an Imgur link or 'default' if upload fails, whether a failure is worth
+            retrying, and the seconds Imgur's rate limit headers ask to wait before the next upload
+        """
+        request = request if request is not None else InFlight()
+        with self.in_flight_lock:
+            if self.closed or request.aborted:
+                return 'default', False, 0.0
+            self.in_flight.add(request)
+        logging.info("Uploading thumbnail to Imgur")
+        image.seek(0)
+        current.request = request
+        try:
+            response = self.get_session().post(self.url, files={'image': image}, timeout=self.timeout)
+        except Exception as e:
+            if request.aborted:
+                logging.info("Thumbnail upload aborted")
+                return 'default', False, 0.0
+            logging.error(f"Error uploading thumbnail: {e}")
+            return 'default', True, 0.0
+        finally:
+            current.request = None
+            with self.in_flight_lock:
+                self.in_flight.discard(request)
+
+        retry_after = rate_limit_delay(response.headers)
+        if response.status_code == 200:
+            try:
+                link = response.json()['data']['link']
+            except (ValueError, KeyError, TypeError) as e:
+                logging.error(f"Unexpected response from Imgur: {e!r}")
+                return 'default', True, retry_after
+            logging.info(f"Thumbnail uploaded successfully: {link}")
+            return link, False, retry_after
+        logging.warning(f"Failed to upload thumbnail: HTTP {response.status_code}")
+        return 'default', response.status_code == 429 or response.status_code >= 500, retry_after
+
+    def get_session(self) -> "requests.Session":
+        """
+        Get the keep-alive HTTP session, creating it on first use.
+
+        requests is imported here, on a worker thread, so loading it never delays startup.
+
+        Returns:
+            The shared session.
+        """
+        with self.session_lock:
+            if self.session is None:
+                import requests
+
+                session = requests.Session()
+                session.headers['Authorization'] = f'Client-ID {self.client_id}'
+                adapter = abortable_adapter(self.max_workers)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self.session = session
+            return self.session
+
+    def close(self) -> None:
+        """
+        Stop accepting uploads, abort the ones in flight and close pooled connections.
+
+        The workers are left to exit on their own, which they do as soon as their
+        aborted request fails, so the process can exit right away.
+
+        Returns:
+            None
+        """
+        logging.info("Closing Imgur uploader")
+        with self.in_flight_lock:
+            self.closed = True
+            in_flight = list(self.in_flight)
+        for request in in_flight:
+            request.abort()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.session is not None:
+            self.session.close()
@@ -0,0 +1,41 @@
+import asyncio
+from typing import Awaitable, Callable, Optional, Set, Tuple
+
+# Called with the reader and writer of each new client connection
+ClientHandler = Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable[None]]
+
+
+async def listen(handle: ClientHandler, host: str, port: int) -> Tuple[asyncio.AbstractServer, int]:
+    """
+    Start a stream server for local clients, e.g. the now playing sink or the control server.
+
+    Args:
+        handle: Coroutine function serving one client connection
+        host: Interface to listen on
+        port: Port to listen on, 0 to pick a free one
+
+    Returns:
+        The server and the port it listens on, the picked one if port was 0.
+    """
+    server = await asyncio.start_server(handle, host, port)
+    return server, server.sockets[0].getsockname()[1]
+
+
+async def close(server: Optional[asyncio.AbstractServer], clients: Set[asyncio.StreamWriter]) -> None:
+    """
+    Stop a server started by listen() and disconnect the clients still connected to it.
+
+    Args:
+        server: Server to stop, or None if it never started
+        clients: Writers of the connected clients, emptied
+
+    Returns:
+        None
+    """
+    if server is None:
+        return
+    server.close()
+    for client in list(clients):
+        client.close()
+    clients.clear()
+    await server.wait_closed()
@@ -0,0 +1,230 @@
+import atexit
+import logging
+import os
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from pathlib import Path
+from typing import Optional, Tuple
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Queue handler that drops records instead of blocking when the queue is full.
+
+    The event loop only pays for formatting the record and a put_nowait(); if the
+    writer thread falls behind, new records are counted and dropped, and the count
+    is reported with the next record that fits.
+    """
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """
+        Put a record on the queue without blocking.
+
+        Args:
+            record: Prepared log record
+
+        Returns:
+            None
+        """
+        if self.dropped:
+            record.msg = f"{record.msg} ({self.dropped} earlier log records dropped, log queue full)"
+        try:
+            self.queue.put_nowait(record)
+            self.dropped = 0
+        except queue.Full:
+            self.dropped += 1
+
+
+class RepeatCollapsingHandler(logging.Handler):
+    """
+    Handler collapsing identical consecutive records before passing them on.
+
+    The first record of a run is written, repeats are only counted, and a
+    "Previous message repeated N times" summary is written when a different record
+    arrives or every `summary_interval` seconds while the run continues.
+    """
+    def __init__(self, target: logging.Handler, summary_interval: float = 600) -> None:
+        """
+        Initialize the handler.
+
+        Args:
+            target: Handler that writes the collapsed records
+            summary_interval: Seconds between summaries of a run that keeps repeating
+        """
+        super().__init__()
+        self.target = target
+        self.summary_interval = summary_interval
+        self.last: Optional[Tuple[str, int, str]] = None
+        self.last_record: Optional[logging.LogRecord] = None
+        self.repeats = 0
+        self.summarized = 0.0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """
+        Write a record unless it repeats the previous one.
+
+        Args:
+            record: Log record to write
+
+        Returns:
+            None
+        """
+        key = (record.name, record.levelno, record.getMessage())
+        if key == self.last:
+            self.repeats += 1
+            if record.created - self.summarized >= self.summary_interval:
+                self.summarize()
+            return
+        self.summarize()
+        self.last = key
+        self.last_record = record
+        self.summarized = record.created
+        self.target.handle(record)
+
+    def summarize(self) -> None:
+        """
+        Write a summary of the repeats counted since the last summary, if any.
+
+        Returns:
+            None
+        """
+        if not self.repeats:
+            return
+        summary = logging.makeLogRecord(self.last_record.__dict__)
+        summary.msg = f"Previous message repeated {self.repeats} times"
+        summary.args = None
+        summary.exc_info = summary.exc_text = None
+        summary.created = time.time()
+        self.target.handle(summary)
+        self.repeats = 0
+        self.summarized = summary.created
+
+    def close(self) -> None:
+        self.summarize()
+        self.target.close()
+        super().close()
+
+
+class PrunedFileHandler(TimedRotatingFileHandler):
+    """
+    Daily rotating log file that also rotates on size and keeps the log directory bounded.
+
+    Midnight rollovers name the file after the day it covers, size rollovers during
+    the day after the time they happen. After every rollover, and once when opened,
+    log files in the same directory older than `retention_days` are deleted, then
+    the oldest ones until the directory, with room for the current file to reach
+    `max_file_bytes`, is below `max_total_bytes`.
+    """
+    def __init__(self, path: Path, max_file_bytes: int, max_total_bytes: int, retention_days: float) -> None:
+        """
+        Initialize the handler and prune the log directory.
+
+        Args:
+            path: Path of the log file
+            max_file_bytes: Size at which the current file is rotated
+            max_total_bytes: Upper bound for the total size of the log directory
+            retention_days: Age in days after which log files are deleted
+        """
+        super().__init__(path, when='midnight', encoding='utf-8')
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self.retention_days = retention_days
+        self.prune()
+
+    def shouldRollover(self, record: logging.LogRecord) -> int:
+        if self.stream is not None and self.stream.tell() >= self.max_file_bytes:
+            return 1
+        return super().shouldRollover(record)
+
+    def rotation_filename(self, default_name: str) -> str:
+        if time.time() < self.rolloverAt:
+            # A size rollover, which can happen several times a day, so the day alone doesn't identify it
+            default_name = f"{self.baseFilename}.{time.strftime('%Y-%m-%d_%H-%M-%S')}"
+        name = super().rotation_filename(default_name)
+        # Several size rollovers within a second
+        candidate, number = name, 0
+        while os.path.exists(candidate):
+            number += 1
+            candidate = f"{name}.{number}"
+        return candidate
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self.prune()
+
+    def prune(self) -> None:
+        """
+        Delete expired log files, then the oldest ones beyond the total size cap.
+
+        Returns:
+            None
+        """
+        current = os.path.abspath(self.baseFilename)
+        directory = os.path.dirname(current)
+        try:
+            files = [entry for entry in os.scandir(directory)
+                     if entry.is_file() and '.log' in entry.name and entry.path != current]
+        except OSError as e:
+            logging.getLogger(__name__).warning(f"Could not list log directory {directory}: {e}")
+            return
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+
+        expired = time.time() - self.retention_days * 86400
+        total = max(os.path.getsize(current) if os.path.exists(current) else 0, self.max_file_bytes)
+        total += sum(entry.stat().st_size for entry in files)
+        for entry in files:
+            if entry.stat().st_mtime >= expired and total <= self.max_total_bytes:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+                total -= size
+            except OSError:
+                pass
+
+
+def start_logging(logger: logging.Logger, path: Path, formatter: logging.Formatter, max_total_bytes: int,
+                  retention_days: float, queue_size: int = 10000) -> QueueListener:
+    """
+    Route a logger through a bounded queue to a background writer thread.
+
+    Args:
+        logger: Logger whose records are written to the file
+        path: Path of the log file
+        formatter: Formatter of the written lines
+        max_total_bytes: Upper bound for the total size of the log directory
+        retention_days: Age in days after which log files are deleted
+        queue_size: Records buffered before new ones are dropped
+
+    Returns:
+        The started listener, stopped automatically at exit to flush the queue.
+    """
+    file_handler = PrunedFileHandler(path, max(max_total_bytes // 4, 1), max_total_bytes, retention_days)
+    file_handler.setFormatter(formatter)
+    listener = QueueListener(queue.Queue(queue_size), RepeatCollapsingHandler(file_handler))
+    logger.addHandler(DroppingQueueHandler(listener.queue))
+    listener.start()
+    atexit.register(stop_logging, listener)
+    return listener
+
+
+def stop_logging(listener: QueueListener) -> None:
+    """
+    Flush the queued records and close the log file. Registered with atexit by start_logging(),
+    and does nothing if the listener was stopped before.
+
+    Args:
+        listener: Listener returned by start_logging()
+
+    Returns:
+        None
+    """
+    if listener._thread is None:
+        return
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
@@ -1,201 +1,497 @@
+import argparse
 import asyncio
 from datetime import datetime
+import json
 import logging
 import os
 from pathlib import Path
-import psutil
+import signal
+import sys
 import threading
-from discord_rp import RPC
-from currently_playing import Song
+import time
+from typing import Any, Dict, List, Optional
+from config import (ARTWORK_CACHE_FLUSH_INTERVAL, ARTWORK_SIMILARITY_THRESHOLD, CONTROL_ENABLED, DISCORD_CLIENT_ID,
+                    DISCORD_PROBE_INTERVAL, HEADLESS, LOG_MAX_BYTES, LOG_RETENTION_DAYS, MEMORY_MONITOR_ENABLED,
+                    MEMORY_MONITOR_FRAMES, MEMORY_MONITOR_INTERVAL,
+                    METRICS_ENABLED, METRICS_INTERVAL, PRESENCE_DRIFT_TOLERANCE, PROFILE_ON_START, PROFILE_SECONDS,
+                    REFRESH_FAST_INTERVAL, REFRESH_IDLE_INTERVAL, REFRESH_MAX_INTERVAL, REFRESH_PAUSED_INTERVAL)
+from discord_rp import RPC, discord_running
+from currently_playing import Song, SongSnapshot
+from artwork_cache import AlbumIndex, ArtworkCache, SimilarArtworkIndex, default_cache_path
+from media_watcher import MediaWatcher
+from winrt_watchdog import WinRTWatchdog
+from process_detector import ProcessDetector
+from metrics import metrics
+from memory_monitor import MemoryMonitor
+from profiler import Profiler
+from transitions import Action, Transition, plan
+from scheduler import RefreshScheduler
+from sinks import SinkHub, configured_sinks, now_playing
+from supervisor import Supervisor
+from control import ControlServer, send_command
 from tray import TrayIcon
-from logging.handlers import TimedRotatingFileHandler
+from log_queue import start_logging
+
+# Handlers are attached to the root logger by get_logger() when run as a script
+logs = logging.getLogger(__name__)
 
 def get_logger(logger_name):
     logger = logging.getLogger(logger_name)
     logger.setLevel(logging.INFO)
-    file_handler = TimedRotatingFileHandler(PATH, when='midnight')
-    file_handler.setFormatter(FORMATTER)
-    logger.addHandler(file_handler)
-    logger.propagate = False
+    # Modules log through the root logger, so it gets the writer, a background thread that keeps the
+    # event loop from waiting on the disk, and this logger propagates to it
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    start_logging(root, PATH, FORMATTER, LOG_MAX_BYTES, LOG_RETENTION_DAYS)
     return logger
 
-def is_process_running(process_name: str) -> bool:
+async def publish_artwork(song: Song, discord: RPC, sinks: SinkHub, thumbnail, published: SongSnapshot) -> None:
     """
-    Check if a process with the given name is currently running.
+    Resolve a new song's artwork and patch it into the already published presence.
+
+    Runs as a background task after the song's text has been published with a
+    placeholder image. If the song changed in the meantime the result is discarded.
 
     Args:
-        process_name: The name of the process to check for
+        song: The active song
+        discord: RPC manager the song was published on
+        sinks: Local consumers the song was published to
+        thumbnail: Thumbnail reference captured when the song was detected
+        published: Snapshot of the song when it was published
 
     Returns:
-        True if the process is running, False otherwise
+        None
     """
-    logs.debug(f"Checking if process '{process_name}' is running")
     try:
-        for proc in psutil.process_iter(['name']):
-            try:
-                if proc.info['name'] == process_name:
-                    return True
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                continue
+        link = await song.resolve_thumbnail(thumbnail)
     except Exception as e:
-        logs.error(f"Error checking processes: {e}")
-    return False
+        logs.error(f'Error resolving artwork, keeping placeholder: {e}')
+        return
+    current = song.snapshot()
+    if current is None or current.identity != published.identity:
+        logs.info('Song changed while resolving artwork, discarding it')
+        return
+    song.image = link
+    logs.debug('Updating Discord activity with resolved artwork')
+    discord.update_activity(song)
+    sinks.publish(now_playing(current, link))
+
+def close_discord(discord: RPC) -> None:
+    """
+    Disconnect from Discord, absorbing the SystemExit the client raises when disconnecting.
+
+    Args:
+        discord: RPC manager to disconnect
 
-async def main(stop_event: threading.Event) -> None:
+    Returns:
+        None
     """
-    Main application function that manages the Discord Rich Presence for Apple Music.
+    try:
+        discord.close()
+        logs.info('Disconnected from Discord')
+    except SystemExit:
+        logs.info('Caught SystemExit from rpc.disconnect(), cleaning up')
 
-    This function initializes the application, monitors Apple Music's playback status,
-    and updates Discord Rich Presence accordingly. It runs in an infinite loop,
-    periodically checking for changes in the currently playing song.
+def cancel_artwork(task: Optional[asyncio.Task]) -> None:
+    """
+    Cancel a pending artwork task, if any.
+
+    Args:
+        task: Task running publish_artwork(), or None
 
     Returns:
         None
     """
-    logs.info("Starting Apple Music Rich Presence application")
+    if task is not None and not task.done():
+        logs.info('Cancelling stale artwork upload')
+        task.cancel()
 
-    # Initial Constants
-    REFRESH_INTERVAL = 5
-    alive = is_process_running('AppleMusic.exe')
-    changed = False
+async def report_metrics(interval: int) -> None:
+    """
+    Periodically write the refresh cycle metrics as one structured log line.
 
-    # Define song object
-    logs.info("Initializing song tracking")
-    active_song = Song()
-
-    # Start tray icon
-    logs.info("Setting up system tray icon")
-    icon = TrayIcon(stop_event)
-    icon.run()
-
-    # If Apple Music is running, get the info from it
-    if alive:
-        logs.info("Apple Music is running, fetching initial song information")
-        await active_song.get_info(changed)
-        await active_song.convert_thumbnail()
-    known = active_song.listview()
-    logs.debug(f"Initial song state: {known}")
-
-    while not stop_event.is_set():
+    Args:
+        interval: Seconds between reports
+
+    Returns:
+        None
+    """
+    while True:
+        await asyncio.sleep(interval)
+        metrics.report(logs)
+
+async def flush_caches(caches: List[ArtworkCache], interval: float) -> None:
+    """
+    Periodically write the artwork caches that changed, off the event loop.
+
+    Args:
+        caches: Persistent caches to flush
+        interval: Seconds between flushes
+
+    Returns:
+        None
+    """
+    while True:
+        await asyncio.sleep(interval)
+        for cache in caches:
+            await cache.flush()
+
+async def monitor_memory(monitor: MemoryMonitor, interval: int) -> None:
+    """
+    Periodically log memory growth while the monitor is enabled, which can change at runtime.
+
+    Args:
+        monitor: Memory monitor to check
+        interval: Seconds between checks
+
+    Returns:
+        None
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        if monitor.enabled:
+            await loop.run_in_executor(None, monitor.check, logs)
+
+def app_status(song: Song, discord: RPC, started: float, headless: bool) -> Dict[str, Any]:
+    """
+    Describe the running application, answered to the control server's status command.
+
+    Args:
+        song: The active song
+        discord: RPC manager
+        started: time.monotonic() when the application started
+        headless: Whether the application runs without the tray
+
+    Returns:
+        JSON serializable status.
+    """
+    import psutil
+
+    return {
+        'now_playing': now_playing(song.snapshot(), song.image),
+        'discord_connected': discord.connected,
+        'headless': headless,
+        'uptime': round(time.monotonic() - started, 1),
+        'pid': os.getpid(),
+        'rss_mib': round(psutil.Process().memory_info().rss / 1024 / 1024, 1),
+        'threads': threading.active_count(),
+    }
+
+def memory_report(monitor: MemoryMonitor) -> Dict[str, Any]:
+    """
+    Describe the memory monitor, answered to the control server's memory and memory-report commands.
+
+    Checks take a while, so this reports the last periodic check instead of running one.
+
+    Args:
+        monitor: Memory monitor
+
+    Returns:
+        JSON serializable state of the monitor.
+    """
+    return {
+        'enabled': monitor.enabled,
+        'check_interval': MEMORY_MONITOR_INTERVAL,
+        'last_check': monitor.last_check,
+    }
+
+def toggle_memory(monitor: MemoryMonitor) -> Dict[str, Any]:
+    """
+    Switch the memory monitor on or off, like the tray's menu item, for the control server's memory command.
+
+    Args:
+        monitor: Memory monitor
+
+    Returns:
+        The monitor's state after the switch, as memory_report() describes it.
+    """
+    monitor.toggle()
+    return memory_report(monitor)
+
+def handle_signals(supervisor: Supervisor, watcher: MediaWatcher) -> None:
+    """
+    Stop on SIGTERM or SIGBREAK and refresh right away on SIGHUP or SIGUSR1, where the platform has them.
+
+    SIGINT is left to asyncio.run(), which cancels main() and so goes through the same cleanup.
+
+    Args:
+        supervisor: Supervisor to stop
+        watcher: Media session watcher to wake for a refresh
+
+    Returns:
+        None
+    """
+    loop = asyncio.get_running_loop()
+    handlers = {'SIGTERM': supervisor.stop, 'SIGBREAK': supervisor.stop,
+                'SIGHUP': watcher.interrupt, 'SIGUSR1': watcher.interrupt}
+    for name, handler in handlers.items():
+        signum = getattr(signal, name, None)
+        if signum is None:
+            continue
+        try:
+            loop.add_signal_handler(signum, handler)
+        except NotImplementedError:
+            # Windows event loops don't support signal handlers, the handler wakes the loop itself
+            signal.signal(signum, lambda received, frame, handler=handler: handler())
+
+async def refresh(song: Song, watcher: MediaWatcher, watchdog: WinRTWatchdog, discord: RPC, sinks: SinkHub,
+                  supervisor: Supervisor) -> None:
+    """
+    Keep the presence and the sinks in step with Apple Music's playback until cancelled.
+
+    Refreshes whenever the media session reports a change, with a fallback refresh
+    scheduled from the playback state in case an event is missed. Each refresh takes a snapshot of
+    the song and runs only the actions the transition from the previous snapshot needs.
+    While Discord isn't running the song is still tracked, but artwork and publishing
+    wait until Discord starts, when only the latest state is published. The state is
+    also fanned out to the configured local sinks, whether or not Discord is running.
+
+    Args:
+        song: The active song
+        watcher: Media session watcher, started
+        watchdog: Deadline shared by the media session calls
+        discord: RPC manager to publish on
+        sinks: Local consumers to publish to, started
+        supervisor: Supervisor the artwork uploads run under
+
+    Returns:
+        None
+    """
+    APPLE_MUSIC_APP_ID = 'AppleInc.AppleMusicWin'
+    apple_music = ProcessDetector('AppleMusic.exe', APPLE_MUSIC_APP_ID)
+    scheduler = RefreshScheduler(REFRESH_FAST_INTERVAL, REFRESH_PAUSED_INTERVAL, REFRESH_IDLE_INTERVAL,
+                                 REFRESH_MAX_INTERVAL)
+    known: Optional[SongSnapshot] = None
+    artwork_task = None
+
+    while True:
         logs.debug("Starting new refresh cycle")
-        changed = False
+        cycle_start = time.perf_counter()
+
+        if watchdog.needs_rebuild or watcher.manager is None:
+            with metrics.span('winrt_rebuild'):
+                await watcher.rebuild()
 
         # Check if Apple Music is still running. If it is, refresh song's info
-        alive = is_process_running('AppleMusic.exe')
+        with metrics.span('process_check'):
+            alive = apple_music.is_running(watcher.source_app_id)
         if alive:
             logs.debug("Apple Music is running, refreshing song info")
-            await active_song.get_info(changed)
+            with metrics.span('get_info'):
+                await song.get_info(watcher.manager)
         else:
             logs.debug("Apple Music is not running")
-
-        # Refresh for latest info
-        new = active_song.listview()
-
-        # Check for changes
-        changed = not (known == new)
-        if changed:
-            logs.debug(f"Song state changed (title, author, album, playing): {known} -> {new}")
-        else:
-            logs.debug(f"Song state unchanged (title, author, album, playing): {known}")
-
-        if changed or not alive or None in new:
-            # Case 1: Client exited, AM not running, or nothing playing => RPC reset
-            if None in new or not alive:
-                logs.info('Case 1: Client exited, AM not running, or nothing playing')
-                try:
-                    active_song.pause()
-                    discord.rpc.disconnect()
-                    active_song.reset()
-                    del discord
-                    logs.info('Disconnected from Discord and reset RPC')
-                except NameError:
-                    logs.info('RPC already reset (not connected)')
-                except SystemExit:
-                    logs.info('Caught SystemExit from rpc.disconnect(), cleaning up')
-                    del discord
-                    active_song.reset()
-                    logging.info('RPC reset completed')
-
-            # Case 2: User paused the song (same song, different state)
-            elif known[0] == new[0] and known[1] == new[1] and known[2] == new[2]:
-                logs.info('Case 2: Song paused/unpaused')
-                try:
-                    active_song.pause()
-                    logs.debug('Updating Discord activity with paused state')
-                    discord.update_activity(active_song)
-                except NameError:
-                    logs.info('Creating new Discord RPC connection')
-                    discord = RPC()
-                    discord.update_activity(active_song)
-
-            # Case 3: New song
-            else:
-                logs.info('Case 3: New song detected')
-                active_song.play()
-                # Refresh info to get the hash in case it wasn't grabbed
-                logs.debug('Refreshing song info and thumbnail')
-                await active_song.get_info(changed)
-                await active_song.convert_thumbnail()
-                try:
-                    logs.debug('Updating Discord activity with new song')
-                    discord.update_activity(active_song)
-                except NameError:
-                    logs.info('Creating new Discord RPC connection')
-                    discord = RPC()
-                    discord.update_activity(active_song)
-
-        # If nothing changed, handle these cases
+        new = song.snapshot() if alive else None
+
+        # Without Discord there is nobody to publish to, so only the song is tracked
+        with metrics.span('discord_probe'):
+            available = discord_running()
+        if available:
+            # Work out what the change since the last published snapshot requires
+            transition, actions = plan(known, new, discord.connected, PRESENCE_DRIFT_TOLERANCE)
         else:
-            # Case 4: Same state persisted
-            if alive:
-                logs.info('Case 4: Same song/state persisted')
-                if not new[3]:
-                    logs.debug('Maintaining paused state')
-                    active_song.pause()
-                else:
-                    logs.debug('Maintaining playing state')
-                    active_song.play()
-                try:
-                    logs.debug('Refreshing Discord activity')
-                    discord.update_activity(active_song)
-                except NameError:
-                    logs.info('Creating new Discord RPC connection')
-                    discord = RPC()
-                    discord.update_activity(active_song)
-
-            # Case 5: Apple Music stays closed or nothing is playing
+            if known is not None or discord.connected:
+                logs.info('Discord is not running, deferring presence updates until it starts')
+                cancel_artwork(artwork_task)
+                close_discord(discord)
+            elif new is not None:
+                metrics.count('presence_deferred')
+            transition, actions = None, ()
+        if actions:
+            logs.info(f"Transition {transition.value}: {[action.value for action in actions]}")
+        logs.debug(f"Song state: {known} -> {new}")
+
+        if new is not None:
+            if new.playing:
+                song.play()
             else:
-                logs.info('Case 5: Apple Music remained closed')
-                try:
-                    active_song.pause()
-                    discord.rpc.disconnect()
-                    active_song.reset()
-                    del discord
-                    logs.info('Disconnected from Discord and reset RPC')
-                except NameError:
-                    logs.debug('RPC already reset (not connected)')
-                except SystemExit:
-                    logs.info('Caught SystemExit from rpc.disconnect(), cleaning up')
-                    del discord
-                    active_song.reset()
-                    logs.debug('RPC reset completed')
-
-        # Refresh variables
-        known = new
-        await asyncio.sleep(REFRESH_INTERVAL)
-
-    logs.info("Stopped using Tray option - Gracefully quitting")
+                song.pause()
+
+        for action in actions:
+            if action is Action.CLEAR:
+                cancel_artwork(artwork_task)
+                discord.clear()
+                song.reset()
+
+            elif action is Action.CONNECT:
+                logs.info('Connecting to Discord in the background')
+                discord.connect()
+
+            elif action is Action.FETCH_ARTWORK:
+                # The text is published right away, the artwork follows once it is resolved
+                cancel_artwork(artwork_task)
+                indexed = song.indexed_artwork()
+                song.image = indexed or 'default'
+                # The first hit on an album is still checked against the thumbnail in the background
+                if indexed is None or song.artwork_needs_check():
+                    artwork_task = supervisor.spawn(
+                        'artwork', publish_artwork(song, discord, sinks, song.thumbnail, new)
+                    )
+
+            elif action is Action.PUBLISH:
+                logs.debug('Updating Discord activity')
+                discord.update_activity(song)
+                if transition is Transition.NEW_TRACK:
+                    logs.info(f'Published new song in {(time.perf_counter() - cycle_start) * 1000:.1f} ms')
+                    metrics.observe('track_change_to_presence', time.perf_counter() - cycle_start)
+
+        # Artwork is only resolved for Discord, so without it the sinks get none
+        sinks.publish(now_playing(new, song.image if available else None))
+
+        # Refresh variables, with nothing known to be published while Discord is away
+        known = new if available else None
+        metrics.observe('refresh_cycle', time.perf_counter() - cycle_start)
+        metrics.count('refresh_cycles')
+        interval = scheduler.next_interval(new, alive)
+        if not available and new is not None:
+            # Nothing signals Discord starting, so check for it while a song waits to be published
+            interval = min(interval, DISCORD_PROBE_INTERVAL)
+        logs.debug(f"Next fallback refresh in {interval:.1f}s")
+        events = await watcher.wait(interval)
+        if not events:
+            logs.debug("No media events received, running fallback refresh")
+            metrics.count('fallback_refreshes')
+
+async def main(stop_event: threading.Event, headless: bool = HEADLESS) -> None:
+    """
+    Main application function that manages the Discord Rich Presence for Apple Music.
+
+    This function initializes the application and runs the refresh loop, the periodic
+    reports and the artwork uploads as tasks under one supervisor. It returns once the
+    user quits from the tray, sends the quit control command or SIGTERM, all of which
+    wake the loop immediately, or the refresh loop fails. Every path out of it,
+    including a keyboard interrupt cancelling it, goes through the same cleanup: the
+    tasks are cancelled, the presence is cleared and the tray is stopped.
+
+    Headless, the tray is never created, so pystray isn't imported and no tray
+    thread runs; the application is controlled through signals and the control
+    server, which unless CONTROL_ENABLED says otherwise only runs headless.
+
+    Args:
+        stop_event: Event set by the tray when the user quits
+        headless: Whether to run without the tray
+
+    Returns:
+        None
+    """
+    logs.info(f"Starting Apple Music Rich Presence application{' headless' if headless else ''}")
+    started = time.monotonic()
+    # Captures get their own folder, bounded by PROFILE_KEEP, and start first so one on start covers the launch
+    profiler = Profiler(default_cache_path("Profiles"), PROFILE_SECONDS)
+    if PROFILE_ON_START:
+        profiler.start()
+
+    supervisor = Supervisor()
+    # One long-lived Discord connection, opened when the first song is published
+    discord = RPC()
+    metrics.enabled = METRICS_ENABLED
+    if metrics.enabled:
+        logs.info(f"Metrics enabled, reporting every {METRICS_INTERVAL}s")
+        supervisor.spawn('metrics', report_metrics(METRICS_INTERVAL))
+    memory = MemoryMonitor(MEMORY_MONITOR_FRAMES)
+    if MEMORY_MONITOR_ENABLED:
+        memory.enable()
+    supervisor.spawn('memory', monitor_memory(memory, MEMORY_MONITOR_INTERVAL))
+
+    # Define song object
+    logs.info("Initializing song tracking")
+    # Shared, so stalls anywhere in the media session count towards rebuilding its manager
+    watchdog = WinRTWatchdog()
+    similar_artwork = SimilarArtworkIndex(default_cache_path("similar_artwork.json"), ARTWORK_SIMILARITY_THRESHOLD)
+    artwork_cache = ArtworkCache(default_cache_path())
+    supervisor.spawn('cache-flush', flush_caches([artwork_cache, similar_artwork], ARTWORK_CACHE_FLUSH_INTERVAL))
+    active_song = Song(artwork_cache, album_index=AlbumIndex(), watchdog=watchdog,
+                       similar_artwork=similar_artwork)
+
+    # Subscribe to media session events
+    logs.info("Starting media session watcher")
+    watcher = MediaWatcher(watchdog=watchdog)
+    await watcher.start()
+
+    # One poller serves every local consumer, each behind its own queue
+    sinks = SinkHub(configured_sinks())
+    await sinks.start()
+
+    # Start tray icon, whose quit wakes the supervisor from the tray thread
+    icon = None
+    if not headless:
+        logs.info("Setting up system tray icon")
+        icon = TrayIcon(stop_event, supervisor.stop, metrics.lines, memory, profiler)
+        icon.run()
+
+    handle_signals(supervisor, watcher)
+    control = None
+    if headless if CONTROL_ENABLED is None else CONTROL_ENABLED:
+        control = ControlServer({
+            'status': lambda: app_status(active_song, discord, started, headless),
+            'refresh': watcher.interrupt,
+            'profile': profiler.start,
+            'stats': metrics.lines,
+            'memory': lambda: toggle_memory(memory),
+            'memory-report': lambda: memory_report(memory),
+            'quit': supervisor.stop,
+        })
+        try:
+            await control.start()
+        except OSError as e:
+            logs.error(f"Could not start control server, continuing without it: {e}")
+            control = None
+
     try:
-        logs.debug('Attempting to quit tray icon')
-        icon.quit()
-        logs.debug('Tray icon quit successfully')
-    except NameError:
-        logs.info('Tray icon not active or already quit, skipping')
-    except Exception as e:
-        logs.error(f'Error quitting tray icon: {e}')
+        supervisor.spawn('refresh', refresh(active_song, watcher, watchdog, discord, sinks, supervisor),
+                         essential=True)
+        await supervisor.wait()
+        logs.info("Stop requested - Gracefully quitting")
+    finally:
+        quit_start = time.perf_counter()
+        # Stops the refresh loop mid-cycle, along with any upload or WinRT call it is waiting on
+        await supervisor.shutdown()
+        if metrics.enabled:
+            metrics.report(logs)
+        memory.disable()
+        profiler.stop()
+        watcher.stop()
+        if control is not None:
+            await control.close()
+        await sinks.close()
+        active_song.uploader.close()
+        # Whatever changed since the last flush
+        artwork_cache.save()
+        similar_artwork.save()
+        discord.clear()
+        close_discord(discord)
+        if icon is not None:
+            try:
+                logs.debug('Attempting to quit tray icon')
+                icon.quit()
+                logs.debug('Tray icon quit successfully')
+            except Exception as e:
+                logs.error(f'Error quitting tray icon: {e}')
+        logs.info(f'Cleaned up in {(time.perf_counter() - quit_start) * 1000:.1f} ms')
 
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser(description="Discord Rich Presence for Apple Music")
+    parser.add_argument('--headless', action='store_true', default=HEADLESS,
+                        help="run without the tray icon, controlled through signals and the control endpoint")
+    parser.add_argument('--control', metavar='COMMAND',
+                        help="send status, refresh, profile, stats, memory, memory-report or quit to the running "
+                             "instance and exit")
+    args = parser.parse_args()
+
+    if args.control:
+        try:
+            reply = send_command(args.control)
+        except OSError as e:
+            print(f"No instance answered on the control endpoint: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(reply, indent=2))
+        sys.exit(0 if reply.get('ok') else 1)
+
+    if DISCORD_CLIENT_ID is None:
+        parser.error("DISCORD_CLIENT_ID is not set, add it to the environment or the .env file")
+
     # Configure logging
     FORMATTER = logging.Formatter("%(asctime)s :: [%(levelname)s] :: %(message)s")
 
@@ -213,52 +509,11 @@ if __name__ == '__main__':
 
     stop_event = threading.Event()
     try:
-        # Run main script
+        # Run main script, which cleans up after itself however it ends
         logs.info("Starting application")
-        asyncio.run(main(stop_event))
-
+        asyncio.run(main(stop_event, args.headless))
     except KeyboardInterrupt:
         logs.info('Shutting down - keyboard interrupt detected')
-
-        try:
-            logs.debug('Attempting to quit tray icon')
-            icon.quit()
-            logs.debug('Tray icon quit successfully')
-        except NameError:
-            logs.info('Tray icon not active or already quit, skipping')
-        except Exception as e:
-            logs.error(f'Error quitting tray icon: {e}')
-
-        try:
-            logs.debug('Attempting to disconnect from Discord')
-            discord.rpc.disconnect()
-            logs.debug('Discord disconnected successfully')
-        except NameError:
-            logs.info('Discord RPC not active or already disconnected, skipping')
-        except Exception as e:
-            logs.error(f'Error disconnecting from Discord: {e}')
-
-        logs.info('Application shutdown complete')
-
     except SystemExit:
         logs.info('Shutting down - system exit detected')
-
-        try:
-            logs.debug('Attempting to quit tray icon')
-            icon.quit()
-            logs.debug('Tray icon quit successfully')
-        except NameError:
-            logs.info('Tray icon not active or already quit, skipping')
-        except Exception as e:
-            logs.error(f'Error quitting tray icon: {e}')
-
-        try:
-            logs.debug('Attempting to disconnect from Discord')
-            discord.rpc.disconnect()
-            logs.debug('Discord disconnected successfully')
-        except NameError:
-            logs.info('Discord RPC not active or already disconnected, skipping')
-        except Exception as e:
-            logs.error(f'Error disconnecting from Discord: {e}')
-
-        logs.info('Application shutdown complete')
+    logs.info('Application shutdown complete')
@@ -0,0 +1,216 @@
+from winsdk.windows.media.control import GlobalSystemMediaTransportControlsSessionManager as MediaManager
+import asyncio
+import logging
+from typing import Any, Callable, List, Optional
+from winrt_watchdog import WinRTWatchdog
+
+
+class MediaWatcher:
+    """
+    Event-driven tracker for the system media session.
+
+    Keeps a single session manager handle and subscribes to its session, media
+    properties, playback info and timeline change events. Events are raised on
+    WinRT threads and forwarded to an asyncio queue consumed by the main loop.
+    """
+    SESSION_CHANGED = "current_session_changed"
+    MEDIA_PROPERTIES_CHANGED = "media_properties_changed"
+    PLAYBACK_INFO_CHANGED = "playback_info_changed"
+    TIMELINE_CHANGED = "timeline_properties_changed"
+    INTERRUPTED = "interrupted"
+
+    def __init__(self, max_pending: int = 64, watchdog: Optional[WinRTWatchdog] = None) -> None:
+        """
+        Initialize the watcher without subscribing to anything yet.
+
+        Args:
+            max_pending: Maximum number of undelivered events kept in the queue
+            watchdog: Deadline for requesting the session manager, or None for one with the configured deadline
+        """
+        logging.info("Initializing media session watcher")
+        self.watchdog = watchdog if watchdog is not None else WinRTWatchdog()
+        self.manager: Optional[Any] = None
+        self.session: Optional[Any] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.events: "asyncio.Queue[str]" = asyncio.Queue(maxsize=max_pending)
+        self.manager_token: Optional[Any] = None
+        self.session_tokens: List[tuple] = []
+
+    @property
+    def source_app_id(self) -> Optional[str]:
+        """
+        Get the app id of the application owning the watched session.
+
+        Returns:
+            The session's source app user model id, or None if there is no session.
+        """
+        if self.session is None:
+            return None
+        return self.session.source_app_user_model_id
+
+    async def start(self, manager: Optional[Any] = None) -> None:
+        """
+        Acquire the session manager and subscribe to its events.
+
+        If requesting the manager stalls, the watcher starts without it and no
+        events arrive until rebuild() succeeds.
+
+        Args:
+            manager: Session manager to watch, or None to request the system one
+
+        Returns:
+            None
+        """
+        logging.info("Starting media session watcher")
+        self.loop = asyncio.get_running_loop()
+        if manager is None:
+            try:
+                manager = await self.watchdog.call('request_async', MediaManager.request_async())
+            except asyncio.TimeoutError:
+                logging.warning("Could not get the media session manager, watching without events for now")
+                return
+        self.manager = manager
+        self.manager_token = self.manager.add_current_session_changed(self.handler(self.SESSION_CHANGED))
+        self.attach(self.manager.get_current_session())
+
+    async def rebuild(self) -> None:
+        """
+        Replace the session manager handle, e.g. after calls through it kept stalling.
+
+        The current handle stays subscribed until a new one has been obtained, so if
+        requesting it stalls too, the watcher keeps working with what it has.
+
+        Returns:
+            None
+        """
+        logging.warning(f"Rebuilding media session manager handle after {self.watchdog.stalls} stalled WinRT calls")
+        try:
+            manager = await self.watchdog.call('request_async', MediaManager.request_async())
+        except asyncio.TimeoutError:
+            logging.warning("Could not get a new media session manager, keeping the current one")
+            return
+        self.stop()
+        await self.start(manager)
+        self.watchdog.rebuilt()
+        # Refresh right away from the new handle
+        self.notify(self.SESSION_CHANGED)
+
+    def stop(self) -> None:
+        """
+        Unsubscribe from all events and release the session manager.
+
+        Returns:
+            None
+        """
+        logging.info("Stopping media session watcher")
+        self.detach()
+        if self.manager is not None and self.manager_token is not None:
+            self.manager.remove_current_session_changed(self.manager_token)
+        self.manager_token = None
+        self.manager = None
+
+    def attach(self, session: Optional[Any]) -> None:
+        """
+        Subscribe to the change events of a media session.
+
+        Args:
+            session: Media session to watch, or None if there is no current session
+
+        Returns:
+            None
+        """
+        self.detach()
+        self.session = session
+        if session is None:
+            logging.debug("No current media session to watch")
+            return
+
+        logging.debug("Subscribing to current media session events")
+        for name, add, remove in (
+            (self.MEDIA_PROPERTIES_CHANGED, session.add_media_properties_changed, session.remove_media_properties_changed),
+            (self.PLAYBACK_INFO_CHANGED, session.add_playback_info_changed, session.remove_playback_info_changed),
+            (self.TIMELINE_CHANGED, session.add_timeline_properties_changed, session.remove_timeline_properties_changed),
+        ):
+            self.session_tokens.append((remove, add(self.handler(name))))
+
+    def detach(self) -> None:
+        """
+        Unsubscribe from the events of the currently watched session.
+
+        Returns:
+            None
+        """
+        for remove, token in self.session_tokens:
+            try:
+                remove(token)
+            except Exception as e:
+                logging.debug(f"Failed to unsubscribe from media session event: {e}")
+        self.session_tokens = []
+        self.session = None
+
+    def handler(self, name: str) -> Callable[[Any, Any], None]:
+        """
+        Build a WinRT event handler that forwards the event to the loop thread.
+
+        Args:
+            name: Event name pushed onto the queue
+
+        Returns:
+            A callable accepting the WinRT (sender, args) pair.
+        """
+        def on_event(sender: Any, args: Any) -> None:
+            if self.loop is not None and not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self.notify, name)
+        return on_event
+
+    def notify(self, name: str) -> None:
+        """
+        Record an event on the loop thread, following session switches.
+
+        Args:
+            name: Name of the event that fired
+
+        Returns:
+            None
+        """
+        if name == self.SESSION_CHANGED and self.manager is not None:
+            self.attach(self.manager.get_current_session())
+        try:
+            self.events.put_nowait(name)
+        except asyncio.QueueFull:
+            # The consumer coalesces pending events, so dropping one loses nothing
+            logging.debug(f"Media event queue full, dropping {name}")
+
+    def interrupt(self) -> None:
+        """
+        Wake up a pending wait() from any thread.
+
+        Returns:
+            None
+        """
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.notify, self.INTERRUPTED)
+
+    async def wait(self, timeout: Optional[float]) -> List[str]:
+        """
+        Wait for the next batch of media events.
+
+        Blocks until at least one event arrives or the timeout elapses, then
+        drains every other pending event so bursts are handled in one refresh.
+
+        Args:
+            timeout: Maximum number of seconds to wait, or None to wait indefinitely
+
+        Returns:
+            Names of the events received, empty if the timeout elapsed.
+        """
+        try:
+            first = await asyncio.wait_for(self.events.get(), timeout)
+        except asyncio.TimeoutError:
+            return []
+
+        received = [first]
+        while not self.events.empty():
+            received.append(self.events.get_nowait())
+        logging.debug(f"Received media events: {received}")
+        return received
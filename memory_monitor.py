@@ -0,0 +1,129 @@
+import logging
+import tracemalloc
+from typing import List, Optional
+
+# Allocations made by tracemalloc itself and the import machinery are noise in the growth report
+IGNORED_FILES = (tracemalloc.__file__, '<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>',
+                 '<unknown>')
+
+
+class MemoryMonitor:
+    """
+    tracemalloc based check for memory that keeps growing over a long session.
+
+    While enabled, check() compares a snapshot of the traced allocations with the
+    previous one and logs the sites that grew the most, along with the growth since
+    the monitor was enabled. Tracing slows allocations down, so it is off until
+    enabled and stopped again by disable(); while off, check() returns right away.
+    """
+    def __init__(self, frames: int = 1, top: int = 10) -> None:
+        """
+        Initialize a disabled monitor.
+
+        Args:
+            frames: Stack frames recorded per allocation, more attribute growth more precisely but cost more
+            top: Number of allocation sites reported per check
+        """
+        logging.info("Initializing memory monitor")
+        self.frames = frames
+        self.top = top
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.previous: Optional[tracemalloc.Snapshot] = None
+        self.started = False
+        # Lines of the last check, kept for the control server's memory-report command
+        self.last_check: List[str] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.baseline is not None
+
+    def enable(self) -> None:
+        """
+        Start tracing allocations and take the baseline snapshot.
+
+        Returns:
+            None
+        """
+        if self.enabled:
+            return
+        logging.info(f"Enabling memory monitor, tracing {self.frames} frame(s) per allocation")
+        # Tracing may already have been started, e.g. with python -X tracemalloc
+        self.started = not tracemalloc.is_tracing()
+        if self.started:
+            tracemalloc.start(self.frames)
+        self.baseline = self.previous = self.snapshot()
+        self.last_check = []
+
+    def disable(self) -> None:
+        """
+        Stop tracing allocations and drop the snapshots.
+
+        Returns:
+            None
+        """
+        if not self.enabled:
+            return
+        logging.info("Disabling memory monitor")
+        self.baseline = self.previous = None
+        if self.started:
+            tracemalloc.stop()
+
+    def toggle(self) -> None:
+        """
+        Enable the monitor if it is disabled and the other way round, e.g. from the tray.
+
+        Returns:
+            None
+        """
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def snapshot(self) -> tracemalloc.Snapshot:
+        """
+        Take a snapshot of the traced allocations without the monitor's own noise.
+
+        Returns:
+            The filtered snapshot.
+        """
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, filename) for filename in IGNORED_FILES]
+        )
+
+    def check(self, logger: Optional[logging.Logger] = None) -> List[str]:
+        """
+        Compare the traced allocations with the previous check and log the largest growth.
+
+        Taking and comparing snapshots takes a while with many live objects, so this
+        is meant to run on a worker thread.
+
+        Args:
+            logger: Logger to write to, or None for the root logger
+
+        Returns:
+            The logged lines, empty while the monitor is disabled.
+        """
+        previous, baseline = self.previous, self.baseline
+        if previous is None or baseline is None:
+            return []
+        try:
+            current = self.snapshot()
+        except RuntimeError:
+            # Disabled while the snapshot was taken
+            return []
+        self.previous = current
+
+        size, peak = tracemalloc.get_traced_memory()
+        total = sum(stat.size_diff for stat in current.compare_to(baseline, 'filename'))
+        lines = [f"traced {size / 1024:.0f} KiB (peak {peak / 1024:.0f} KiB), "
+                 f"{total / 1024:+.0f} KiB since enabled"]
+        for stat in current.compare_to(previous, 'lineno')[:self.top]:
+            if stat.size_diff <= 0:
+                break
+            frame = stat.traceback[0]
+            lines.append(f"{frame.filename}:{frame.lineno}: {stat.size_diff / 1024:+.1f} KiB "
+                         f"({stat.count_diff:+d} blocks, {stat.size / 1024:.1f} KiB total)")
+        (logger or logging.getLogger()).info("Memory growth since last check:\n" + "\n".join(lines))
+        self.last_check = lines
+        return lines
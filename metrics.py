@@ -0,0 +1,187 @@
+import json
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+
+class Span:
+    """
+    Context manager timing one stage and recording it into Metrics.
+    """
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics: "Metrics", name: str) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class NullSpan:
+    """
+    Shared do-nothing span handed out while instrumentation is disabled.
+    """
+    __slots__ = ()
+
+    def __enter__(self) -> "NullSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Metrics:
+    """
+    Lightweight per-stage timing and counters for the refresh cycle.
+
+    Stages are timed with `with metrics.span('name'):` and kept in rolling windows
+    summarized as p50/p95/max; counters track events such as uploads and cache hits.
+    While disabled, span() returns a shared no-op object and count() returns right
+    away, so instrumented code pays almost nothing.
+    """
+    def __init__(self, enabled: bool = False, window: int = 512) -> None:
+        """
+        Initialize empty metrics.
+
+        Args:
+            enabled: Whether timings and counters are recorded
+            window: Number of most recent samples kept per stage
+        """
+        self.enabled = enabled
+        self.window = window
+        self.samples: Dict[str, Deque[float]] = {}
+        self.counters: Dict[str, int] = {}
+        self.since = time.time()
+
+    def span(self, name: str) -> object:
+        """
+        Time a stage.
+
+        Args:
+            name: Stage name
+
+        Returns:
+            A context manager recording the stage's duration when it exits.
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def observe(self, name: str, seconds: float) -> None:
+        """
+        Record one duration of a stage.
+
+        Args:
+            name: Stage name
+            seconds: Duration of the stage
+
+        Returns:
+            None
+        """
+        if not self.enabled:
+            return
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """
+        Increment a counter.
+
+        Args:
+            name: Counter name
+            amount: Value added to the counter
+
+        Returns:
+            None
+        """
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self) -> Dict[str, object]:
+        """
+        Summarize recorded timings and counters.
+
+        Returns:
+            Dictionary with per-stage sample count, p50, p95 and max in milliseconds,
+            and the counters since metrics were enabled.
+        """
+        stages = {}
+        for name, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            stages[name] = {
+                'n': len(ordered),
+                'p50': round(percentile(ordered, 50) * 1000, 2),
+                'p95': round(percentile(ordered, 95) * 1000, 2),
+                'max': round(ordered[-1] * 1000, 2),
+            }
+        return {'uptime': int(time.time() - self.since), 'stages_ms': stages, 'counters': dict(sorted(self.counters.items()))}
+
+    def log_line(self) -> str:
+        """
+        Render the summary as a single structured log line.
+
+        Returns:
+            The summary encoded as compact JSON.
+        """
+        return json.dumps(self.summary(), separators=(",", ":"))
+
+    def lines(self) -> List[str]:
+        """
+        Render the summary as short human readable lines, e.g. for the tray.
+
+        Returns:
+            One line per stage followed by one line of counters.
+        """
+        if not self.enabled:
+            return ["Metrics are disabled (set METRICS_ENABLED=1)"]
+        summary = self.summary()
+        lines = [f"{name}: p50 {stage['p50']} ms, p95 {stage['p95']} ms, max {stage['max']} ms"
+                 for name, stage in summary['stages_ms'].items()]
+        counters = ", ".join(f"{name} {value}" for name, value in summary['counters'].items())
+        lines.append(counters or "No counters yet")
+        return lines
+
+    def report(self, logger: Optional[logging.Logger] = None) -> None:
+        """
+        Write the summary as one structured log line.
+
+        Args:
+            logger: Logger to write to, or None for the root logger
+
+        Returns:
+            None
+        """
+        if not self.enabled:
+            return
+        (logger or logging.getLogger()).info(f"Metrics: {self.log_line()}")
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """
+    Get a percentile of already sorted samples using the nearest-rank method.
+
+    Args:
+        ordered: Samples in ascending order, not empty
+        q: Percentile between 0 and 100
+
+    Returns:
+        The sample at the requested percentile.
+    """
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+# Shared instance used by the instrumented modules, configured by main.py
+metrics = Metrics()
@@ -0,0 +1,131 @@
+import logging
+import time
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import psutil
+
+
+class ProcessDetector:
+    """
+    Cheap, cached check for whether a process is running.
+
+    The process table is scanned once to find the process, after which only the
+    cached PID and its create time are checked. Full scans are repeated only once
+    the cached process is gone, with an exponential backoff between scans while it
+    stays absent. A media session owned by the application also counts as proof
+    that it is running, skipping the process table entirely.
+    """
+    def __init__(self, process_name: str, app_id_prefix: Optional[str] = None,
+                 min_backoff: float = 5, max_backoff: float = 300) -> None:
+        """
+        Initialize the detector without scanning yet.
+
+        Args:
+            process_name: Executable name to look for, e.g. 'AppleMusic.exe'
+            app_id_prefix: Prefix of the application's media session source app id
+            min_backoff: Seconds to wait before rescanning after the first miss
+            max_backoff: Upper bound in seconds for the delay between rescans
+        """
+        logging.info(f"Initializing process detector for '{process_name}'")
+        self.process_name = process_name
+        self.app_id_prefix = app_id_prefix
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.process: Optional["psutil.Process"] = None
+        self.pid: Optional[int] = None
+        self.create_time: Optional[float] = None
+        self.backoff = min_backoff
+        self.next_scan = 0.0
+        self.scans = 0
+
+    def is_running(self, source_app_id: Optional[str] = None) -> bool:
+        """
+        Check if the process is currently running.
+
+        Args:
+            source_app_id: Source app id of the current media session, if any
+
+        Returns:
+            True if the process is running, False otherwise
+        """
+        if source_app_id and self.app_id_prefix and source_app_id.startswith(self.app_id_prefix):
+            logging.debug(f"Media session belongs to '{self.process_name}', skipping process check")
+            self.backoff = self.min_backoff
+            self.next_scan = 0.0
+            return True
+
+        if self.process is not None:
+            if self.alive():
+                return True
+            logging.info(f"Process '{self.process_name}' (PID {self.pid}) exited")
+            self.forget()
+
+        now = time.monotonic()
+        if now < self.next_scan:
+            logging.debug(f"Skipping scan for '{self.process_name}', next scan in {self.next_scan - now:.1f}s")
+            return False
+
+        if self.scan():
+            self.backoff = self.min_backoff
+            self.next_scan = 0.0
+            return True
+
+        self.next_scan = now + self.backoff
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+        return False
+
+    def alive(self) -> bool:
+        """
+        Check that the cached process still exists and hasn't been replaced.
+
+        Returns:
+            True if the cached PID still belongs to the same process, False otherwise
+        """
+        import psutil
+
+        try:
+            # is_running() compares the create time, so a reused PID is not mistaken for ours
+            return self.process.is_running()
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            return False
+
+    def scan(self) -> bool:
+        """
+        Scan the full process table for the process and cache it if found.
+
+        Returns:
+            True if the process was found, False otherwise
+        """
+        # Imported on first scan, which a media session of the process can skip entirely
+        import psutil
+
+        logging.debug(f"Scanning process table for '{self.process_name}'")
+        self.scans += 1
+        try:
+            for proc in psutil.process_iter(['name', 'create_time']):
+                try:
+                    if proc.info['name'] == self.process_name:
+                        self.process = proc
+                        self.pid = proc.pid
+                        self.create_time = proc.info['create_time']
+                        logging.info(f"Found process '{self.process_name}' (PID {self.pid})")
+                        return True
+                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                    continue
+        except Exception as e:
+            logging.error(f"Error checking processes: {e}")
+        return False
+
+    def forget(self) -> None:
+        """
+        Drop the cached process so the next check rescans immediately.
+
+        Returns:
+            None
+        """
+        self.process = None
+        self.pid = None
+        self.create_time = None
+        self.backoff = self.min_backoff
+        self.next_scan = 0.0
@@ -0,0 +1,311 @@
+import io
+import logging
+import marshal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from types import CodeType
+from typing import Dict, List, Optional, Tuple
+from config import PROFILE_KEEP, PROFILE_SECONDS
+
+# pstats identifies functions by (filename, first line, name)
+Label = Tuple[str, int, str]
+# A sampled thread name and its stack, code objects from the innermost frame out
+Sample = Tuple[str, Tuple[CodeType, ...]]
+
+
+def label(code: CodeType) -> Label:
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+def thread_cpu_times() -> Dict[int, float]:
+    """
+    Get the CPU time used by each thread of the process so far.
+
+    Returns:
+        CPU seconds by native thread id, empty if they can't be read.
+    """
+    try:
+        import psutil
+        return {thread.id: thread.user_time + thread.system_time for thread in psutil.Process().threads()}
+    except Exception as e:
+        logging.debug(f"Failed to read per-thread CPU times: {e}")
+        return {}
+
+
+class Profiler:
+    """
+    Sampling profiler capturing what every thread of the application spends CPU on.
+
+    A capture runs on its own thread for a fixed window, recording the stack of
+    every other thread (the event loop, the tray and the executor workers) every
+    `interval` seconds. It then writes a .prof file readable by pstats or snakeviz
+    and a text summary of the top functions into `directory`, keeping only the
+    latest `keep` captures there so repeated captures don't fill the disk. The profiled threads
+    need no hooks, so nothing runs between captures and the application isn't
+    slowed down until one is started.
+
+    Samples are grouped in slices of `slice` seconds and weighted by the CPU time
+    their thread used in the slice, so threads waiting on a socket, a queue or the
+    tray's message loop drop out instead of dominating the profile. Without per
+    thread CPU times, samples fall back to counting wall clock time.
+    """
+    def __init__(self, directory: Path, seconds: float = PROFILE_SECONDS, interval: float = 0.01,
+                 slice: float = 0.1, top: int = 25, keep: int = PROFILE_KEEP) -> None:
+        """
+        Initialize an idle profiler.
+
+        Args:
+            directory: Directory the captures are written to
+            seconds: Length of a capture
+            interval: Seconds between samples
+            slice: Seconds over which samples share their thread's CPU time
+            top: Number of functions listed per table of the summary
+            keep: Number of captures kept in the directory, older ones are deleted
+        """
+        logging.info("Initializing profiler")
+        self.directory = directory
+        self.seconds = seconds
+        self.interval = interval
+        self.slice = slice
+        self.top = top
+        self.keep = keep
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+        self.written: Optional[Tuple[Path, Path]] = None
+
+    @property
+    def capturing(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self) -> bool:
+        """
+        Start a capture in the background, unless one is already running.
+
+        Returns:
+            True if a capture was started.
+        """
+        if self.capturing:
+            logging.info("Profile capture already running")
+            return False
+        logging.info(f"Capturing a {self.seconds:g}s profile, sampling every {self.interval * 1000:g} ms")
+        self.stopping.clear()
+        self.written = None
+        # Not a daemon, so a capture cut short at shutdown is still written before the process exits
+        self.thread = threading.Thread(target=self.capture, name="profiler")
+        self.thread.start()
+        return True
+
+    def stop(self) -> None:
+        """
+        End a running capture early. What was sampled so far is still written.
+
+        Returns:
+            None
+        """
+        self.stopping.set()
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[Tuple[Path, Path]]:
+        """
+        Wait for the current capture to be written.
+
+        Args:
+            timeout: Most seconds to wait, or None to wait until it is written
+
+        Returns:
+            Paths of the .prof file and the summary, or None if nothing was written.
+        """
+        if self.thread is not None:
+            self.thread.join(timeout)
+        return self.written
+
+    def capture(self) -> None:
+        """
+        Sample the other threads until the window ends or stop() is called, then write the results.
+        Runs on the profiler thread.
+
+        Returns:
+            None
+        """
+        own = threading.get_ident()
+        counts: "Counter[Sample]" = Counter()
+        seconds: "Counter[Sample]" = Counter()
+        busy: "Counter[str]" = Counter()
+        pending: Dict[str, List[Tuple[CodeType, ...]]] = {}
+        native: Dict[str, int] = {}
+        rounds = slice_rounds = 0
+        before = thread_cpu_times()
+        weighted = bool(before)
+        start = slice_start = time.perf_counter()
+        deadline = start + self.seconds
+        while not self.stopping.wait(self.interval) and time.perf_counter() < deadline:
+            threads = {thread.ident: thread for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                thread = threads.get(ident)
+                name = thread.name if thread is not None else f"thread-{ident}"
+                if thread is not None and getattr(thread, 'native_id', None) is not None:
+                    native[name] = thread.native_id
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                pending.setdefault(name, []).append(tuple(stack))
+            rounds += 1
+            slice_rounds += 1
+            now = time.perf_counter()
+            if now - slice_start >= self.slice:
+                before = self.attribute(pending, native, before, (now - slice_start) / slice_rounds,
+                                        counts, seconds, busy)
+                slice_start, slice_rounds = now, 0
+        if slice_rounds:
+            self.attribute(pending, native, before, (time.perf_counter() - slice_start) / slice_rounds,
+                           counts, seconds, busy)
+        elapsed = time.perf_counter() - start
+
+        if not rounds:
+            logging.info("Profile capture stopped before the first sample, nothing written")
+            return
+        try:
+            self.written = self.write(counts, seconds, busy, elapsed, weighted)
+        except OSError as e:
+            logging.warning(f"Failed to write profile: {e}")
+            return
+        logging.info(f"Profile written to {self.written[0]} and {self.written[1]}")
+        self.prune()
+
+    def prune(self) -> None:
+        """
+        Delete all but the latest `keep` captures from the directory.
+
+        Returns:
+            None
+        """
+        try:
+            captures = sorted({path.stem for path in self.directory.glob("profile_*")
+                               if path.suffix in (".prof", ".txt")})
+        except OSError as e:
+            logging.warning(f"Failed to list profiles: {e}")
+            return
+        for stem in captures[:max(len(captures) - self.keep, 0)]:
+            for suffix in (".prof", ".txt"):
+                try:
+                    (self.directory / f"{stem}{suffix}").unlink()
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logging.warning(f"Failed to delete old profile {stem}{suffix}: {e}")
+
+    @staticmethod
+    def attribute(pending: Dict[str, List[Tuple[CodeType, ...]]], native: Dict[str, int], before: Dict[int, float],
+                  per_sample: float, counts: "Counter[Sample]", seconds: "Counter[Sample]",
+                  busy: "Counter[str]") -> Dict[int, float]:
+        """
+        Share the time each thread used over a slice between its samples, then start the next slice.
+
+        Args:
+            pending: Stacks sampled during the slice by thread name, emptied
+            native: Native thread ids by thread name
+            before: CPU times by native thread id at the start of the slice
+            per_sample: Wall clock seconds per sample, used without CPU times
+            counts: Samples kept by thread and stack, updated
+            seconds: Time attributed by thread and stack, updated
+            busy: Time attributed by thread, updated
+
+        Returns:
+            CPU times by native thread id at the end of the slice.
+        """
+        after = thread_cpu_times() if before else {}
+        for name, stacks in pending.items():
+            thread_id = native.get(name)
+            if thread_id in after:
+                used = after[thread_id] - before.get(thread_id, 0.0)
+            else:
+                used = len(stacks) * per_sample if not before else 0.0
+            if used <= 0:
+                continue
+            busy[name] += used
+            for stack in stacks:
+                counts[name, stack] += 1
+                seconds[name, stack] += used / len(stacks)
+        pending.clear()
+        return after
+
+    def write(self, counts: "Counter[Sample]", seconds: "Counter[Sample]", busy: "Counter[str]", elapsed: float,
+              weighted: bool) -> Tuple[Path, Path]:
+        """
+        Write the samples as a pstats file and a text summary.
+
+        A function's own time is the time attributed to samples it was the innermost
+        frame of, its cumulative time that of samples it was anywhere on the stack of,
+        and its call count the number of those samples.
+
+        Args:
+            counts: Samples kept by thread and stack
+            seconds: Time attributed by thread and stack
+            busy: Time attributed by thread
+            elapsed: Length of the capture in seconds
+            weighted: Whether the time is CPU time rather than wall clock time
+
+        Returns:
+            Paths of the .prof file and the summary.
+        """
+        # Only needed once a capture is written, so importing the profiler stays cheap
+        import pstats
+
+        stats: Dict[Label, list] = {}
+        leaves: Dict[str, "Counter[Label]"] = {}
+        for (thread, codes), count in counts.items():
+            used = seconds[thread, codes]
+            labels = [label(code) for code in codes]
+            seen = set()
+            for position, func in enumerate(labels):
+                entry = stats.setdefault(func, [0, 0, 0.0, 0.0, {}])
+                if position == 0:
+                    entry[2] += used
+                if func in seen:
+                    # Recursive frames are counted once per sample
+                    continue
+                seen.add(func)
+                entry[0] += count
+                entry[1] += count
+                entry[3] += used
+                if position + 1 < len(labels):
+                    calls, _, own, total = entry[4].get(labels[position + 1], (0, 0, 0.0, 0.0))
+                    entry[4][labels[position + 1]] = (calls + count, calls + count,
+                                                      own + (used if position == 0 else 0.0), total + used)
+            if labels:
+                leaves.setdefault(thread, Counter())[labels[0]] += used
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        prof = self.directory / f"{name}.prof"
+        with open(prof, "wb") as f:
+            marshal.dump({func: tuple(entry) for func, entry in stats.items()}, f)
+
+        kind = "CPU" if weighted else "wall clock"
+        lines: List[str] = [
+            f"amrp-py profile: {elapsed:.1f}s sampled every {self.interval * 1000:g} ms, "
+            f"{sum(busy.values()):.2f}s of {kind} time attributed",
+            f"Times are {kind} seconds and ncalls counts samples. "
+            + ("Idle threads and waits are left out." if weighted else "Waiting threads show up in their wait."),
+            "",
+            "Threads:",
+        ]
+        for thread, used in busy.most_common():
+            lines.append(f"  {thread}: {used:.2f}s, innermost functions:")
+            for func, share in leaves.get(thread, Counter()).most_common(5):
+                lines.append(f"    {share / used:6.1%}  {pstats.func_std_string(func)}")
+        stream = io.StringIO()
+        if stats:
+            report = pstats.Stats(str(prof), stream=stream)
+            report.sort_stats('tottime').print_stats(self.top)
+            report.sort_stats('cumulative').print_stats(self.top)
+        summary = self.directory / f"{name}.txt"
+        with open(summary, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n" + stream.getvalue())
+        return prof, summary
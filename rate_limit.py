@@ -0,0 +1,116 @@
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter.
+
+    Holds up to `capacity` tokens, refilled continuously so that `capacity`
+    tokens become available every `period` seconds.
+    """
+    def __init__(self, capacity: int, period: float) -> None:
+        """
+        Initialize a full bucket.
+
+        Args:
+            capacity: Maximum number of tokens, i.e. the allowed burst size
+            period: Seconds needed to refill the bucket from empty
+        """
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        """
+        Take a token if one is available.
+
+        Returns:
+            True if a token was taken, False if the bucket is empty
+        """
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self) -> float:
+        """
+        Get the time until the next token becomes available.
+
+        Returns:
+            Seconds to wait, 0 if a token is available now.
+        """
+        self.refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for calls to an unreliable endpoint.
+
+    After `threshold` consecutive failures the circuit opens and calls should not
+    be attempted for `cooldown` seconds. Once the cooldown has passed, a trial call
+    is allowed; if it fails the circuit opens again with the cooldown doubled, up
+    to `max_cooldown`, and a success closes it and resets the cooldown.
+    """
+    def __init__(self, threshold: int = 3, cooldown: float = 30, max_cooldown: float = 900) -> None:
+        """
+        Initialize a closed circuit.
+
+        Args:
+            threshold: Consecutive failures that open the circuit
+            cooldown: Seconds the circuit stays open the first time
+            max_cooldown: Upper bound in seconds for the doubled cooldown
+        """
+        self.threshold = threshold
+        self.min_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return self.retry_in() > 0
+
+    def retry_in(self) -> float:
+        """
+        Get the time until a call may be attempted.
+
+        Returns:
+            Seconds to wait, 0 if the circuit is closed or ready for a trial call.
+        """
+        return max(0.0, self.open_until - time.monotonic())
+
+    def success(self) -> None:
+        """
+        Record a successful call, closing the circuit.
+
+        Returns:
+            None
+        """
+        self.failures = 0
+        self.cooldown = self.min_cooldown
+        self.open_until = 0.0
+
+    def failure(self) -> bool:
+        """
+        Record a failed call, opening the circuit once failures reach the threshold.
+
+        Returns:
+            True if this failure opened the circuit
+        """
+        self.failures += 1
+        if self.failures < self.threshold:
+            return False
+        self.open_until = time.monotonic() + self.cooldown
+        self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+        return True
@@ -0,0 +1,72 @@
+import logging
+import time
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from currently_playing import SongSnapshot
+
+
+class RefreshScheduler:
+    """
+    Picks how long the main loop sleeps before its next fallback refresh.
+
+    Media session events wake the loop on their own, so the schedule only has to
+    catch what events miss, as cheaply as possible:
+
+    - while playing, wake shortly after the predicted end of the track, and at a
+      fast cadence if that moment has already passed
+    - while paused or with nothing playing, poll slowly
+    - while Apple Music is not running, back off exponentially
+    - return to the fast cadence as soon as there is activity again
+    """
+    def __init__(self, fast: float = 2, paused: float = 120, idle: float = 60, maximum: float = 300,
+                 track_end_grace: float = 1) -> None:
+        """
+        Initialize the scheduler.
+
+        Args:
+            fast: Interval in seconds used around track boundaries and when activity resumes
+            paused: Interval in seconds while the song is paused
+            idle: Interval in seconds while Apple Music runs but nothing is playing
+            maximum: Upper bound in seconds for any interval, including the backoff while Apple Music is closed
+            track_end_grace: Seconds after the predicted track end at which to wake
+        """
+        logging.info("Initializing refresh scheduler")
+        self.fast = fast
+        self.paused = paused
+        self.idle = idle
+        self.maximum = maximum
+        self.track_end_grace = track_end_grace
+        self.absent = fast
+
+    def next_interval(self, snapshot: Optional["SongSnapshot"], alive: bool, now: Optional[float] = None) -> float:
+        """
+        Get the delay until the next fallback refresh.
+
+        Args:
+            snapshot: Snapshot of the current song, or None if nothing is playing
+            alive: Whether Apple Music is running
+            now: Current Unix time, defaults to time.time()
+
+        Returns:
+            Seconds to wait for media events before refreshing anyway.
+        """
+        if not alive:
+            interval = self.absent
+            self.absent = min(self.absent * 2, self.maximum)
+            return interval
+        self.absent = self.fast
+
+        if snapshot is None:
+            return min(self.idle, self.maximum)
+        if not snapshot.playing:
+            return min(self.paused, self.maximum)
+        if snapshot.end is None:
+            return min(self.idle, self.maximum)
+
+        now = time.time() if now is None else now
+        until_end = snapshot.end - now + self.track_end_grace
+        if until_end <= 0:
+            # Past the predicted end without a track change event, so poll until it shows up
+            return self.fast
+        return min(until_end, self.maximum)
@@ -0,0 +1,466 @@
+import asyncio
+import base64
+import hashlib
+import importlib
+import json
+import logging
+import os
+import tempfile
+import local_server
+from config import SINK_FILE, SINK_FILE_FORMAT, SINK_HTTP_HOST, SINK_HTTP_ORIGINS, SINK_HTTP_PORT, SINK_PLUGINS
+from metrics import metrics
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set
+
+if TYPE_CHECKING:
+    from currently_playing import SongSnapshot
+
+# Key every WebSocket handshake is hashed with (RFC 6455)
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def now_playing(snapshot: Optional["SongSnapshot"], image: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Build the state published to sinks.
+
+    Args:
+        snapshot: Snapshot of the current song, or None if nothing is playing
+        image: Artwork link of the song, or None / 'default' if there is none yet
+
+    Returns:
+        JSON serializable dict with the same keys whether or not a song is playing.
+    """
+    if snapshot is None:
+        return dict(active=False, title=None, artist=None, album=None, playing=False, start=None, end=None,
+                    artwork=None)
+    return dict(
+        active=True,
+        title=snapshot.title,
+        artist=snapshot.artist,
+        album=snapshot.album,
+        playing=snapshot.playing,
+        start=snapshot.start,
+        end=snapshot.end,
+        artwork=image if image and image != 'default' else None,
+    )
+
+
+class Sink:
+    """
+    Consumer of the now-playing state, e.g. an overlay or a status bar widget.
+
+    Subclasses implement send(), and start() / close() if they hold resources.
+    Each sink is fed by its own SinkHub queue, so send() may be slow without
+    holding up Discord or the other sinks; states published while it runs are
+    coalesced into the newest one.
+    """
+    name = "sink"
+
+    async def start(self) -> None:
+        """
+        Acquire the sink's resources. Called once before the first state is sent.
+
+        Returns:
+            None
+        """
+
+    async def send(self, state: Dict[str, Any]) -> None:
+        """
+        Deliver a state built by now_playing().
+
+        Args:
+            state: The current now-playing state
+
+        Returns:
+            None
+        """
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """
+        Release the sink's resources.
+
+        Returns:
+            None
+        """
+
+
+class FileSink(Sink):
+    """
+    Writes the state to a file that other programs can read, e.g. an OBS text source.
+
+    Files ending in .json get the state as JSON, any other file a line formatted
+    from the state's keys. The file is written next to its destination and moved
+    over it, so readers never see a partial write.
+    """
+    name = "file"
+
+    def __init__(self, path: str, text_format: str = SINK_FILE_FORMAT) -> None:
+        """
+        Initialize the sink.
+
+        Args:
+            path: File to write
+            text_format: str.format() template for non-JSON files, e.g. "{artist} - {title}"
+        """
+        logging.info(f"Initializing file sink at {path}")
+        self.path = os.path.abspath(path)
+        self.text_format = text_format
+
+    def render(self, state: Dict[str, Any]) -> str:
+        """
+        Get the file contents for a state.
+
+        Args:
+            state: The current now-playing state
+
+        Returns:
+            JSON, or the formatted line, empty while nothing is playing.
+        """
+        if self.path.endswith('.json'):
+            return json.dumps(state)
+        if not state['active']:
+            return ''
+        return self.text_format.format(**state)
+
+    async def send(self, state: Dict[str, Any]) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.write, self.render(state))
+
+    def write(self, content: str) -> None:
+        """
+        Atomically replace the file. Runs on a worker thread.
+
+        Args:
+            content: New file contents
+
+        Returns:
+            None
+        """
+        directory = os.path.dirname(self.path)
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix='.now-playing-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                file.write(content)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            # Windows refuses the replace while a reader has the file open, the next state retries
+            logging.warning(f"Could not write now playing file {self.path}: {e}")
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+
+
+class HttpSink(Sink):
+    """
+    Serves the state as JSON over HTTP and pushes it to WebSocket clients.
+
+    GET / returns the current state, and the same path upgraded to a WebSocket
+    receives it immediately and again on every change. The server only listens on
+    the loopback interface by default. Clients that don't keep up with the pushes
+    are disconnected instead of buffering without bound.
+
+    Loopback is reachable from any page open in the user's browser, so requests
+    from web pages are checked against an allow-list of origins: only allowed
+    origins get a CORS header to read the state, and WebSocket upgrades from other
+    origins are refused. Clients that send no Origin, like scripts and native apps, are
+    always served.
+    """
+    name = "http"
+
+    def __init__(self, host: str = SINK_HTTP_HOST, port: int = SINK_HTTP_PORT or 0,
+                 origins: str = SINK_HTTP_ORIGINS, client_timeout: float = 5) -> None:
+        """
+        Initialize the sink without listening yet.
+
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, 0 to pick a free one
+            origins: Comma separated origins of web pages allowed to read the state, * for any
+            client_timeout: Seconds a client may take to send its request or accept a push
+        """
+        logging.info(f"Initializing HTTP sink on {host}:{port}")
+        self.host = host
+        self.port = port
+        self.origins = {origin.strip().rstrip('/').lower() for origin in origins.split(',') if origin.strip()}
+        self.client_timeout = client_timeout
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.body = json.dumps(now_playing(None)).encode()
+        self.clients: Set[asyncio.StreamWriter] = set()
+
+    async def start(self) -> None:
+        self.server, self.port = await local_server.listen(self.handle, self.host, self.port)
+        logging.info(f"Serving now playing state on http://{self.host}:{self.port}/")
+
+    async def send(self, state: Dict[str, Any]) -> None:
+        self.body = json.dumps(state).encode()
+        if self.clients:
+            frame = websocket_frame(self.body)
+            await asyncio.gather(*(self.push(client, frame) for client in list(self.clients)))
+
+    async def push(self, client: asyncio.StreamWriter, frame: bytes) -> None:
+        """
+        Send a frame to a WebSocket client, disconnecting it if it falls behind.
+
+        Args:
+            client: Writer of the client connection
+            frame: Encoded WebSocket frame
+
+        Returns:
+            None
+        """
+        try:
+            client.write(frame)
+            await asyncio.wait_for(client.drain(), self.client_timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            logging.info(f"Dropping now playing WebSocket client: {e!r}")
+            metrics.count('sink_clients_dropped')
+            self.clients.discard(client)
+            client.close()
+
+    def allowed(self, origin: Optional[str]) -> bool:
+        """
+        Check whether a client may read the state.
+
+        Args:
+            origin: The client's Origin header, None if it sent none
+
+        Returns:
+            True for clients without an origin and for allowed origins.
+        """
+        return origin is None or '*' in self.origins or origin.rstrip('/').lower() in self.origins
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Answer one HTTP request, or keep a WebSocket connection until the client leaves.
+
+        Args:
+            reader: Reader of the client connection
+            writer: Writer of the client connection
+
+        Returns:
+            None
+        """
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.client_timeout)
+            lines = request.decode('latin-1').split('\r\n')
+            method, path, _ = (lines[0].split(' ') + ['', ''])[:3]
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            origin = headers.get('origin')
+            websocket = headers.get('upgrade', '').lower() == 'websocket' and 'sec-websocket-key' in headers
+            if method != 'GET' or path.split('?')[0] not in ('/', '/now-playing'):
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            elif websocket and not self.allowed(origin):
+                # Browsers don't apply CORS to WebSockets, so the page's origin is refused here
+                logging.info(f"Refusing now playing WebSocket client from origin {origin}")
+                writer.write(b'HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            elif websocket:
+                await self.serve_websocket(reader, writer, headers['sec-websocket-key'])
+            else:
+                # Pages from other origins get the response without the header, which their browser hides from them
+                cors = (b'Access-Control-Allow-Origin: %s\r\nVary: Origin\r\n' % origin.encode('latin-1')
+                        if origin is not None and self.allowed(origin) else b'')
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n' + cors +
+                             b'Cache-Control: no-store\r\n'
+                             b'Content-Length: %d\r\nConnection: close\r\n\r\n' % len(self.body) + self.body)
+            await asyncio.wait_for(writer.drain(), self.client_timeout)
+        except (OSError, EOFError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                asyncio.TimeoutError) as e:
+            logging.debug(f"Now playing client failed: {e!r}")
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    async def serve_websocket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, key: str) -> None:
+        """
+        Complete the WebSocket handshake, send the current state and wait for the client to close.
+
+        Args:
+            reader: Reader of the client connection
+            writer: Writer of the client connection
+            key: The client's Sec-WebSocket-Key header
+
+        Returns:
+            None
+        """
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest())
+        writer.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n' + websocket_frame(self.body))
+        self.clients.add(writer)
+        # Clients only listen, so their frames are read and discarded until they close
+        while True:
+            opcode, payload = await read_websocket_frame(reader)
+            if opcode == 0x8:
+                writer.write(websocket_frame(payload[:2], 0x8))
+                return
+            if opcode == 0x9:
+                writer.write(websocket_frame(payload, 0xA))
+
+    async def close(self) -> None:
+        await local_server.close(self.server, self.clients)
+
+
+def websocket_frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    """
+    Encode a single unmasked WebSocket frame, as sent by servers.
+
+    Args:
+        payload: Frame payload
+        opcode: Frame type, text by default
+
+    Returns:
+        The encoded frame.
+    """
+    length = len(payload)
+    if length < 126:
+        header = bytes((0x80 | opcode, length))
+    elif length < 1 << 16:
+        header = bytes((0x80 | opcode, 126)) + length.to_bytes(2, 'big')
+    else:
+        header = bytes((0x80 | opcode, 127)) + length.to_bytes(8, 'big')
+    return header + payload
+
+
+async def read_websocket_frame(reader: asyncio.StreamReader, max_length: int = 64 * 1024) -> tuple:
+    """
+    Read one WebSocket frame sent by a client.
+
+    Args:
+        reader: Reader of the client connection
+        max_length: Largest payload accepted
+
+    Returns:
+        The frame's opcode and unmasked payload.
+    """
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), 'big')
+    elif length == 127:
+        length = int.from_bytes(await reader.readexactly(8), 'big')
+    if length > max_length:
+        raise ValueError(f"WebSocket frame of {length} bytes is too large")
+    mask = await reader.readexactly(4) if second & 0x80 else b'\0\0\0\0'
+    payload = await reader.readexactly(length)
+    return first & 0x0F, bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+
+
+class SinkHub:
+    """
+    Fans the now-playing state out to every configured sink.
+
+    Each sink gets its own single-slot queue and task: publishing never waits, a
+    state that a busy sink hasn't picked up yet is replaced by the newer one, and
+    a slow or failing sink only delays itself.
+    """
+    def __init__(self, sinks: List[Sink]) -> None:
+        """
+        Initialize the hub without starting the sinks yet.
+
+        Args:
+            sinks: Sinks to publish to
+        """
+        logging.info(f"Initializing sink hub with {len(sinks)} sink(s)")
+        self.sinks = sinks
+        self.queues: Dict[Sink, asyncio.Queue] = {}
+        self.tasks: List[asyncio.Task] = []
+        self.last: Optional[Dict[str, Any]] = None
+
+    async def start(self) -> None:
+        """
+        Start every sink and its delivery task. Sinks that fail to start are left out.
+
+        Returns:
+            None
+        """
+        for sink in self.sinks:
+            try:
+                await sink.start()
+            except Exception as e:
+                logging.error(f"Could not start {sink.name} sink, skipping it: {e!r}")
+                continue
+            queue = asyncio.Queue(maxsize=1)
+            self.queues[sink] = queue
+            self.tasks.append(asyncio.create_task(self.deliver(sink, queue)))
+
+    def publish(self, state: Dict[str, Any]) -> None:
+        """
+        Queue a state for every sink unless it equals the last one published.
+
+        Args:
+            state: State built by now_playing()
+
+        Returns:
+            None
+        """
+        if not self.queues or state == self.last:
+            return
+        self.last = state
+        for sink, queue in self.queues.items():
+            if queue.full():
+                logging.debug(f"{sink.name} sink is busy, replacing its pending state")
+                metrics.count('sink_coalesced')
+                queue.get_nowait()
+            queue.put_nowait(state)
+
+    async def deliver(self, sink: Sink, queue: asyncio.Queue) -> None:
+        """
+        Send queued states to one sink until cancelled.
+
+        Args:
+            sink: Sink to deliver to
+            queue: The sink's queue
+
+        Returns:
+            None
+        """
+        while True:
+            state = await queue.get()
+            try:
+                with metrics.span(f'sink_{sink.name}'):
+                    await sink.send(state)
+            except Exception as e:
+                logging.warning(f"{sink.name} sink failed to send state: {e!r}")
+                metrics.count('sink_failures')
+
+    async def close(self) -> None:
+        """
+        Stop delivering and close the sinks.
+
+        Returns:
+            None
+        """
+        for task in self.tasks:
+            task.cancel()
+        for sink in self.queues:
+            try:
+                await sink.close()
+            except Exception as e:
+                logging.error(f"Error closing {sink.name} sink: {e!r}")
+
+
+def configured_sinks() -> List[Sink]:
+    """
+    Create the sinks enabled in the configuration.
+
+    SINK_PLUGINS lists extra sinks as comma separated module:Class paths, created
+    without arguments.
+
+    Returns:
+        The sinks, empty if none are configured.
+    """
+    sinks: List[Sink] = []
+    if SINK_FILE:
+        sinks.append(FileSink(SINK_FILE))
+    if SINK_HTTP_PORT is not None:
+        sinks.append(HttpSink())
+    for path in filter(None, (plugin.strip() for plugin in SINK_PLUGINS.split(','))):
+        module, _, name = path.partition(':')
+        try:
+            sinks.append(getattr(importlib.import_module(module), name)())
+        except Exception as e:
+            logging.error(f"Could not load sink plugin {path}: {e!r}")
+    return sinks
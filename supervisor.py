@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from typing import Any, Coroutine, Dict
+from metrics import metrics
+
+
+class Supervisor:
+    """
+    Owns the application's background tasks and its stop signal.
+
+    Tasks started through spawn() are tracked until they finish, and failures are
+    logged rather than lost with the task. The application stops when stop() is
+    called from any thread, e.g. the tray's, which wakes the loop right away, or
+    when an essential task ends. shutdown() then cancels every task still running,
+    including artwork uploads and WinRT calls in flight, and waits a bounded time
+    for them, so nothing holds up quitting.
+
+    Must be created on the event loop it supervises.
+    """
+    def __init__(self) -> None:
+        """
+        Initialize the supervisor on the running loop, with no tasks.
+        """
+        logging.info("Initializing task supervisor")
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        self.tasks: Dict[asyncio.Task, str] = {}
+        self.essential: Dict[asyncio.Task, str] = {}
+
+    def spawn(self, name: str, coro: Coroutine[Any, Any, Any], essential: bool = False) -> asyncio.Task:
+        """
+        Run a coroutine as a supervised task.
+
+        Args:
+            name: Name of the task, used in logs
+            coro: Coroutine to run
+            essential: Whether the application stops once the task ends, e.g. the refresh loop
+
+        Returns:
+            The task, which may be cancelled on its own as well.
+        """
+        task = self.loop.create_task(coro)
+        self.tasks[task] = name
+        if essential:
+            self.essential[task] = name
+        task.add_done_callback(self.finished)
+        return task
+
+    def finished(self, task: asyncio.Task) -> None:
+        """
+        Forget a finished task, logging its failure and stopping if it was essential.
+
+        Args:
+            task: The finished task
+
+        Returns:
+            None
+        """
+        name = self.tasks.pop(task, "task")
+        essential = self.essential.pop(task, None) is not None
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Task {name} failed: {task.exception()!r}", exc_info=task.exception())
+            metrics.count('task_failures')
+        if essential and not self.stopped.is_set():
+            logging.error(f"Essential task {name} ended, stopping")
+            self.stopped.set()
+
+    def stop(self) -> None:
+        """
+        Ask the application to stop. Safe to call from any thread.
+
+        Returns:
+            None
+        """
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.stopped.set)
+
+    async def wait(self) -> None:
+        """
+        Wait until the application is asked to stop.
+
+        Returns:
+            None
+        """
+        await self.stopped.wait()
+
+    async def shutdown(self, timeout: float = 1.0) -> None:
+        """
+        Cancel every supervised task and wait for them to finish.
+
+        A task stuck in a call that ignores cancellation, such as a hung WinRT
+        operation, is abandoned after the timeout.
+
+        Args:
+            timeout: Most seconds to wait for the cancelled tasks
+
+        Returns:
+            None
+        """
+        tasks = list(self.tasks)
+        if not tasks:
+            return
+        logging.info(f"Cancelling {len(tasks)} task(s): {sorted(set(self.tasks.values()))}")
+        self.essential.clear()
+        for task in tasks:
+            task.cancel()
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            logging.warning(f"Task {self.tasks.get(task, 'task')} ignored cancellation, abandoning it")
@@ -0,0 +1,84 @@
+import enum
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    # Only needed for annotations, keeping the engine importable without the WinRT stack
+    from currently_playing import SongSnapshot
+
+
+class Transition(enum.Enum):
+    """
+    Kind of change between two consecutive song snapshots.
+    """
+    IDLE = "idle"                          # nothing was playing and still isn't
+    STOPPED = "stopped"                    # playback ended or Apple Music closed
+    NEW_TRACK = "new_track"                # a different song is playing
+    PLAYBACK_CHANGED = "playback_changed"  # same song, paused or resumed
+    SEEKED = "seeked"                      # same song still playing, timeline moved
+    UNCHANGED = "unchanged"
+
+
+class Action(enum.Enum):
+    """
+    Unit of work the main loop performs in response to a transition.
+    """
+    CONNECT = "connect"                # open the Discord RPC connection in the background
+    PUBLISH = "publish"                # send the song to Discord
+    CLEAR = "clear"                    # clear the presence and forget the song
+    FETCH_ARTWORK = "fetch_artwork"    # reuse or start resolving the song's artwork
+
+
+# Actions for each transition, in the order they must run
+TRANSITION_ACTIONS: Dict[Transition, Tuple[Action, ...]] = {
+    Transition.IDLE: (),
+    Transition.STOPPED: (Action.CLEAR,),
+    Transition.NEW_TRACK: (Action.CONNECT, Action.FETCH_ARTWORK, Action.PUBLISH),
+    Transition.PLAYBACK_CHANGED: (Action.CONNECT, Action.PUBLISH),
+    Transition.SEEKED: (Action.CONNECT, Action.PUBLISH),
+    Transition.UNCHANGED: (),
+}
+
+
+def classify(old: Optional["SongSnapshot"], new: Optional["SongSnapshot"], drift_tolerance: int = 2) -> Transition:
+    """
+    Classify the change between two snapshots.
+
+    Args:
+        old: Snapshot from the previous refresh, or None if nothing was playing
+        new: Snapshot from this refresh, or None if nothing is playing
+        drift_tolerance: Seconds the timestamps may shift before counting as a seek
+
+    Returns:
+        The transition between the two snapshots.
+    """
+    if new is None:
+        return Transition.IDLE if old is None else Transition.STOPPED
+    if old is None or old.identity != new.identity:
+        return Transition.NEW_TRACK
+    if old.playing != new.playing:
+        return Transition.PLAYBACK_CHANGED
+    # While paused the timestamps are recomputed from a frozen position, so only compare them while playing
+    if new.playing and new.drifted(old, drift_tolerance):
+        return Transition.SEEKED
+    return Transition.UNCHANGED
+
+
+def plan(old: Optional["SongSnapshot"], new: Optional["SongSnapshot"], connected: bool,
+         drift_tolerance: int = 2) -> Tuple[Transition, Tuple[Action, ...]]:
+    """
+    Compute the minimal set of actions for the change between two snapshots.
+
+    Args:
+        old: Snapshot from the previous refresh, or None if nothing was playing
+        new: Snapshot from this refresh, or None if nothing is playing
+        connected: Whether a Discord RPC connection is already open or being opened
+        drift_tolerance: Seconds the timestamps may shift before counting as a seek
+
+    Returns:
+        The transition and the actions to run for it, in order.
+    """
+    transition = classify(old, new, drift_tolerance)
+    actions = TRANSITION_ACTIONS[transition]
+    if connected:
+        actions = tuple(action for action in actions if action is not Action.CONNECT)
+    return transition, actions
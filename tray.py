@@ -1,7 +1,10 @@
 import threading
 import logging
-from pystray import Icon, MenuItem, Menu
-from PIL import Image
+from typing import TYPE_CHECKING, Any, Callable, List, Optional
+
+if TYPE_CHECKING:
+    from memory_monitor import MemoryMonitor
+    from profiler import Profiler
 
 class TrayIcon:
     """
@@ -9,50 +12,121 @@ class TrayIcon:
 
     This class creates and manages a system tray icon that displays the application
     status and provides a menu for basic actions like quitting the application.
+    pystray and PIL are only loaded by the tray thread, so the icon never delays
+    startup or the first presence update.
     """
-    def __init__(self, stop_event: threading.Event) -> None:
+    def __init__(self, stop_event: threading.Event, on_quit: Optional[Callable[[], None]] = None,
+                 stats: Optional[Callable[[], List[str]]] = None, memory: Optional["MemoryMonitor"] = None,
+                 profiler: Optional["Profiler"] = None) -> None:
         """
         Initialize the tray icon with default settings.
 
-        Creates a new tray icon with the application icon and a simple menu.
+        The icon itself is created with the application icon and a simple menu by run().
+
+        Args:
+            stop_event: Event set when the user quits from the tray menu
+            on_quit: Optional callback run after the stop event is set, used to wake the main loop
+            stats: Optional callback returning performance stats lines shown from the menu
+            memory: Optional memory monitor that can be switched on and off from the menu
+            profiler: Optional profiler whose captures can be started from the menu
         """
         logging.info("Initializing system tray icon")
         self.thread = None
         self.stop_event = stop_event
+        self.on_quit = on_quit
+        self.stats = stats
+        self.memory = memory
+        self.profiler = profiler
+        self.name = "amrp-py"
+        self.icon: Optional[Any] = None
+
+    def run(self) -> None:
+        """
+        Start the tray icon on a separate daemon thread.
+
+        This method starts the tray icon in a background thread so it doesn't
+        block the main application.
+
+        Returns:
+            None
+        """
+        logging.info("Starting tray icon in background thread")
+        self.thread = threading.Thread(target=self.serve, name="tray")
+        self.thread.daemon = True
+        self.thread.start()
+        logging.debug("Tray icon thread started")
+
+    def serve(self) -> None:
+        """
+        Create the icon and run its event loop. Runs on the tray thread.
+
+        The icon is created on the thread that runs it, as the Windows backend requires.
+
+        Returns:
+            None
+        """
+        from pystray import Icon, MenuItem, Menu
+        from PIL import Image
+
         try:
-            self.image = Image.open("assets/app-icon.png")
+            image = Image.open("assets/app-icon.png")
             logging.debug("Loaded tray icon image")
         except Exception as e:
-            logging.error(f"Failed to load tray icon image: {e}")
-            raise
+            logging.error(f"Failed to load tray icon image, running without tray icon: {e}")
+            return
 
-        self.name = "amrp-py"
+        seconds = self.profiler.seconds if self.profiler is not None else 0
         self.icon = Icon(
             self.name,
-            icon=self.image,
+            icon=image,
             title=self.name,
             menu=[
                 MenuItem('amrp-py — Running', lambda: None, enabled=False),
                 Menu.SEPARATOR,
+                MenuItem("Show stats", self.show_stats, visible=self.stats is not None),
+                MenuItem("Monitor memory", self.toggle_memory, checked=lambda item: self.memory.enabled,
+                         visible=self.memory is not None),
+                MenuItem(f"Capture profile ({seconds:g} s)", self.capture_profile,
+                         enabled=lambda item: not self.profiler.capturing, visible=self.profiler is not None),
                 MenuItem("Quit", self.quit)
             ]
         )
+        if self.stop_event.is_set():
+            return
+        self.icon.run()
 
-    def run(self) -> None:
+    def show_stats(self) -> None:
         """
-        Start the tray icon on a separate daemon thread.
+        Show the refresh cycle performance stats as a notification.
 
-        This method starts the tray icon in a background thread so it doesn't
-        block the main application.
+        The stats are also written to the log, since notifications are truncated.
 
         Returns:
             None
         """
-        logging.info("Starting tray icon in background thread")
-        self.thread = threading.Thread(target=self.icon.run)
-        self.thread.daemon = True
-        self.thread.start()
-        logging.debug("Tray icon thread started")
+        lines = self.stats()
+        logging.info("Performance stats:\n" + "\n".join(lines))
+        self.icon.notify("\n".join(lines), f"{self.name} stats")
+
+    def toggle_memory(self) -> None:
+        """
+        Switch the memory monitor on or off. Its reports are written to the log.
+
+        Returns:
+            None
+        """
+        self.memory.toggle()
+
+    def capture_profile(self) -> None:
+        """
+        Start a profile capture. The profile and its summary are written to the log directory.
+
+        Returns:
+            None
+        """
+        if self.profiler.start():
+            self.icon.notify(f"Capturing a {self.profiler.seconds:g} s profile to {self.profiler.directory}",
+                             f"{self.name} profiler")
 
     def quit(self) -> None:
         """
@@ -64,5 +138,8 @@ class TrayIcon:
             None
         """
         logging.info("Quitting application from tray icon")
-        self.icon.stop()
+        if self.icon is not None:
+            self.icon.stop()
         self.stop_event.set()
+        if self.on_quit is not None:
+            self.on_quit()
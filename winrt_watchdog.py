@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Optional
+from config import WINRT_REBUILD_AFTER, WINRT_TIMEOUT
+from metrics import metrics
+
+
+class WinRTWatchdog:
+    """
+    Deadlines for WinRT calls and a count of the ones that stalled.
+
+    Calls made through call() give up once their deadline passes, leaving the
+    caller to fall back to its last known good state. The call is cancelled but
+    not waited for, since a hung WinRT operation may ignore the cancellation.
+    Consecutive stalls are counted, and once there are `rebuild_after` of them in
+    a row the session manager handle is considered broken and should be rebuilt.
+    """
+    def __init__(self, timeout: float = WINRT_TIMEOUT, rebuild_after: int = WINRT_REBUILD_AFTER) -> None:
+        """
+        Initialize the watchdog.
+
+        Args:
+            timeout: Seconds a WinRT call may take before it counts as stalled
+            rebuild_after: Consecutive stalls after which the session manager should be rebuilt
+        """
+        logging.info(f"Initializing WinRT watchdog with a {timeout}s deadline")
+        self.timeout = timeout
+        self.rebuild_after = rebuild_after
+        self.stalls = 0
+        self.total_stalls = 0
+
+    @property
+    def needs_rebuild(self) -> bool:
+        """
+        Whether enough calls stalled in a row that the session manager should be rebuilt.
+        """
+        return self.stalls >= self.rebuild_after
+
+    async def call(self, name: str, awaitable: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """
+        Await a WinRT operation with a deadline.
+
+        Args:
+            name: Name of the call, used in logs and metrics
+            awaitable: The WinRT operation
+            timeout: Deadline in seconds, or None for the watchdog's default
+
+        Returns:
+            The operation's result.
+
+        Raises:
+            asyncio.TimeoutError: If the operation didn't complete in time
+        """
+        timeout = self.timeout if timeout is None else timeout
+        task = asyncio.ensure_future(awaitable)
+        try:
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+        finally:
+            if not task.done():
+                task.cancel()
+        if not done:
+            self.stalls += 1
+            self.total_stalls += 1
+            logging.warning(f"WinRT call {name} stalled for {timeout}s ({self.stalls} in a row, "
+                            f"{self.total_stalls} in total)")
+            metrics.count('winrt_stalls')
+            raise asyncio.TimeoutError(f"WinRT call {name} timed out after {timeout}s")
+        self.stalls = 0
+        return task.result()
+
+    def rebuilt(self) -> None:
+        """
+        Record that the session manager was rebuilt, resetting the stall count.
+
+        Returns:
+            None
+        """
+        logging.info("Session manager rebuilt")
+        metrics.count('winrt_rebuilds')
+        self.stalls = 0